@@ -0,0 +1,246 @@
+"""Admission control: per-client rate limits, an in-flight cap and load shedding
+
+Every limit here applies per worker process.
+
+- RateLimiter: token buckets per client key. The key is the X-API-Key
+  header, else the client address. Over the rate -> RateLimited (429).
+  Off unless RATE_LIMIT_PER_SEC is set.
+- AdmissionController: at most ADMISSION_MAX_IN_FLIGHT requests do work at
+  once. Requests past that wait in one of two lanes. Interactive requests
+  (single images from the UI) are admitted before any waiting bulk request,
+  and ADMISSION_INTERACTIVE_RESERVED slots are never given to bulk work. A
+  request whose expected wait exceeds ADMISSION_DEADLINE_MS is refused
+  straight away with Overloaded (503 + Retry-After) instead of queueing
+  until the gunicorn timeout. The expected wait is estimated from per-lane
+  service times (EWMA).
+
+The in-flight cap defaults to BATCH_MAX_SIZE, enough concurrent requests
+for the micro-batcher to fill a batch. Servers run ADMISSION_THREADS
+threads: the cap plus ADMISSION_WAITERS more, so a request past the cap
+holds a thread while it waits in its lane or is shed, instead of sitting
+unseen in the listen backlog or an executor queue.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", os.environ.get("BATCH_MAX_SIZE", 8)))
+# Threads beyond the cap, for requests waiting in the lanes
+ADMISSION_WAITERS = int(os.environ.get("ADMISSION_WAITERS", 8))
+ADMISSION_THREADS = max(1, ADMISSION_MAX_IN_FLIGHT) + max(1, ADMISSION_WAITERS)
+ADMISSION_INTERACTIVE_RESERVED = int(os.environ.get("ADMISSION_INTERACTIVE_RESERVED", 1))
+ADMISSION_DEADLINE_MS = float(os.environ.get("ADMISSION_DEADLINE_MS", 10000))
+# Requests per second and burst size per client key; 0 (the default) disables
+# rate limiting. Behind a proxy it needs TRUST_PROXY_HOPS, or every client
+# shares the proxy's bucket
+RATE_LIMIT_PER_SEC = float(os.environ.get("RATE_LIMIT_PER_SEC", 0))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 20))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 10000))
+
+# Weight of the newest sample in the service time average
+SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A request refused before doing any work; ``status`` is the HTTP status"""
+    status = 503
+    reason = "rejected"
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class RateLimited(AdmissionRejected):
+    status = 429
+    reason = "rate_limited"
+
+
+class Overloaded(AdmissionRejected):
+    status = 503
+    reason = "overloaded"
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1.0, now=None):
+        """Take ``cost`` tokens; returns 0.0, or the seconds until they would be available"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(float(cost), self.burst)  # a large batch still gets through on a full bucket
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per client key, least recently seen keys evicted first"""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_clients = max(1, int(max_clients))
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limited = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def check(self, key, cost=1.0):
+        """Charge ``cost`` to ``key``'s bucket; raises RateLimited when it is empty"""
+        if not self.enabled:
+            return
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            wait = bucket.take(cost)
+            if wait:
+                self._limited += 1
+        if wait:
+            raise RateLimited(f"Rate limit of {self.rate:g} requests/s exceeded, retry after {math.ceil(wait)} s",
+                              wait)
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "rate_per_sec": self.rate, "burst": self.burst,
+                    "clients": len(self._buckets), "limited": self._limited}
+
+
+class AdmissionController:
+    """Bounded in-flight work with an interactive lane ahead of bulk requests"""
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, deadline_ms=ADMISSION_DEADLINE_MS,
+                 interactive_reserved=ADMISSION_INTERACTIVE_RESERVED):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.deadline = max(0.0, float(deadline_ms)) / 1000.0
+        # Bulk work always keeps at least one slot
+        self.bulk_limit = max(1, self.max_in_flight - max(0, int(interactive_reserved)))
+        self._cond = threading.Condition()
+        self._in_flight = dict.fromkeys(LANES, 0)
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._service_time = dict.fromkeys(LANES, None)
+        self._admitted = dict.fromkeys(LANES, 0)
+        self._shed = dict.fromkeys(LANES, 0)
+
+    def _can_start(self, lane):
+        busy = sum(self._in_flight.values())
+        if lane == INTERACTIVE:
+            return busy < self.max_in_flight
+        return busy < self.max_in_flight and self._in_flight[BULK] < self.bulk_limit \
+            and not self._waiting[INTERACTIVE]
+
+    def expected_wait(self, lane):
+        """Seconds until a new ``lane`` request would start, from recent service times"""
+        with self._cond:
+            return self._expected_wait(lane)
+
+    def _expected_wait(self, lane):
+        if self._can_start(lane):
+            return 0.0
+        # Slots free up at sum(in flight / service time) per second
+        rate = sum(self._in_flight[l] / self._service_time[l] for l in LANES
+                   if self._in_flight[l] and self._service_time[l])
+        if not rate:
+            return 0.0  # nothing measured yet; the deadline still bounds the wait
+        ahead = self._waiting[INTERACTIVE] + (self._waiting[BULK] if lane == BULK else 0)
+        return (ahead + 1) / rate
+
+    def check(self, lane=INTERACTIVE, deadline=None):
+        """Raise Overloaded now if a new ``lane`` request would wait past the deadline
+
+        Lets a route shed load before reading the upload body.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        with self._cond:
+            expected = self._expected_wait(lane)
+            if expected > deadline:
+                self._shed[lane] += 1
+                raise Overloaded(f"Server is busy (expected wait {expected:.1f} s), retry later", expected)
+
+    def acquire(self, lane=INTERACTIVE, deadline=None):
+        """Wait for a slot; returns a ticket for release() or raises Overloaded
+
+        Refuses immediately when the expected wait exceeds the deadline, and
+        gives up when the deadline passes while waiting.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        with self._cond:
+            if not self._can_start(lane):
+                expected = self._expected_wait(lane)
+                if expected > deadline:
+                    self._shed[lane] += 1
+                    raise Overloaded(f"Server is busy (expected wait {expected:.1f} s), retry later", expected)
+                self._waiting[lane] += 1
+                try:
+                    while not self._can_start(lane):
+                        remaining = started + deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed[lane] += 1
+                            raise Overloaded(f"Server is busy (waited {deadline:.1f} s), retry later",
+                                             self._expected_wait(lane) or deadline)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[lane] -= 1
+                    # A departing interactive waiter may unblock bulk ones
+                    self._cond.notify_all()
+            self._in_flight[lane] += 1
+            self._admitted[lane] += 1
+        return lane, time.monotonic(), time.monotonic() - started
+
+    def release(self, ticket):
+        lane, admitted_at, _ = ticket
+        elapsed = time.monotonic() - admitted_at
+        with self._cond:
+            self._in_flight[lane] -= 1
+            previous = self._service_time[lane]
+            self._service_time[lane] = elapsed if previous is None else \
+                previous + SERVICE_TIME_ALPHA * (elapsed - previous)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, lane=INTERACTIVE, deadline=None):
+        """Hold a slot for the duration of a with block"""
+        ticket = self.acquire(lane, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "bulk_limit": self.bulk_limit,
+                "deadline_ms": self.deadline * 1000.0,
+                "lanes": {lane: {
+                    "in_flight": self._in_flight[lane],
+                    "waiting": self._waiting[lane],
+                    "admitted": self._admitted[lane],
+                    "shed": self._shed[lane],
+                    "service_time_ms": (self._service_time[lane] * 1000.0
+                                        if self._service_time[lane] is not None else None),
+                    "expected_wait_ms": self._expected_wait(lane) * 1000.0,
+                } for lane in LANES},
+            }
@@ -1,13 +1,54 @@
 """Mango Leaf Disease Detector - Flask Web UI with REST API"""
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request
 import os
 import numpy as np
-from PIL import Image
+import hmac
 import io
+import json
+import tarfile
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import calibration
+import metrics
+import model_registry
+from admission import BULK, INTERACTIVE, AdmissionController, AdmissionRejected, RateLimiter
+from embeddings import EmbeddingIndex, EmbeddingsUnavailable, perceptual_hash
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JobQueue, JobStore, QueueFullError
+from model_registry import ModelRegistry, ModelRegistryError, VersionNotLoadedError
+from model_server import RemoteModel, RemoteRegistry, wait_for_server
+from prediction_cache import PredictionCache
+import preprocessing
+import tiles
+import tta
+from preprocessing import ImageTooLargeError, StageTimer
+from uploads import (FORM_OVERHEAD_BYTES, MAX_REQUEST_BYTES, MAX_UPLOAD_BYTES, UploadRejected,
+                     UploadTooLargeError, read_image)
 
 app = Flask(__name__, template_folder='templates')
 
+# Werkzeug answers 413 past this before the body is parsed (zip/tar batches included)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+
+# Proxies in front of the app (load balancer, ingress) whose X-Forwarded-For
+# is trusted, so rate limits key on the real client address
+TRUST_PROXY_HOPS = int(os.environ.get("TRUST_PROXY_HOPS", 0))
+if TRUST_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY_HOPS)
+
+# Admission control (per worker): per-client token buckets, a bounded number
+# of requests doing work, early 503s when the queue is too long, and an
+# interactive lane ahead of bulk uploads (see admission.py)
+rate_limiter = RateLimiter()
+admission_control = AdmissionController()
+if rate_limiter.enabled and not TRUST_PROXY_HOPS:
+    print("[WARNING] RATE_LIMIT_PER_SEC is set but TRUST_PROXY_HOPS is 0 - behind a proxy "
+          "every client shares one rate limit bucket")
+
 # Disease information database
 DISEASE_INFO = {
     "Anthracnose": {
@@ -44,27 +85,419 @@ DISEASE_INFO = {
     }
 }
 
-# Try to load model
-model = None
-try:
-    import tensorflow as tf
-    from tfswin import SwinTransformerTiny224
+# DEMO_MODE=1 skips model loading (CI and benchmarks without weights)
+DEMO_MODE = os.environ.get("DEMO_MODE", "0") == "1"
+
+# Micro-batching: gather concurrent /predict requests into one forward pass
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+BATCHING = os.environ.get("BATCHING", "1") != "0"
+# Batch endpoint: images per forward pass
+PREDICT_BATCH_SIZE = int(os.environ.get("PREDICT_BATCH_SIZE", 16))
+
+# Models come from the registry - in this process, or via the shared model
+# server (gunicorn.conf.py with MODEL_SERVER=1) so workers don't each hold a
+# copy and a reload reaches every worker
+MODEL_VERSION = model_registry.default_version()
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET")
+# POST /models/reload requires "Authorization: Bearer <token>"; it is disabled when unset
+MODEL_ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN")
+registry = None
+if DEMO_MODE:
+    print("[INFO] DEMO_MODE=1 - model not loaded")
+elif MODEL_SERVER_SOCKET:
+    try:
+        server_info = wait_for_server(MODEL_SERVER_SOCKET, timeout=60)
+        if server_info["model_loaded"]:
+            registry = RemoteRegistry(RemoteModel(MODEL_SERVER_SOCKET))
+            MODEL_VERSION = registry.primary
+            print(f"[SUCCESS] Using model server at {MODEL_SERVER_SOCKET}")
+        else:
+            print("[WARNING] Model server has no model - using demo mode")
+    except Exception as e:
+        print(f"[WARNING] Could not reach model server: {e} - using demo mode")
+else:
+    # Warm every batch size this process issues: micro-batches, TTA views, tiles and /predict/batch
+    registry = ModelRegistry(model_registry.backend_loader(
+        batching=BATCHING, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS),
+        warmup_batch_sizes=model_registry.warmup_batch_sizes(
+            max(BATCH_MAX_SIZE if BATCHING else 1, tta.MAX_VIEWS), PREDICT_BATCH_SIZE,
+            min(tiles.TILES_BATCH_SIZE, tiles.TILES_MAX)))
+    try:
+        registry.configure(MODEL_VERSION, model_registry.MODEL_VERSION_B, model_registry.MODEL_AB_SPLIT)
+    except Exception as e:
+        print(f"[WARNING] {e} - using demo mode")
+        registry = None
+
+model_loaded = registry is not None
+
+# Labels for demo mode; loaded versions carry their own from metadata.json
+class_names = list(DISEASE_INFO.keys())
+
+def update_model_metrics():
+    """Model memory and per-version warmup time gauges"""
+    if registry is None:
+        metrics.MODEL_MEMORY.set(0)
+        return
+    versions = (registry.stats() or {}).get("versions", {})
+    if MODEL_SERVER_SOCKET:
+        metrics.MODEL_MEMORY.set(registry.remote.info().get("model_memory_bytes", 0))
+    else:
+        metrics.MODEL_MEMORY.set(sum(v.get("model_memory_bytes", 0) for v in versions.values()))
+    for version, info in versions.items():
+        if "warmup_seconds" in info:
+            metrics.WARMUP_SECONDS.labels(version=version).set(info["warmup_seconds"])
+
+update_model_metrics()
+
+# Prediction cache keyed by image hash + model version (not used in demo mode)
+PREDICTION_CACHE_BYTES = int(os.environ.get("PREDICTION_CACHE_BYTES", 8 * 1024 * 1024))
+PREDICTION_CACHE_DIR = os.environ.get("PREDICTION_CACHE_DIR") or None
+PREDICTION_CACHE_DISK_MAX_BYTES = int(os.environ.get("PREDICTION_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024))
+
+prediction_cache = None
+if model_loaded and PREDICTION_CACHE_BYTES > 0:
+    prediction_cache = PredictionCache(PREDICTION_CACHE_BYTES, disk_dir=PREDICTION_CACHE_DIR,
+                                       disk_max_bytes=PREDICTION_CACHE_DISK_MAX_BYTES)
+
+# Embedding index for near-duplicate reuse and similar-case search (off unless set)
+EMBEDDING_INDEX_DIR = os.environ.get("EMBEDDING_INDEX_DIR") or None
+NEAR_DUPLICATE_BITS = int(os.environ.get("NEAR_DUPLICATE_BITS", 4))
+# A hash match is only reported as a near-duplicate at this embedding cosine similarity
+NEAR_DUPLICATE_SIMILARITY = float(os.environ.get("NEAR_DUPLICATE_SIMILARITY", 0.97))
+EMBED_NEIGHBORS = int(os.environ.get("EMBED_NEIGHBORS", 5))
+
+embedding_indexes = {}
+
+# Batch endpoint: decode threads and request cap
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", 4))
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", 500))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+# Asynchronous jobs: bounded in-process worker pool, results in local SQLite
+JOBS_DB = os.environ.get("JOBS_DB", "/tmp/mango-jobs.sqlite3")
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", 1))
+JOBS_MAX_QUEUED = int(os.environ.get("JOBS_MAX_QUEUED", 8))
+JOBS_TTL_SECONDS = int(os.environ.get("JOBS_TTL_SECONDS", 3600))
+JOBS_POLL_INTERVAL = 0.5
+
+job_store = JobStore(JOBS_DB, ttl_seconds=JOBS_TTL_SECONDS)
+job_queue = JobQueue(job_store, workers=JOBS_WORKERS, max_queued=JOBS_MAX_QUEUED)
+
+def count_rejection(e):
+    """Count a refused upload by reason and return its HTTP status"""
+    if isinstance(e, ImageTooLargeError):
+        reason, status = "too_many_pixels", 413
+    else:
+        reason, status = e.reason, e.status
+    metrics.UPLOAD_REJECTIONS.labels(reason=reason).inc()
+    return status
+
+def upload_error(e):
+    """JSON error response for a refused upload, counted by reason"""
+    return jsonify({"error": str(e)}), count_rejection(e)
+
+def check_single_upload_length():
+    """413 response when a one-image request declares a body over the per-image cap"""
+    limit = MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES
+    if MAX_UPLOAD_BYTES and request.content_length and request.content_length > limit:
+        return upload_error(UploadTooLargeError(
+            f"Request is {request.content_length} bytes, limit is {MAX_UPLOAD_BYTES} bytes per image"))
+    return None
+
+def client_key(api_key, address):
+    """Rate limit key: the API key when one is sent, else the client address"""
+    return f"key:{api_key}" if api_key else f"ip:{address}"
+
+def request_lane(value):
+    """Bulk when the client asks for it (X-Priority: bulk / priority=bulk), else interactive"""
+    return BULK if (value or "").strip().lower() == BULK else INTERACTIVE
+
+def charge_client(cost=1):
+    """Take ``cost`` tokens from this client's bucket; raises admission.RateLimited"""
+    if cost > 0:
+        rate_limiter.check(client_key(request.headers.get("X-API-Key"), request.remote_addr), cost)
+
+def check_admission(lane):
+    """Cheap checks before the body is read: the client's rate limit, then the queue wait"""
+    charge_client()
+    admission_control.check(lane)
+
+def acquire_slot(lane):
+    """Wait for an in-flight slot; raises admission.Overloaded past the deadline"""
+    ticket = admission_control.acquire(lane)
+    metrics.ADMISSION_WAIT.labels(lane=lane).observe(ticket[2])
+    return ticket
+
+def run_admitted(lane, fn, *args):
+    """Run fn(*args) holding an in-flight slot"""
+    ticket = acquire_slot(lane)
+    try:
+        return fn(*args)
+    finally:
+        admission_control.release(ticket)
+
+def read_upload(stream, size_hint=None):
+    """Bytes of one uploaded image, or the UploadRejected/ImageTooLargeError refusing it"""
+    try:
+        data = read_image(stream, size_hint=size_hint)
+    except (UploadRejected, ImageTooLargeError) as e:
+        count_rejection(e)
+        return e
+    metrics.UPLOAD_BYTES.observe(len(data))
+    return data
+
+def preprocess_image(data, out=None, timer=None):
+    """Decode uploaded bytes into a (224, 224, 3) float32 model input"""
+    return preprocessing.preprocess(data, out=out, timer=timer)
+
+def select_model():
+    """LoadedModel for this request, or None in demo mode
+
+    X-Model-Version (or a model_version form field) pins a loaded version;
+    otherwise the registry's A/B split applies, sticky per X-Client-Id.
+    Raises VersionNotLoadedError for an unknown pin.
+    """
+    if registry is None:
+        return None
+    pin = request.headers.get("X-Model-Version") or request.values.get("model_version")
+    return registry.select(pin=pin, key=request.headers.get("X-Client-Id"))
+
+def cache_lookup(data, loaded):
+    """Return (cache key, cached probabilities or None) for uploaded bytes"""
+    if prediction_cache is None or loaded is None:
+        return None, None
+    key = PredictionCache.key(data, loaded.version)
+    probabilities = prediction_cache.get(key)
+    metrics.CACHE_LOOKUPS.labels(result="miss" if probabilities is None else "hit").inc()
+    return key, probabilities
+
+def cache_store(key, probabilities):
+    if prediction_cache is not None and key is not None:
+        prediction_cache.put(key, probabilities)
+
+def embedding_index(version, dim=None):
+    """EmbeddingIndex for a model version; None if disabled or not created yet
+
+    Passing ``dim`` creates the index on first use.
+    """
+    if EMBEDDING_INDEX_DIR is None:
+        return None
+    index = embedding_indexes.get(version)
+    if index is None:
+        try:
+            index = EmbeddingIndex(os.path.join(EMBEDDING_INDEX_DIR, version), dim)
+        except FileNotFoundError:
+            return None
+        index = embedding_indexes.setdefault(version, index)
+    return index
+
+def index_meta(key, filename, loaded, probabilities):
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    return {"key": key, "filename": filename, "model_version": loaded.version,
+            "disease": loaded.class_names[int(probabilities.argmax())],
+            "probabilities": probabilities.tolist()}
+
+def confirmed_duplicate(index, phash, embedding):
+    """Perceptual-hash match whose embedding also agrees, or None
+
+    The returned entry carries its cosine "similarity" to ``embedding``.
+    """
+    duplicate = index.find_duplicate(phash, NEAR_DUPLICATE_BITS)
+    if duplicate is None:
+        return None
+    similarity = index.similarity(embedding, duplicate["row"])
+    if similarity < NEAR_DUPLICATE_SIMILARITY:
+        return None
+    return {**duplicate, "similarity": similarity}
+
+def predict_with_index(data, filename, key, loaded, timer):
+    """Reuse the stored probabilities of identical bytes, else predict and index the image
+
+    A near-duplicate (hash and embedding match, different bytes) is reported
+    but never stands in for the forward pass. Returns (probabilities,
+    matching index entry or None).
+    """
+    key = key or PredictionCache.key(data, loaded.version)
+    img = preprocessing.open_image(data, timer=timer)
+    with timer.stage("phash"):
+        phash = perceptual_hash(img)
+    index = embedding_index(loaded.version)
+    if index is not None:
+        duplicate = index.find_duplicate(phash, NEAR_DUPLICATE_BITS, key=key)
+        if duplicate is not None and duplicate.get("key") == key:
+            # Same bytes indexed before, e.g. since evicted from the prediction cache
+            metrics.CACHE_LOOKUPS.labels(result="index").inc()
+            return np.asarray(duplicate["probabilities"], dtype=np.float32), {**duplicate, "similarity": 1.0}
     
-    model_path = os.path.join(os.getcwd(), "saved_models", "7", "model.keras")
-    if os.path.exists(model_path):
-        model = tf.keras.models.load_model(model_path)
-        print("[SUCCESS] Model loaded successfully")
+    img_array = preprocessing.preprocess_into(img, preprocessing.allocate_batch(1)[0], timer=timer)
+    with timer.stage("model"):
+        try:
+            embeddings, probabilities = loaded.embed(img_array[np.newaxis])
+        except EmbeddingsUnavailable:
+            return predict_probabilities(loaded, img_array), None
+    with timer.stage("index"):
+        index = embedding_index(loaded.version, dim=embeddings.shape[-1])
+        duplicate = confirmed_duplicate(index, phash, embeddings[0])
+        index.add(embeddings[0], phash, index_meta(key, filename, loaded, probabilities[0]))
+    return probabilities[0], duplicate
+
+def predict_probabilities(loaded, img_array):
+    """Run one forward pass and return the probability vector for one image"""
+    return loaded.predict_one(img_array)
+
+def demo_probabilities():
+    """Random probability vector for demo mode (no model weights)"""
+    import random
+    probabilities = np.array([random.uniform(0.01, 0.3) for _ in class_names])
+    probabilities[random.randint(0, len(class_names) - 1)] = random.uniform(0.8, 1.0)
+    return probabilities
+
+def confidence_band(confidence):
+    """Confidence band name: Very High, High, Moderate or Low"""
+    if confidence > 0.9:
+        return "Very High"
+    elif confidence > 0.7:
+        return "High"
+    elif confidence > 0.5:
+        return "Moderate"
+    return "Low"
+
+def confidence_text_for(confidence):
+    """Human readable confidence band"""
+    return f"{confidence_band(confidence)} Confidence ({confidence*100:.1f}%)"
+
+def server_timing(timer):
+    """Per-stage durations as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in timer.timings.items())
+
+def predict_views(data, n_views, timer, loaded):
+    """Test-time augmentation: all views of one image in a single forward pass
+
+    Returns (averaged probabilities, TTA summary for the response).
+    """
+    img = preprocessing.open_image(data, size=tta.DECODE_SIZE, timer=timer)
+    names, batch = tta.build_views(img, n_views, timer=timer)
+    with timer.stage("model"):
+        if loaded is None:
+            view_probabilities = np.stack([demo_probabilities() for _ in names])
+        else:
+            view_probabilities = loaded.predict(batch)
+    probabilities, agreement, view_top = tta.aggregate(view_probabilities)
+    labels = loaded.class_names if loaded is not None else class_names
+    summary = {
+        "views": len(names),
+        "agreement": agreement,
+        "per_view": [
+            {"view": name, "disease": labels[int(top)], "confidence": float(probs[top])}
+            for name, top, probs in zip(names, view_top, view_probabilities)
+        ]
+    }
+    return probabilities, summary
+
+def predict_tiles(data, max_tiles, timer, loaded):
+    """Tiled analysis: overlapping 224 px windows classified in large batches
+
+    Returns (leaf probabilities, tile summary with the heatmap grid).
+    """
+    labels = loaded.class_names if loaded is not None else class_names
+    if loaded is None:
+        predict = lambda batch: np.stack([demo_probabilities() for _ in batch])
     else:
-        print("[WARNING] Model file not found - using demo mode")
-except Exception as e:
-    print(f"[WARNING] Could not load model: {e} - using demo mode")
+        predict = loaded.predict
+    return tiles.analyze(data, predict, labels, max_tiles=max_tiles, timer=timer)
 
-class_names = list(DISEASE_INFO.keys())
+def calibrate_batch(probabilities, loaded):
+    """Calibrate an (N, classes) batch with the version's temperature in one call"""
+    return calibration.calibrate(probabilities, calibration.temperature_for(loaded.version))
+
+def build_prediction(probabilities, loaded=None, calibrated=False):
+    """Build the /predict response body from a single probability vector
+
+    ``loaded`` is the LoadedModel that produced it (None in demo mode, where
+    the random vector is not calibrated). Raw vectors are calibrated here
+    unless ``calibrated`` says the caller already did it for a whole batch.
+    """
+    labels = loaded.class_names if loaded is not None else class_names
+    if loaded is not None and not calibrated:
+        probabilities = calibrate_batch(probabilities, loaded)
+    probabilities = np.asarray(probabilities)
+    predicted_idx = int(np.argmax(probabilities))
+    predicted_class = labels[predicted_idx]
+    confidence = float(probabilities[predicted_idx])
+    
+    # Ranked list from the same calibrated vector, so it agrees with confidence
+    ranked = np.argsort(-probabilities, kind="stable")
+    predictions_list = [
+        {"class": labels[i], "confidence": float(probabilities[i])}
+        for i in ranked
+    ]
+    
+    band = confidence_band(confidence)
+    metrics.record_prediction(predicted_class, band)
+    
+    disease_info = DISEASE_INFO.get(predicted_class, {})
+    return {
+        "disease": predicted_class,
+        "confidence": confidence,
+        "confidence_text": confidence_text_for(confidence),
+        "description": disease_info.get("description", "No description available"),
+        "treatment": disease_info.get("treatment", "No treatment information available"),
+        "all_predictions": predictions_list,
+        "model_version": loaded.version if loaded is not None else None
+    }
+
+def run_prediction(stream, filename, n_views, loaded, timer, max_tiles=None):
+    """/predict body shared with asgi.py: read one upload and return the response dict
+
+    ``max_tiles`` switches to tiled analysis. Raises UploadRejected or
+    ImageTooLargeError for refused uploads.
+    """
+    # Capped, sniffed read: non-images and oversized headers stop here
+    data = read_image(stream)
+    metrics.UPLOAD_BYTES.observe(len(data))
+    if max_tiles:
+        # Tiled high-resolution analysis - leaf verdict plus heatmap, not cached
+        probabilities, summary = predict_tiles(data, max_tiles, timer, loaded)
+        result = build_prediction(probabilities, loaded)
+        result["tiles"] = summary
+    elif n_views > 1:
+        # Test-time augmentation - averaged views, not cached
+        probabilities, summary = predict_views(data, n_views, timer, loaded)
+        result = build_prediction(probabilities, loaded)
+        result["tta"] = summary
+    elif loaded is None:
+        # Demo mode - return random prediction
+        preprocess_image(data, timer=timer)  # still reject undecodable uploads
+        with timer.stage("model"):
+            result = build_prediction(demo_probabilities())
+    else:
+        # Same bytes already classified by this model version?
+        key, probabilities = cache_lookup(data, loaded)
+        duplicate = None
+        if probabilities is None and EMBEDDING_INDEX_DIR is not None:
+            # Identical bytes already indexed? Otherwise predict and index this one
+            probabilities, duplicate = predict_with_index(data, filename, key, loaded, timer)
+            cache_store(key, probabilities)
+        elif probabilities is None:
+            # Real prediction - one forward pass feeds top-1 and all_predictions
+            img_array = preprocess_image(data, timer=timer)
+            with timer.stage("model"):
+                probabilities = predict_probabilities(loaded, img_array)
+            cache_store(key, probabilities)
+        result = build_prediction(probabilities, loaded)
+        if duplicate is not None:
+            result["near_duplicate_of"] = {"filename": duplicate.get("filename"), "key": duplicate.get("key"),
+                                           "hash_distance": duplicate["hash_distance"],
+                                           "similarity": duplicate["similarity"]}
+    return result
 
 @app.route("/", methods=["GET"])
 def home():
     """Serve the web UI"""
-    return render_template('index.html')
+    return render_template('index.html', upload_size=preprocessing.IMAGE_SIZE)
 
 @app.route("/api", methods=["GET"])
 def api_info():
@@ -77,19 +510,138 @@ def api_info():
         "endpoints": {
             "GET /": "Web UI interface",
             "GET /api": "This information",
-            "POST /predict": "Predict disease from uploaded image",
-            "GET /health": "Health check"
+            "POST /predict": "Predict disease from uploaded image (tta=<views> for test-time augmentation, "
+                             "tiles=<max tiles> for tiled analysis with a heatmap)",
+            "POST /embed": "Leaf embedding and the most similar indexed images (index=1 to add it)",
+            "POST /predict/batch": "Predict many images (files or zip/tar), streamed as NDJSON",
+            "POST /jobs": "Queue a prediction job (same inputs as /predict/batch)",
+            "GET /jobs/<id>": "Job status and results",
+            "GET /jobs/<id>/events": "Job progress as server-sent events",
+            "GET /models": "Model versions on disk and current routing",
+            "POST /models/reload": "Load and hot-swap model versions (JSON: version, version_b, split)",
+            "GET /health": "Liveness check",
+            "GET /ready": "Readiness: 200 once the model is loaded and warmed up",
+            "GET /stats": "Inference statistics",
+            "GET /metrics": "Prometheus metrics"
         }
     })
 
+def readiness():
+    """(ready, detail) - ready once the routed versions are loaded and warmed
+
+    Demo mode is ready by design; a failed model load never is.
+    """
+    if DEMO_MODE:
+        return True, {"demo_mode": True}
+    if registry is None:
+        return False, {"reason": "model failed to load"}
+    try:
+        stats = registry.stats() or {}
+    except Exception as e:
+        return False, {"reason": f"model server unreachable: {e}"}
+    versions = stats.get("versions", {})
+    routed = [v for v in (stats.get("primary"), stats.get("secondary")) if v]
+    cold = [v for v in routed if "warmup_seconds" not in versions.get(v, {})]
+    if not routed or cold:
+        return False, {"reason": "model warming up", "versions": cold}
+    return True, {"warmup_seconds": {v: versions[v]["warmup_seconds"] for v in routed}}
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 only after the model is warmed at every serving batch size"""
+    is_ready, detail = readiness()
+    return jsonify({"ready": is_ready, **detail}), 200 if is_ready else 503
+
 @app.route("/health", methods=["GET"])
 def health():
-    """Health check"""
-    return jsonify({"status": "healthy", "ready": True, "model_loaded": model is not None}), 200
+    """Liveness check (always 200 while the process serves requests); see /ready"""
+    return jsonify({
+        "status": "healthy",
+        "ready": readiness()[0],
+        "model_loaded": model_loaded,
+        "prediction_cache": prediction_cache.stats() if prediction_cache is not None else None,
+        "jobs": job_queue.stats()
+    }), 200
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus metrics, aggregated across gunicorn workers"""
+    body, content_type = metrics.render()
+    if body is None:
+        return jsonify({"error": "prometheus_client is not installed"}), 503
+    return Response(body, mimetype=content_type.split(";")[0], content_type=content_type)
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Inference statistics for tuning the latency/throughput trade-off"""
+    return jsonify({
+        "model_loaded": model_loaded,
+        "model_version": registry.primary if registry is not None else None,
+        "models": registry.stats() if registry is not None else None,
+        "prediction_cache": prediction_cache.stats() if prediction_cache is not None else None,
+        "jobs": job_queue.stats(),
+        "admission": {**admission_control.stats(), "rate_limit": rate_limiter.stats()}
+    })
+
+@app.route("/models", methods=["GET"])
+def list_models():
+    """Versions on disk and which ones are serving traffic"""
+    return jsonify({
+        "available": model_registry.discover_versions(),
+        "routing": registry.routing() if registry is not None else None
+    })
+
+@app.route("/models/reload", methods=["POST"])
+def reload_models():
+    """Load new version(s), warm them up, then swap without dropping requests
+
+    JSON body (all optional): {"version": "8", "version_b": "9", "split": 0.1};
+    version defaults to the newest on disk. With the shared model server the
+    swap applies to every worker, otherwise to this process only. Disabled
+    unless MODEL_ADMIN_TOKEN is set.
+    """
+    if not MODEL_ADMIN_TOKEN:
+        return jsonify({"error": "Model reloads are disabled (MODEL_ADMIN_TOKEN is not set)"}), 403
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(),
+                               f"Bearer {MODEL_ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+    if registry is None:
+        return jsonify({"error": "No model registry (demo mode)"}), 503
+    
+    body = request.get_json(silent=True) or {}
+    version = body.get("version") or model_registry.latest_version()
+    if version is None:
+        return jsonify({"error": "No model versions found"}), 404
+    # Versions become path components: only numeric directories that exist
+    version = str(version)
+    version_b = str(body["version_b"]) if body.get("version_b") is not None else None
+    available = model_registry.discover_versions()
+    for requested in (version, version_b):
+        if requested is not None and not (requested.isdigit() and requested in available):
+            return jsonify({"error": f"Unknown model version {requested!r}", "available": available}), 400
+    try:
+        split = float(body.get("split", 0.0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "split must be a number between 0 and 1"}), 400
+    
+    started = time.perf_counter()
+    try:
+        routing = registry.configure(version, version_b, split)
+    except ModelRegistryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Reload failed, still serving the previous version: {e}"}), 500
+    update_model_metrics()
+    return jsonify({"routing": routing, "reload_seconds": time.perf_counter() - started})
 
 @app.route("/predict", methods=["POST"])
 def predict():
     """Predict disease from uploaded image"""
+    lane = request_lane(request.headers.get("X-Priority") or request.args.get("priority"))
+    check_admission(lane)
+    rejected = check_single_upload_length()
+    if rejected is not None:
+        return rejected
     try:
         # Check if file was uploaded
         if 'file' not in request.files:
@@ -99,74 +651,409 @@ def predict():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Read and process image
-        img = Image.open(io.BytesIO(file.read())).convert('RGB')
-        img = img.resize((224, 224))
-        img_array = np.array(img) / 255.0
+        try:
+            n_views = tta.parse_views(request.values.get('tta'))
+            max_tiles = tiles.parse_tiles(request.values.get('tiles'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if max_tiles and n_views > 1:
+            return jsonify({"error": "tta and tiles cannot be combined"}), 400
         
-        if model is None:
-            # Demo mode - return random prediction
-            import random
-            predicted_idx = random.randint(0, len(class_names) - 1)
-            predicted_class = class_names[predicted_idx]
-            confidence = random.uniform(0.8, 1.0)
-        else:
-            # Real prediction
-            img_batch = np.expand_dims(img_array, axis=0)
-            predictions = model.predict(img_batch, verbose=0)
-            predicted_idx = np.argmax(predictions[0])
-            predicted_class = class_names[predicted_idx]
-            confidence = float(predictions[0][predicted_idx])
-            
-            # Temperature scaling for calibration
-            T = 0.15
-            confidence = 1.0 / (1.0 + np.exp(-np.log(confidence / (1 - confidence + 1e-7)) / T))
+        try:
+            loaded = select_model()
+        except VersionNotLoadedError as e:
+            return jsonify({"error": str(e.args[0])}), 400
         
-        # Get disease info
-        disease_info = DISEASE_INFO.get(predicted_class, {})
+        timer = StageTimer()
+        result = run_admitted(lane, run_prediction, file.stream, file.filename, n_views, loaded, timer, max_tiles)
         
-        # Prepare all predictions
-        if model is None:
-            predictions_list = [
-                {"class": class_names[i], "confidence": random.uniform(0.01, 0.3)} 
-                for i in range(len(class_names))
-            ]
-            predictions_list[predicted_idx]["confidence"] = confidence
-            predictions_list = sorted(predictions_list, key=lambda x: x["confidence"], reverse=True)
+        with timer.stage("json"):
+            response = jsonify(result)
+        response.headers["Server-Timing"] = server_timing(timer)
+        if result["model_version"] is not None:
+            response.headers["X-Model-Version"] = result["model_version"]
+        metrics.observe_stages(timer.timings)
+        return response
+    
+    except (UploadRejected, ImageTooLargeError) as e:
+        return upload_error(e)
+    except (RequestEntityTooLarge, AdmissionRejected):
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/embed", methods=["POST"])
+def embed():
+    """Leaf embedding (pooled backbone features) and its nearest indexed neighbours"""
+    check_admission(INTERACTIVE)
+    rejected = check_single_upload_length()
+    if rejected is not None:
+        return rejected
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({"error": "No file uploaded"}), 400
+    file = request.files['file']
+    try:
+        loaded = select_model()
+    except VersionNotLoadedError as e:
+        return jsonify({"error": str(e.args[0])}), 400
+    if loaded is None:
+        return jsonify({"error": "Embeddings need a loaded model (demo mode)"}), 503
+    
+    try:
+        k = max(0, int(request.values.get("k", EMBED_NEIGHBORS)))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    add = request.values.get("index", "0").lower() in ("1", "true", "yes")
+    include_vector = request.values.get("vector", "1").lower() not in ("0", "false", "no")
+    
+    def compute():
+        data = read_image(file.stream)
+        img = preprocessing.open_image(data, timer=timer)
+        img_array = preprocessing.preprocess_into(img, preprocessing.allocate_batch(1)[0], timer=timer)
+        with timer.stage("model"):
+            return (data, img, *loaded.embed(img_array[np.newaxis]))
+    
+    timer = StageTimer()
+    try:
+        data, img, embeddings, probabilities = run_admitted(INTERACTIVE, compute)
+    except AdmissionRejected:
+        raise
+    except EmbeddingsUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except (UploadRejected, ImageTooLargeError) as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    embedding = embeddings[0]
+    phash = perceptual_hash(img)
+    result = {"model_version": loaded.version, "dim": int(embedding.shape[-1]),
+              "perceptual_hash": f"{phash:016x}", "near_duplicate_of": None, "neighbors": []}
+    with timer.stage("index"):
+        index = embedding_index(loaded.version, dim=embedding.shape[-1] if add else None)
+        if index is not None:
+            result["near_duplicate_of"] = confirmed_duplicate(index, phash, embedding)
+            result["neighbors"] = index.search(embedding, k) if k else []
+            for entry in [result["near_duplicate_of"], *result["neighbors"]]:
+                if entry is not None:
+                    entry.pop("probabilities", None)
+            if add:
+                key = PredictionCache.key(data, loaded.version)
+                result["row"] = index.add(embedding, phash, index_meta(key, file.filename, loaded, probabilities[0]))
+    if include_vector:
+        result["embedding"] = embedding.astype(float).tolist()
+    
+    response = jsonify(result)
+    response.headers["Server-Timing"] = server_timing(timer)
+    response.headers["X-Model-Version"] = loaded.version
+    return response
+
+def detach_uploads(files):
+    """Take ownership of upload streams so they outlive the request
+
+    Flask closes request.files when the view returns, before a streamed
+    response body has been generated.
+    """
+    uploads = []
+    for file in files:
+        uploads.append((file.filename, file.stream))
+        file.stream = io.BytesIO()
+    return uploads
+
+def iter_uploaded_images(uploads):
+    """Yield (filename, bytes or rejection error) for uploaded images, expanding zip/tar archives"""
+    for name, stream in uploads:
+        lower = name.lower()
+        if lower.endswith(".zip"):
+            with zipfile.ZipFile(stream) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and is_image_name(member.filename):
+                        with archive.open(member) as member_stream:
+                            yield member.filename, read_upload(member_stream, size_hint=member.file_size)
+        elif lower.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+            with tarfile.open(fileobj=stream, mode="r:*") as archive:
+                for member in archive:
+                    if member.isfile() and is_image_name(member.name):
+                        yield member.name, read_upload(archive.extractfile(member), size_hint=member.size)
         else:
-            predictions_batch = model.predict(img_batch, verbose=0)
-            predictions_list = [
-                {"class": class_names[i], "confidence": float(predictions_batch[0][i])}
-                for i in range(len(class_names))
-            ]
-            predictions_list = sorted(predictions_list, key=lambda x: x["confidence"], reverse=True)
-        
-        # Determine confidence text
-        if confidence > 0.9:
-            confidence_text = f"Very High Confidence ({confidence*100:.1f}%)"
-        elif confidence > 0.7:
-            confidence_text = f"High Confidence ({confidence*100:.1f}%)"
-        elif confidence > 0.5:
-            confidence_text = f"Moderate Confidence ({confidence*100:.1f}%)"
+            yield name, read_upload(stream)
+
+def is_image_name(name):
+    """Archive members worth decoding (skips macOS metadata and hidden files)"""
+    base = os.path.basename(name)
+    return not base.startswith(".") and "__MACOSX" not in name and base.lower().endswith(IMAGE_EXTENSIONS)
+
+def iter_decoded_batches(images, batch_size, loaded):
+    """Decode images in parallel, yielding (buffer, entries) per batch
+
+    Each entry is (filename, key, cached, future, timer); decode threads write
+    straight into their slot of the preallocated float32 buffer. Cache hits
+    are not decoded. The next batch is submitted for decoding before the
+    current one is handed to the model, so decode overlaps the forward pass.
+    """
+    pending = None
+    buffer, chunk = preprocessing.allocate_batch(batch_size), []
+    for name, data in images:
+        future, timer = None, StageTimer()
+        if isinstance(data, Exception):
+            # Refused upload: report it in this image's slot, nothing to decode
+            key, cached, future = None, None, Future()
+            future.set_exception(data)
         else:
-            confidence_text = f"Low Confidence ({confidence*100:.1f}%)"
+            key, cached = cache_lookup(data, loaded)
+        if cached is None and future is None:
+            future = decode_executor.submit(preprocess_image, data, buffer[len(chunk)], timer)
+        chunk.append((name, key, cached, future, timer))
+        if len(chunk) == batch_size:
+            if pending:
+                yield pending
+            pending = (buffer, chunk)
+            buffer, chunk = preprocessing.allocate_batch(batch_size), []
+    if pending:
+        yield pending
+    if chunk:
+        yield buffer, chunk
+
+def limit_images(images, limit, summary):
+    """The first ``limit`` images; sets summary["truncated"] when there were more"""
+    for count, image in enumerate(images):
+        if count == limit:
+            summary["truncated"] = True
+            return
+        yield image
+
+def iter_batch_results(uploads, batch_size, timings, loaded, summary=None):
+    """Yield one result dict per uploaded image, batching the forward passes
+
+    Every image is served by ``loaded``, so a hot reload mid-request does not
+    mix versions within one response. Images past BATCH_MAX_IMAGES (archives
+    can hold any number) are not processed; ``summary["truncated"]`` is then
+    set to True.
+    """
+    index = 0
+    summary = {} if summary is None else summary
+    summary.setdefault("truncated", False)
+    images = limit_images(iter_uploaded_images(uploads), BATCH_MAX_IMAGES, summary)
+    for buffer, batch in iter_decoded_batches(images, batch_size, loaded):
+        results = [None] * len(batch)
+        positions = []
+        for i, (name, key, cached, future, timer) in enumerate(batch):
+            if cached is not None:
+                results[i] = build_prediction(cached, loaded)
+                continue
+            try:
+                future.result()
+                positions.append(i)
+                metrics.observe_stages(timer.timings)
+                for stage, ms in timer.timings.items():
+                    timings.timings[stage] = timings.timings.get(stage, 0.0) + ms
+            except (UploadRejected, ImageTooLargeError) as e:
+                results[i] = {"error": str(e)}
+            except Exception as e:
+                results[i] = {"error": f"Could not decode image: {e}"}
+        
+        if positions:
+            # Only gather when cache hits or failed decodes left holes
+            if positions == list(range(len(positions))):
+                arrays = buffer[:len(positions)]
+            else:
+                arrays = buffer[positions]
+            try:
+                started = time.perf_counter()
+                with timings.stage("model"):
+                    if loaded is None:
+                        probabilities = [demo_probabilities() for _ in positions]
+                    else:
+                        probabilities = loaded.predict(arrays)
+                metrics.MODEL_TIME.labels(route="batch").observe(time.perf_counter() - started)
+                for i, probs in zip(positions, probabilities):
+                    cache_store(batch[i][1], probs)
+                if loaded is not None:
+                    probabilities = calibrate_batch(probabilities, loaded)
+                for i, probs in zip(positions, probabilities):
+                    results[i] = build_prediction(probs, loaded, calibrated=True)
+            except Exception as e:
+                for i in positions:
+                    results[i] = {"error": str(e)}
         
-        return jsonify({
-            "disease": predicted_class,
-            "confidence": confidence,
-            "confidence_text": confidence_text,
-            "description": disease_info.get("description", "No description available"),
-            "treatment": disease_info.get("treatment", "No treatment information available"),
-            "all_predictions": predictions_list
-        })
+        for (name, _, _, _, _), result in zip(batch, results):
+            yield {"index": index, "filename": name, **result}
+            index += 1
+
+def parse_batch_request():
+    """Return (uploaded files, batch size, model) or (None, error response, None)"""
+    files = request.files.getlist('files') + request.files.getlist('file')
+    files = [f for f in files if f.filename]
+    if not files:
+        return None, (jsonify({"error": "No files uploaded"}), 400), None
+    if len(files) > BATCH_MAX_IMAGES:
+        return None, (jsonify({"error": f"{len(files)} files uploaded, the limit is {BATCH_MAX_IMAGES} "
+                                        "images per request"}), 413), None
     
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    try:
+        batch_size = int(request.form.get("batch_size", PREDICT_BATCH_SIZE))
+    except ValueError:
+        return None, (jsonify({"error": "batch_size must be an integer"}), 400), None
+    try:
+        loaded = select_model()
+    except VersionNotLoadedError as e:
+        return None, (jsonify({"error": str(e.args[0])}), 400), None
+    return files, max(1, min(batch_size, PREDICT_BATCH_SIZE * 4)), loaded
+
+def close_uploads(uploads):
+    for _, stream in uploads:
+        stream.close()
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Predict many images per request, streaming one NDJSON line per image"""
+    admission_control.check(BULK)
+    files, batch_size, loaded = parse_batch_request()
+    # One charge per batch, a token per image (capped at the bucket size)
+    charge_client(len(files) if files is not None else 1)
+    if files is None:
+        return batch_size
+    
+    # The bulk slot is held until the stream has been sent
+    ticket = acquire_slot(BULK)
+    try:
+        uploads = detach_uploads(files)
+    except Exception:
+        admission_control.release(ticket)
+        raise
+    
+    def generate():
+        count = errors = 0
+        timings = StageTimer()
+        summary = {}
+        try:
+            for result in iter_batch_results(uploads, batch_size, timings, loaded, summary):
+                count += 1
+                errors += "error" in result
+                with timings.stage("json"):
+                    line = json.dumps(result) + "\n"
+                yield line
+        finally:
+            close_uploads(uploads)
+        yield json.dumps({"done": True, "count": count, "errors": errors,
+                          "truncated": summary["truncated"], "max_images": BATCH_MAX_IMAGES,
+                          "model_version": loaded.version if loaded is not None else None,
+                          "timings_ms": timings.timings}) + "\n"
+    
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.call_on_close(lambda: admission_control.release(ticket))
+    if loaded is not None:
+        response.headers["X-Model-Version"] = loaded.version
+    return response
+
+def run_job(job_id, uploads, batch_size, loaded):
+    """Background job body: store each image's result as it completes"""
+    summary = {}
+    for result in iter_batch_results(uploads, batch_size, StageTimer(), loaded, summary):
+        job_store.add_result(job_id, result["index"], result)
+    if summary["truncated"]:
+        return f"Only the first {BATCH_MAX_IMAGES} images were processed (BATCH_MAX_IMAGES)"
+    return None
+
+def job_urls(job_id):
+    return {"status_url": f"/jobs/{job_id}", "events_url": f"/jobs/{job_id}/events"}
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a prediction job for large uploads; returns a job id immediately"""
+    # Jobs are bounded by the job queue, so only the client's rate limit applies
+    files, batch_size, loaded = parse_batch_request()
+    charge_client(len(files) if files is not None else 1)
+    if files is None:
+        return batch_size
+    
+    uploads = detach_uploads(files)
+    try:
+        job_id = job_queue.submit(run_job, uploads, batch_size, loaded,
+                                  cleanup=lambda: close_uploads(uploads))
+    except QueueFullError as e:
+        close_uploads(uploads)
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    
+    response = jsonify({"job_id": job_id, "status": JOB_QUEUED, **job_urls(job_id)})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status, plus results completed so far"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    job["results"] = [result for _, result in job_store.results(job_id)]
+    job.update(job_urls(job_id))
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-sent events: one 'result' event per image, then 'done'"""
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    
+    def generate():
+        last_index = -1
+        last_status = None
+        while True:
+            job = job_store.get(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job expired\"}\n\n"
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            for index, result in job_store.results(job_id, after=last_index):
+                last_index = index
+                yield f"event: result\ndata: {json.dumps(result)}\n\n"
+            if job["status"] in (JOB_DONE, JOB_FAILED):
+                yield f"event: done\ndata: {json.dumps(job)}\n\n"
+                return
+            time.sleep(JOBS_POLL_INTERVAL)
+    
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_LATENCY.labels(endpoint=endpoint, status=response.status_code).observe(
+            time.perf_counter() - started)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if g.pop("request_started", None) is not None:
+        metrics.IN_FLIGHT.dec()
 
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Endpoint not found"}), 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    metrics.UPLOAD_REJECTIONS.labels(reason="request_too_large").inc()
+    return jsonify({"error": f"Request body is larger than the {MAX_REQUEST_BYTES} byte limit"}), 413
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(error):
+    metrics.ADMISSION_REJECTIONS.labels(reason=error.reason).inc()
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, error.status
+
 @app.errorhandler(500)
 def server_error(error):
     return jsonify({"error": "Internal server error"}), 500
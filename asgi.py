@@ -0,0 +1,180 @@
+"""ASGI entry point: uploads received on the event loop, CPU work on a thread pool
+
+    SERVER_MODE=asgi gunicorn --config gunicorn.conf.py
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+POST /predict is a native async route. The multipart body is received
+without holding a thread, so a slow mobile upload costs a socket and a
+spooled buffer, not one of a handful of gthread slots. Once the upload is
+complete, decode and inference (app.run_prediction) run on ASGI_CPU_WORKERS
+threads, holding one of app.py's admission-control slots. Every other route (/, /api, /health, /predict/batch, /jobs, ...)
+is the Flask app mounted through a2wsgi.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as web
+import metrics
+from admission import ADMISSION_THREADS, AdmissionRejected
+import tiles
+import tta
+from model_registry import VersionNotLoadedError
+from preprocessing import ImageTooLargeError, StageTimer
+from uploads import FORM_OVERHEAD_BYTES, MAX_UPLOAD_BYTES, UploadRejected, UploadTooLargeError
+
+# Threads for decode + inference. Admission control bounds the work to
+# ADMISSION_MAX_IN_FLIGHT; the extra threads wait in its lanes (or are shed)
+# instead of in the executor queue
+ASGI_CPU_WORKERS = int(os.environ.get("ASGI_CPU_WORKERS", ADMISSION_THREADS))
+# Threads running the mounted Flask routes (/predict/batch and /embed are admitted too)
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", ADMISSION_THREADS))
+
+cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix="asgi-cpu")
+
+
+def capped_receive(receive, max_bytes):
+    """Wrap an ASGI receive so a body past max_bytes raises UploadTooLargeError
+
+    Catches chunked uploads that send no Content-Length.
+    """
+    received = 0
+
+    async def wrapped():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise UploadTooLargeError(f"Request is larger than {MAX_UPLOAD_BYTES} bytes per image")
+        return message
+    return wrapped
+
+
+def error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def admission_error(e):
+    metrics.ADMISSION_REJECTIONS.labels(reason=e.reason).inc()
+    return JSONResponse({"error": str(e), "retry_after": e.retry_after}, status_code=e.status,
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+def client_address(request):
+    """Client address resolved like app.py's ProxyFix
+
+    With TRUST_PROXY_HOPS set, the X-Forwarded-For entry that many hops from
+    the right (added by the trusted proxies), else the socket peer.
+    """
+    hops = web.TRUST_PROXY_HOPS
+    if hops:
+        forwarded = [value.strip() for value in ",".join(request.headers.getlist("x-forwarded-for")).split(",")]
+        if len(forwarded) >= hops and forwarded[-hops]:
+            return forwarded[-hops]
+    return request.client.host if request.client else None
+
+
+async def handle_predict(request):
+    # Rate limit and queue-wait shedding before the body is received
+    lane = web.request_lane(request.headers.get("x-priority") or request.query_params.get("priority"))
+    try:
+        web.rate_limiter.check(web.client_key(request.headers.get("x-api-key"), client_address(request)))
+        web.admission_control.check(lane)
+    except AdmissionRejected as e:
+        return admission_error(e)
+
+    limit = MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES
+    length = request.headers.get("content-length", "")
+    if MAX_UPLOAD_BYTES and length.isdigit() and int(length) > limit:
+        e = UploadTooLargeError(f"Request is {length} bytes, limit is {MAX_UPLOAD_BYTES} bytes per image")
+        return error(str(e), web.count_rejection(e))
+    if MAX_UPLOAD_BYTES:
+        request = Request(request.scope, capped_receive(request.receive, limit))
+
+    try:
+        form = await request.form(max_files=1, max_fields=16)
+    except UploadTooLargeError as e:
+        return error(str(e), web.count_rejection(e))
+    try:
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return error("No file uploaded", 400)
+        if not file.filename:
+            return error("No file selected", 400)
+
+        try:
+            n_views = tta.parse_views(request.query_params.get("tta", form.get("tta")))
+            max_tiles = tiles.parse_tiles(request.query_params.get("tiles", form.get("tiles")))
+        except ValueError as e:
+            return error(str(e), 400)
+        if max_tiles and n_views > 1:
+            return error("tta and tiles cannot be combined", 400)
+
+        loaded = None
+        if web.registry is not None:
+            pin = (request.headers.get("x-model-version") or request.query_params.get("model_version")
+                   or form.get("model_version"))
+            try:
+                loaded = web.registry.select(pin=pin, key=request.headers.get("x-client-id"))
+            except VersionNotLoadedError as e:
+                return error(str(e.args[0]), 400)
+
+        timer = StageTimer()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(cpu_executor, web.run_admitted, lane, web.run_prediction,
+                                                file.file, file.filename, n_views, loaded, timer, max_tiles)
+        except AdmissionRejected as e:
+            return admission_error(e)
+        except (UploadRejected, ImageTooLargeError) as e:
+            return error(str(e), web.count_rejection(e))
+        except Exception as e:
+            return error(str(e), 500)
+    finally:
+        await form.close()
+
+    with timer.stage("json"):
+        response = JSONResponse(result)
+    response.headers["Server-Timing"] = web.server_timing(timer)
+    if result["model_version"] is not None:
+        response.headers["X-Model-Version"] = result["model_version"]
+    metrics.observe_stages(timer.timings)
+    return response
+
+
+async def predict(request):
+    """Predict disease from an uploaded image (same contract as the Flask route)"""
+    started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    try:
+        response = await handle_predict(request)
+    finally:
+        metrics.IN_FLIGHT.dec()
+    metrics.REQUEST_LATENCY.labels(endpoint="/predict", status=response.status_code).observe(
+        time.perf_counter() - started)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(_):
+    yield
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route("/predict", predict, methods=["POST"]),
+        Mount("/", WSGIMiddleware(web.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,147 @@
+"""Dynamic micro-batching for model inference
+
+Concurrent requests submit single images; a background thread gathers them
+for up to ``max_wait_ms`` or ``max_batch_size`` items and runs one forward
+pass for the whole batch.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Gather concurrent single-image predictions into batched forward passes"""
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._closed = False
+
+        # Stats
+        self._batch_sizes = {}
+        self._batches = 0
+        self._requests = 0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_worker(self):
+        """Start the batching thread (again after a fork)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                # Threads and queued items do not survive fork
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def submit(self, image):
+        """Queue one preprocessed image, returns a Future with its probability vector"""
+        future = Future()
+        if not self._closed:
+            self._ensure_worker()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put((image, future, time.perf_counter()))
+        if closed:
+            # Late caller after close(): run unbatched rather than hang
+            try:
+                future.set_result(self.predict_fn(np.expand_dims(image, axis=0))[0])
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def close(self):
+        """Stop the worker once everything already queued has been answered"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def predict(self, image, timeout=None):
+        """Blocking helper around submit()"""
+        return self.submit(image).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the deadline or size cap"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        items = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # close() sentinel: finish this batch, stop on the next call
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            started = time.perf_counter()
+            images = [item[0] for item in items]
+            futures = [item[1] for item in items]
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(items)
+                self._batch_sizes[len(items)] = self._batch_sizes.get(len(items), 0) + 1
+                for _, _, enqueued in items:
+                    wait = started - enqueued
+                    self._wait_sum += wait
+                    self._wait_max = max(self._wait_max, wait)
+
+            try:
+                batch = np.stack(images, axis=0)
+                predictions = self.predict_fn(batch)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for i, future in enumerate(futures):
+                future.set_result(predictions[i])
+
+    def stats(self):
+        """Queue depth, batch-size histogram and per-request wait time"""
+        with self._lock:
+            requests = self._requests
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": requests,
+                "avg_batch_size": requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "avg_wait_ms": self._wait_sum / requests * 1000.0 if requests else 0.0,
+                "max_wait_ms_observed": self._wait_max * 1000.0,
+            }
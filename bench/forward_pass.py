@@ -0,0 +1,95 @@
+"""Regression benchmark: requests/sec of the /predict model path before and after
+the single-forward-pass change, on CPU only.
+
+Usage:
+    python bench/forward_pass.py [--iterations 50] [--output result.json]
+
+"before" replays the old path (model.predict for top-1, then model.predict
+again for all_predictions); "after" is app.build_prediction() fed by one
+model.predict call. Needs the real model at saved_models/7/model.keras.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# CPU only, and keep TensorFlow quiet
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+os.environ.setdefault("BATCHING", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import app as app_module
+
+
+def calibrate_top1(confidence, T=0.15):
+    """Old scalar calibration of the top-1 probability only"""
+    return float(1.0 / (1.0 + np.exp(-np.log(confidence / (1 - confidence + 1e-7)) / T)))
+
+
+def before(loaded, img_array):
+    """Old /predict path: two forward passes per request"""
+    img_batch = np.expand_dims(img_array, axis=0)
+    predictions = loaded.predict(img_batch)
+    predicted_idx = np.argmax(predictions[0])
+    confidence = calibrate_top1(float(predictions[0][predicted_idx]))
+    predictions_batch = loaded.predict(img_batch)
+    predictions_list = sorted(
+        ({"class": loaded.class_names[i], "confidence": float(predictions_batch[0][i])}
+         for i in range(len(loaded.class_names))),
+        key=lambda x: x["confidence"], reverse=True)
+    return confidence, predictions_list
+
+
+def after(loaded, img_array):
+    """Current /predict path: one forward pass per request"""
+    probabilities = loaded.predict(np.expand_dims(img_array, axis=0))[0]
+    return app_module.build_prediction(probabilities, loaded)
+
+
+def measure(fn, loaded, images, iterations):
+    fn(loaded, images[0])  # warm up tracing
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(loaded, images[i % len(images)])
+    elapsed = time.perf_counter() - started
+    return {"iterations": iterations, "seconds": elapsed, "requests_per_sec": iterations / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if app_module.registry is None:
+        print("[ERROR] Model not loaded - this benchmark needs saved_models/<version>/model.keras")
+        return 1
+    loaded = app_module.registry.select()
+
+    rng = np.random.default_rng(0)
+    images = rng.random((8, 224, 224, 3), dtype=np.float32)
+
+    results = {
+        "before": measure(before, loaded, images, args.iterations),
+        "after": measure(after, loaded, images, args.iterations),
+    }
+    results["speedup"] = results["after"]["requests_per_sec"] / results["before"]["requests_per_sec"]
+
+    print(f"before: {results['before']['requests_per_sec']:.2f} req/s")
+    print(f"after : {results['after']['requests_per_sec']:.2f} req/s")
+    print(f"speedup: {results['speedup']:.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""Reproducible inference benchmark for the Flask app
+
+Drives /predict and /predict/batch either in-process (Flask test client) or
+over HTTP (an existing server, or a gunicorn spawned for the run), and reports
+p50/p95/p99 latency, throughput, RSS and per-stage time (decode, resize,
+normalize, model, json) from the Server-Timing header.
+
+Usage:
+    python bench/run.py --demo --output bench/results/demo.json
+    python bench/run.py --target http --spawn-gunicorn --images data/heldout
+    python bench/run.py --target http --url http://localhost:8080 --scenarios concurrent
+
+--demo forces the model-less demo mode, so CI without weights still catches
+regressions in the request path. Compare two result files with --compare.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# ---------------------------------------------------------------------------
+# Image sources
+# ---------------------------------------------------------------------------
+
+def synthetic_images(count, size, seed=0):
+    """JPEG-encoded leaf-like images: green gradient, noise and dark spots"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = []
+    for i in range(count):
+        y, x = np.mgrid[0:height, 0:width]
+        base = np.stack([40 + 40 * x / width, 110 + 80 * y / height,
+                         np.full(x.shape, 40 + 20 * rng.random())], axis=-1)
+        noise = rng.normal(0, 12, (height, width, 3))
+        pixels = base + noise
+        for _ in range(rng.integers(0, 12)):
+            cx, cy, r = rng.integers(0, width), rng.integers(0, height), rng.integers(5, max(6, width // 20))
+            pixels[(x - cx) ** 2 + (y - cy) ** 2 < r * r] *= 0.4
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+        images.append((f"synthetic_{i}.jpg", buffer.getvalue()))
+    return images
+
+
+def folder_images(folder, count):
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths = sorted(paths)[:count]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+# ---------------------------------------------------------------------------
+# Clients
+# ---------------------------------------------------------------------------
+
+def parse_server_timing(header):
+    timings = {}
+    for part in (header or "").split(","):
+        name, _, rest = part.strip().partition(";dur=")
+        if name and rest:
+            timings[name] = float(rest)
+    return timings
+
+
+class InProcessClient:
+    """Flask test client; one per thread"""
+
+    def __init__(self):
+        import app as app_module
+        self.app_module = app_module
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app_module.app.test_client()
+        return client
+
+    def predict(self, name, data):
+        response = self._client().post("/predict", data={"file": (io.BytesIO(data), name)})
+        return response.status_code, parse_server_timing(response.headers.get("Server-Timing"))
+
+    def predict_batch(self, images):
+        files = [(io.BytesIO(data), name) for name, data in images]
+        response = self._client().post("/predict/batch", data={"files": files})
+        try:
+            lines = response.get_data(as_text=True).splitlines()
+        finally:
+            response.close()  # releases the bulk admission slot
+        return response.status_code, json.loads(lines[-1]).get("timings_ms", {}) if lines else {}
+
+    def server_pids(self):
+        return [os.getpid()]
+
+
+class HTTPClient:
+    """requests-based client against a running server"""
+
+    def __init__(self, url, pids=None):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip("/")
+        self.pids = pids or []
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.requests.Session()
+        return session
+
+    def predict(self, name, data):
+        response = self._session().post(f"{self.url}/predict", files={"file": (name, data)}, timeout=300)
+        return response.status_code, parse_server_timing(response.headers.get("Server-Timing"))
+
+    def predict_batch(self, images):
+        files = [("files", (name, data)) for name, data in images]
+        response = self._session().post(f"{self.url}/predict/batch", files=files, timeout=600)
+        lines = response.text.splitlines()
+        return response.status_code, json.loads(lines[-1]).get("timings_ms", {}) if lines else {}
+
+    def server_pids(self):
+        return self.pids
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_gunicorn(env):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), **env)
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app:app"],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    import requests
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            if requests.get(f"{url}/health", timeout=2).ok:
+                return process, url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not become healthy")
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc"""
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def rss_bytes(pids):
+    """Resident set size summed over pids and their children (psutil or Linux /proc)"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    total = 0
+    for pid in pids:
+        if psutil is not None:
+            try:
+                process = psutil.Process(pid)
+                for p in [process] + process.children(recursive=True):
+                    total += p.memory_info().rss
+            except psutil.Error:
+                pass
+            continue
+        for child in process_tree(pid):
+            try:
+                with open(f"/proc/{child}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+    return total or None
+
+
+def summarize(latencies, stage_timings, images, elapsed, errors):
+    latencies_ms = np.array(latencies) * 1000.0
+    stages = {}
+    for timings in stage_timings:
+        for stage, ms in timings.items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "requests": len(latencies),
+        "images": images,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput_images_per_sec": images / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+        "stage_ms_mean": {stage: float(np.mean(v)) for stage, v in sorted(stages.items())},
+    }
+
+
+def run_single(client, images, requests):
+    latencies, timings, errors = [], [], 0
+    started = time.perf_counter()
+    for i in range(requests):
+        name, data = images[i % len(images)]
+        t0 = time.perf_counter()
+        status, stage = client.predict(name, data)
+        latencies.append(time.perf_counter() - t0)
+        timings.append(stage)
+        errors += status != 200
+    return summarize(latencies, timings, requests, time.perf_counter() - started, errors)
+
+
+def run_batch(client, images, requests, batch_size):
+    latencies, timings, errors = [], [], 0
+    started = time.perf_counter()
+    for i in range(requests):
+        chunk = [images[(i * batch_size + j) % len(images)] for j in range(batch_size)]
+        t0 = time.perf_counter()
+        status, stage = client.predict_batch(chunk)
+        latencies.append(time.perf_counter() - t0)
+        timings.append({k: v / batch_size for k, v in stage.items()})
+        errors += status != 200
+    return summarize(latencies, timings, requests * batch_size, time.perf_counter() - started, errors)
+
+
+def run_concurrent(client, images, requests, concurrency):
+    latencies, timings = [None] * requests, [None] * requests
+    statuses = [None] * requests
+
+    def one(i):
+        name, data = images[i % len(images)]
+        t0 = time.perf_counter()
+        statuses[i], timings[i] = client.predict(name, data)
+        latencies[i] = time.perf_counter() - t0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    errors = sum(status != 200 for status in statuses)
+    result = summarize(latencies, timings, requests, time.perf_counter() - started, errors)
+    result["concurrency"] = concurrency
+    return result
+
+
+def compare(baseline_path, current_path):
+    """Print p50/p95/throughput deltas between two result files"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    for scenario, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(scenario)
+        if base is None:
+            continue
+        print(f"{scenario}:")
+        for key in ("p50", "p95", "p99"):
+            b, c = base["latency_ms"][key], result["latency_ms"][key]
+            print(f"  {key:4} {b:9.2f} -> {c:9.2f} ms ({(c - b) / b * 100:+.1f}%)")
+        b, c = base["throughput_images_per_sec"], result["throughput_images_per_sec"]
+        print(f"  throughput {b:8.2f} -> {c:8.2f} img/s ({(c - b) / b * 100:+.1f}%)")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Flask inference service")
+    parser.add_argument("--target", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", help="Base URL of a running server (http target)")
+    parser.add_argument("--spawn-gunicorn", action="store_true", help="Start gunicorn for the run (http target)")
+    parser.add_argument("--images", default="synthetic", help="'synthetic' or a folder of images")
+    parser.add_argument("--count", type=int, default=32, help="Number of distinct images")
+    parser.add_argument("--size", default="1600x1200", help="Synthetic image size WxH")
+    parser.add_argument("--scenarios", default="single,batch,concurrent")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per /predict/batch request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed requests before measuring")
+    parser.add_argument("--demo", action="store_true", help="Force model-less demo mode")
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    random.seed(args.seed)
+    server_env = {"DEMO_MODE": "1" if args.demo else os.environ.get("DEMO_MODE", "0")}
+    if args.demo:
+        server_env["MODEL_SERVER"] = "0"
+    if not args.cache:
+        # Repeated images would otherwise be served from the cache
+        server_env["PREDICTION_CACHE_BYTES"] = "0"
+
+    if args.images == "synthetic":
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        images = synthetic_images(args.count, (width, height), args.seed)
+    else:
+        images = folder_images(args.images, args.count)
+    if not images:
+        print("[ERROR] No images to benchmark with")
+        return 1
+
+    process = None
+    if args.target == "inprocess":
+        os.environ.update(server_env)
+        os.chdir(ROOT)
+        client = InProcessClient()
+    elif args.spawn_gunicorn:
+        process, url = spawn_gunicorn(server_env)
+        client = HTTPClient(url, pids=[process.pid])
+    elif args.url:
+        client = HTTPClient(args.url)
+    else:
+        parser.error("--target http needs --url or --spawn-gunicorn")
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.target,
+            "demo": args.demo,
+            "images": args.images,
+            "image_count": len(images),
+            "image_size": args.size if args.images == "synthetic" else None,
+            "mean_upload_bytes": float(np.mean([len(data) for _, data in images])),
+            "requests": args.requests,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": {},
+    }
+
+    try:
+        for name, data in images[:args.warmup]:
+            client.predict(name, data)
+        rss_before = rss_bytes(client.server_pids())
+
+        for scenario in args.scenarios.split(","):
+            scenario = scenario.strip()
+            if scenario == "single":
+                result = run_single(client, images, args.requests)
+            elif scenario == "batch":
+                result = run_batch(client, images, max(1, args.requests // args.batch_size), args.batch_size)
+            elif scenario == "concurrent":
+                result = run_concurrent(client, images, args.requests, args.concurrency)
+            else:
+                parser.error(f"Unknown scenario {scenario!r}")
+            result["rss_bytes"] = rss_bytes(client.server_pids())
+            results["scenarios"][scenario] = result
+
+            lat = result["latency_ms"]
+            print(f"{scenario:10} p50 {lat['p50']:8.2f} ms  p95 {lat['p95']:8.2f} ms  p99 {lat['p99']:8.2f} ms  "
+                  f"{result['throughput_images_per_sec']:8.2f} img/s  errors {result['errors']}")
+            if result["stage_ms_mean"]:
+                print("           " + "  ".join(f"{k} {v:.2f}ms" for k, v in result["stage_ms_mean"].items()))
+        results["meta"]["rss_bytes_after_warmup"] = rss_before
+    finally:
+        if process is not None:
+            # SIGINT is gunicorn's quick shutdown; SIGTERM waits on keep-alive connections
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=30)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[SUCCESS] Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Temperature calibration of class probabilities
+
+The models output softmax probabilities. Calibration rescales their logits:
+
+    calibrated = softmax(log(p) / T)
+
+T < 1 sharpens the distribution and T > 1 flattens it. T = 1 leaves it
+unchanged. Everything works on whole (N, classes) arrays (or one vector)
+along the last axis, so a batch costs one numpy expression.
+
+The temperature for a version is ``temperature`` in
+saved_models/<n>/metadata.json; if that is absent, DEFAULT_TEMPERATURE.
+It is fitted on inputs at preprocessing.MODEL_INPUT_SCALE (0-255, as in
+training), which both apps use, and stored with that scale; a temperature
+fitted on any other input range is ignored.
+To fit it on a labelled validation folder (one subfolder per class):
+
+    python calibration.py --version 7 --data-dir data/val [--write]
+"""
+
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+import model_registry
+import preprocessing
+
+DEFAULT_TEMPERATURE = float(os.environ.get("CALIBRATION_TEMPERATURE", 0.15))
+TEMPERATURE_BOUNDS = (0.01, 10.0)
+
+# Smallest probability taken to the log; keeps log(0) finite in float32
+_EPSILON = np.finfo(np.float32).tiny
+
+_temperatures = {}
+_temperatures_lock = threading.Lock()
+
+
+def log_probabilities(probabilities):
+    """log(p) as float32 with zeros clipped to a finite value"""
+    return np.log(np.maximum(np.asarray(probabilities, dtype=np.float32), _EPSILON))
+
+
+def _softmax_scaled(logits, temperature):
+    scaled = logits / np.float32(temperature)
+    scaled -= scaled.max(axis=-1, keepdims=True)
+    np.exp(scaled, out=scaled)
+    scaled /= scaled.sum(axis=-1, keepdims=True)
+    return scaled
+
+
+def calibrate(probabilities, temperature=DEFAULT_TEMPERATURE):
+    """softmax(log(p) / T) over the last axis of a vector or (N, classes) batch"""
+    return _softmax_scaled(log_probabilities(probabilities), temperature)
+
+
+def negative_log_likelihood(probabilities, labels, temperature):
+    """Mean NLL of the true labels after calibration at ``temperature``"""
+    logits = log_probabilities(probabilities) / np.float32(temperature)
+    logits -= logits.max(axis=-1, keepdims=True)
+    log_norm = np.log(np.exp(logits).sum(axis=-1))
+    labels = np.asarray(labels, dtype=np.int64)
+    return float(np.mean(log_norm - logits[np.arange(len(labels)), labels]))
+
+
+def fit_temperature(probabilities, labels, bounds=TEMPERATURE_BOUNDS, iterations=60):
+    """Temperature minimising validation NLL
+
+    NLL is convex in 1/T for temperature scaling, so a golden-section search
+    over log(T) within ``bounds`` finds the minimum.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(probabilities) == 0:
+        raise ValueError("Need at least one labelled prediction to fit a temperature")
+    low, high = np.log(bounds[0]), np.log(bounds[1])
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    a, b = high - ratio * (high - low), low + ratio * (high - low)
+    nll_a = negative_log_likelihood(probabilities, labels, np.exp(a))
+    nll_b = negative_log_likelihood(probabilities, labels, np.exp(b))
+    for _ in range(iterations):
+        if nll_a < nll_b:
+            high, b, nll_b = b, a, nll_a
+            a = high - ratio * (high - low)
+            nll_a = negative_log_likelihood(probabilities, labels, np.exp(a))
+        else:
+            low, a, nll_a = a, b, nll_b
+            b = low + ratio * (high - low)
+            nll_b = negative_log_likelihood(probabilities, labels, np.exp(b))
+    return float(np.exp((low + high) / 2.0))
+
+
+def expected_calibration_error(probabilities, labels, bins=15):
+    """Top-1 ECE: confidence vs accuracy gap, weighted over equal-width bins"""
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    confidence = probabilities.max(axis=-1)
+    correct = probabilities.argmax(axis=-1) == np.asarray(labels)
+    which = np.minimum((confidence * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(which, minlength=bins)
+    gap = np.abs(np.bincount(which, weights=confidence, minlength=bins)
+                 - np.bincount(which, weights=correct, minlength=bins))
+    return float(gap.sum() / max(1, counts.sum()))
+
+
+def temperature_for(version, root=model_registry.MODELS_ROOT):
+    """Calibration temperature for a model version (cached until metadata.json changes)"""
+    path = os.path.join(root, str(version), "metadata.json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    key = (root, str(version))
+    with _temperatures_lock:
+        cached = _temperatures.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    metadata = model_registry.read_metadata(version, root) if mtime else {}
+    temperature = metadata.get("temperature")
+    if temperature and metadata.get("temperature_input_scale") != preprocessing.MODEL_INPUT_SCALE:
+        print(f"[WARNING] v{version} temperature was fitted on another input scale - "
+              f"using {DEFAULT_TEMPERATURE} until it is refitted")
+        temperature = None
+    temperature = float(temperature) if temperature else DEFAULT_TEMPERATURE
+    with _temperatures_lock:
+        _temperatures[key] = (mtime, temperature)
+    return temperature
+
+
+def write_temperature(version, temperature, root=model_registry.MODELS_ROOT):
+    """Store ``temperature`` in saved_models/<version>/metadata.json"""
+    path = os.path.join(root, str(version), "metadata.json")
+    metadata = model_registry.read_metadata(version, root)
+    metadata["temperature"] = float(temperature)
+    metadata["temperature_input_scale"] = preprocessing.MODEL_INPUT_SCALE
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def predict_folder(loaded, folder, batch_size):
+    """Raw probabilities and label indices for a class-per-subfolder image folder"""
+    from folder_analysis import list_images
+
+    paths, labels = [], []
+    for path in list_images(folder):
+        label = os.path.basename(os.path.dirname(path))
+        if label in loaded.class_names:
+            paths.append(path)
+            labels.append(loaded.class_names.index(label))
+    if not paths:
+        raise ValueError(f"No images under {folder} in folders named after the classes")
+    probabilities = []
+    for start in range(0, len(paths), batch_size):
+        batch = preprocessing.preprocess_batch(paths[start:start + batch_size])
+        probabilities.append(np.asarray(loaded.predict(batch)))
+        print(f"[INFO] {min(start + batch_size, len(paths))}/{len(paths)} images")
+    return np.concatenate(probabilities), np.asarray(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the calibration temperature on a validation folder")
+    parser.add_argument("--version", default=None, help="Model version (default: MODEL_VERSION or newest)")
+    parser.add_argument("--data-dir", required=True, help="Validation images, one subfolder per class")
+    parser.add_argument("--backend", default=None, help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--write", action="store_true", help="Save the temperature to metadata.json")
+    args = parser.parse_args()
+
+    version = args.version or model_registry.default_version()
+    registry = model_registry.ModelRegistry(model_registry.backend_loader(batching=False, backend=args.backend))
+    loaded = registry.load(version)
+    probabilities, labels = predict_folder(loaded, args.data_dir, args.batch_size)
+
+    temperature = fit_temperature(probabilities, labels)
+    current = temperature_for(version)
+    for name, t in (("uncalibrated", 1.0), ("current", current), ("fitted", temperature)):
+        calibrated = calibrate(probabilities, t)
+        print(f"[INFO] {name:12s} T={t:.4f} NLL={negative_log_likelihood(probabilities, labels, t):.4f} "
+              f"ECE={expected_calibration_error(calibrated, labels):.4f}")
+    accuracy = float((probabilities.argmax(axis=1) == labels).mean())
+    print(f"[SUCCESS] v{version}: fitted T={temperature:.4f} on {len(labels)} images (accuracy {accuracy:.2%})")
+    if args.write:
+        write_temperature(version, temperature)
+        print(f"[SUCCESS] Saved temperature to saved_models/{version}/metadata.json")
+
+
+if __name__ == "__main__":
+    main()
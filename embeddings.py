@@ -0,0 +1,219 @@
+"""Leaf embeddings and a near-duplicate index
+
+The embedding is the Swin backbone's GlobalAveragePooling2D output (768
+floats), read from the same forward pass that produces the class
+probabilities. Only Keras backends expose it; exported SavedModel/TFLite
+artifacts have no intermediate outputs.
+
+EmbeddingIndex keeps, per model version, L2-normalised float16 embeddings
+and a 64-bit perceptual hash per image in memory-mapped files plus a JSONL
+sidecar with each entry's metadata. Similarity search is a brute-force dot
+product over the float16 matrix in blocks. The perceptual hash finds
+near-duplicate candidates in a few microseconds, but a 64-bit hash alone
+cannot tell two similar leaves apart: /predict only reuses stored
+probabilities for an entry with the same content key (identical bytes),
+and reports a near-duplicate only once the embeddings agree as well.
+
+Files in <directory>/<model version>/:
+    info.json     {"dim": ...}
+    vectors.f16   (capacity, dim) float16
+    hashes.u64    (capacity,) uint64
+    meta.jsonl    one JSON object per entry, in row order
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+SEARCH_BLOCK_ROWS = 65536
+INITIAL_CAPACITY = 4096
+
+
+class EmbeddingsUnavailable(Exception):
+    """The loaded backend cannot produce embeddings"""
+
+
+def build_embedder(model):
+    """Keras model returning [embedding, probabilities] in one pass, or None
+
+    None when the model is not a Keras model or has no
+    GlobalAveragePooling2D layer.
+    """
+    layers = getattr(model, "layers", None)
+    if not layers:
+        return None
+    import tensorflow as tf
+
+    pooling = [layer for layer in layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+    if not pooling:
+        return None
+    return tf.keras.Model(inputs=model.inputs, outputs=[pooling[-1].output, model.output])
+
+
+def perceptual_hash(img):
+    """64-bit difference hash of a PIL image (robust to resizing and re-encoding)"""
+    small = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR),
+                       dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distances(hashes, value):
+    """Bit distance between each uint64 in ``hashes`` and ``value``"""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex:
+    """Append-only float16 embedding index with perceptual-hash lookup
+
+    Safe across threads and processes: appends take an exclusive file lock,
+    and readers pick up rows added by other processes on their next call.
+    """
+
+    def __init__(self, directory, dim=None):
+        """Open the index in ``directory``; ``dim`` is required to create a new one"""
+        info_path = os.path.join(directory, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path, encoding="utf-8") as f:
+                dim = json.load(f)["dim"]
+        elif dim is None:
+            raise FileNotFoundError(f"No embedding index in {directory}")
+        else:
+            os.makedirs(directory, exist_ok=True)
+            with open(info_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"dim": int(dim)}, f)
+            os.replace(info_path + ".tmp", info_path)
+        self.directory = directory
+        self.dim = int(dim)
+        self._vectors_path = os.path.join(directory, "vectors.f16")
+        self._hashes_path = os.path.join(directory, "hashes.u64")
+        self._meta_path = os.path.join(directory, "meta.jsonl")
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._hashes = None
+        self._meta = []
+        self._meta_offset = 0
+        with self._file_lock():
+            self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _capacity(self):
+        if not os.path.exists(self._hashes_path):
+            return 0
+        return os.path.getsize(self._hashes_path) // 8
+
+    def _map(self, capacity):
+        if self._capacity() < capacity:
+            # Grow by extending the files; existing rows stay where they are
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * self.dim * 2)
+            with open(self._hashes_path, "ab") as f:
+                f.truncate(capacity * 8)
+        capacity = self._capacity()
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self._hashes = np.memmap(self._hashes_path, dtype=np.uint64, mode="r+", shape=(capacity,))
+
+    def _refresh(self):
+        """Read metadata rows appended since the last call (by any process)"""
+        if not os.path.exists(self._meta_path):
+            self._map(INITIAL_CAPACITY)
+            return
+        with open(self._meta_path, encoding="utf-8") as f:
+            f.seek(self._meta_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # partial write in progress
+                self._meta.append(json.loads(line))
+                self._meta_offset += len(line.encode("utf-8"))
+        if self._vectors is None or self._vectors.shape[0] < len(self._meta) or \
+                self._vectors.shape[0] != self._capacity():
+            self._map(max(INITIAL_CAPACITY, len(self._meta)))
+
+    def __len__(self):
+        return len(self._meta)
+
+    def add(self, embedding, phash, meta):
+        """Append one entry; returns its row number"""
+        vector = normalize(embedding).astype(np.float16)
+        with self._lock, self._file_lock():
+            self._refresh()
+            row = len(self._meta)
+            if row >= self._vectors.shape[0]:
+                self._map(self._vectors.shape[0] * 2)
+            self._vectors[row] = vector
+            self._hashes[row] = np.uint64(phash)
+            self._vectors.flush()
+            self._hashes.flush()
+            # The metadata line is the commit point: rows without one are ignored
+            line = json.dumps({**meta, "row": row}) + "\n"
+            with open(self._meta_path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._meta.append({**meta, "row": row})
+            self._meta_offset += len(line.encode("utf-8"))
+            return row
+
+    def find_duplicate(self, phash, max_distance=4, key=None):
+        """Metadata of the closest entry within max_distance bits, or None
+
+        An entry whose "key" equals ``key`` (the same bytes) is preferred
+        over other entries at the same distance.
+        """
+        with self._lock:
+            self._refresh()
+            count = len(self._meta)
+            if count == 0:
+                return None
+            distances = hamming_distances(np.asarray(self._hashes[:count]), phash)
+            candidates = np.flatnonzero(distances <= max_distance)
+            if len(candidates) == 0:
+                return None
+            best = int(candidates[distances[candidates].argmin()])
+            if key is not None:
+                best = next((int(i) for i in candidates if self._meta[i].get("key") == key
+                             and distances[i] == distances[best]), best)
+            return {**self._meta[best], "hash_distance": int(distances[best])}
+
+    def similarity(self, embedding, row):
+        """Cosine similarity between ``embedding`` and the stored entry ``row``"""
+        query = normalize(embedding)
+        with self._lock:
+            self._refresh()
+            return float(np.clip(np.asarray(self._vectors[row], dtype=np.float32) @ query, -1.0, 1.0))
+
+    def search(self, embedding, k=5):
+        """Top-k entries by cosine similarity, best first"""
+        query = normalize(embedding).astype(np.float32)
+        with self._lock:
+            self._refresh()
+            count = len(self._meta)
+            if count == 0:
+                return []
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                block = np.asarray(self._vectors[start:min(count, start + SEARCH_BLOCK_ROWS)], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [{**self._meta[i], "score": float(scores[i])} for i in top]
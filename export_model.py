@@ -0,0 +1,214 @@
+"""Export saved_models/<version> to inference artifacts
+
+Usage:
+    python export_model.py --version 7 --quantize dynamic --heldout-dir data/heldout
+    python export_model.py --version 7 --quantize int8 --calibration-dir data/train \\
+        --heldout-dir data/heldout --min-agreement 0.99
+    python export_model.py --version 7 --format saved_model
+
+Formats:
+    tflite       quantized TFLite file for INFERENCE_BACKEND=tflite (default)
+    saved_model  inference-only SavedModel in saved_models/<version>/inference/,
+                 loaded by the desktop app and INFERENCE_BACKEND=saved_model
+                 without rebuilding Swin, fetching ImageNet weights or
+                 creating an optimizer
+
+Quantization modes:
+    dynamic  int8 weights, float activations (no calibration data needed)
+    int8     int8 weights and activations, calibrated on --calibration-dir
+    float16  float16 weights
+    none     plain float32 TFLite
+
+After export the artifact is checked against the Keras model on a held-out
+folder (one sub-folder per class, or a flat folder of images) and a parity
+report is written next to it. Serve a TFLite file with INFERENCE_BACKEND=tflite
+(and TFLITE_MODEL=<file name> if not model.tflite).
+
+The Keras model is read from model.keras, or rebuilt from
+model_weights.weights.h5 when only the weights are present.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import preprocessing
+from inference_backends import SAVED_MODEL_DIR, SavedModelBackend, TFLiteBackend, load_keras_model, model_dir
+from model_registry import default_version, load_class_names
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def list_images(folder, class_names):
+    """Return (path, label index or None) for images under folder"""
+    items = []
+    for root, _, files in os.walk(folder):
+        label = os.path.basename(root)
+        label_idx = class_names.index(label) if label in class_names else None
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((os.path.join(root, name), label_idx))
+    return items
+
+
+def iter_batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        yield chunk, preprocessing.preprocess_batch([path for path, _ in chunk])
+
+
+def convert(model, quantize, calibration_items, calibration_steps):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        if not calibration_items:
+            raise ValueError("int8 quantization needs --calibration-dir with images")
+
+        def representative_dataset():
+            for path, _ in calibration_items[:calibration_steps]:
+                yield [preprocessing.preprocess_batch([path])]
+
+        converter.representative_dataset = representative_dataset
+    # Swin uses a few ops without TFLite builtin kernels
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS,
+                                           tf.lite.OpsSet.SELECT_TF_OPS]
+    return converter.convert()
+
+
+def export_saved_model(model, path):
+    """Write an inference-only SavedModel (serving signature, no optimizer state)"""
+    if hasattr(model, "export"):
+        model.export(path)
+    else:
+        import tensorflow as tf
+        tf.saved_model.save(model, path)
+
+
+def parity_check(keras_model, exported_model, items, batch_size, name="tflite"):
+    """Compare top-1 agreement, accuracy and probabilities on a held-out folder"""
+    agree = 0
+    keras_correct = exported_correct = labelled = 0
+    max_abs_diff = 0.0
+    sum_abs_diff = 0.0
+    keras_time = exported_time = 0.0
+
+    for chunk, batch in iter_batches(items, batch_size):
+        started = time.perf_counter()
+        keras_probs = keras_model.predict(batch, verbose=0)
+        keras_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        exported_probs = exported_model.predict(batch)
+        exported_time += time.perf_counter() - started
+
+        keras_top = keras_probs.argmax(axis=1)
+        exported_top = exported_probs.argmax(axis=1)
+        agree += int((keras_top == exported_top).sum())
+        diff = np.abs(keras_probs - exported_probs)
+        max_abs_diff = max(max_abs_diff, float(diff.max()))
+        sum_abs_diff += float(diff.mean()) * len(chunk)
+
+        for (_, label), k, e in zip(chunk, keras_top, exported_top):
+            if label is not None:
+                labelled += 1
+                keras_correct += int(k == label)
+                exported_correct += int(e == label)
+
+    n = len(items)
+    return {
+        "images": n,
+        "top1_agreement": agree / n,
+        "mean_abs_prob_diff": sum_abs_diff / n,
+        "max_abs_prob_diff": max_abs_diff,
+        "labelled_images": labelled,
+        "keras_accuracy": keras_correct / labelled if labelled else None,
+        f"{name}_accuracy": exported_correct / labelled if labelled else None,
+        "keras_ms_per_image": keras_time / n * 1000.0,
+        f"{name}_ms_per_image": exported_time / n * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export inference artifacts with a parity check")
+    parser.add_argument("--version", default=default_version())
+    parser.add_argument("--format", choices=["tflite", "saved_model"], default="tflite")
+    parser.add_argument("--quantize", choices=["dynamic", "int8", "float16", "none"], default="dynamic",
+                        help="TFLite quantization mode")
+    parser.add_argument("--output", help="Artifact name inside saved_models/<version>/ "
+                                         "(default model.tflite, model_int8.tflite, ..., inference)")
+    parser.add_argument("--calibration-dir", help="Images for int8 calibration")
+    parser.add_argument("--calibration-steps", type=int, default=200)
+    parser.add_argument("--heldout-dir", help="Held-out images for the accuracy-parity check")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--min-agreement", type=float, default=None,
+                        help="Exit non-zero if top-1 agreement falls below this")
+    args = parser.parse_args()
+
+    class_names = load_class_names(args.version)
+    keras_model = load_keras_model(args.version)
+
+    if args.format == "saved_model":
+        name = args.output or SAVED_MODEL_DIR
+        artifact_path = os.path.join(model_dir(args.version), name)
+        print(f"[INFO] Exporting inference SavedModel for v{args.version}...")
+        export_saved_model(keras_model, artifact_path)
+        print(f"[SUCCESS] Wrote {artifact_path}")
+        report_path = artifact_path.rstrip(os.sep) + ".parity.json"
+    else:
+        calibration_items = list_images(args.calibration_dir, class_names) if args.calibration_dir else []
+        print(f"[INFO] Converting model v{args.version} ({args.quantize})...")
+        tflite_bytes = convert(keras_model, args.quantize, calibration_items, args.calibration_steps)
+
+        name = args.output or ("model.tflite" if args.quantize == "dynamic" else f"model_{args.quantize}.tflite")
+        artifact_path = os.path.join(model_dir(args.version), name)
+        with open(artifact_path, "wb") as f:
+            f.write(tflite_bytes)
+        print(f"[SUCCESS] Wrote {artifact_path} ({len(tflite_bytes) / 1e6:.1f} MB)")
+        report_path = os.path.splitext(artifact_path)[0] + ".parity.json"
+
+    if not args.heldout_dir:
+        print("[WARNING] No --heldout-dir given - skipping accuracy-parity check")
+        return 0
+
+    items = list_images(args.heldout_dir, class_names)
+    if not items:
+        print(f"[ERROR] No images found in {args.heldout_dir}")
+        return 1
+
+    if args.format == "saved_model":
+        exported = SavedModelBackend(artifact_path)
+    else:
+        exported = TFLiteBackend(artifact_path)
+    report = parity_check(keras_model, exported, items, args.batch_size, name=args.format)
+    report.update({"model_version": str(args.version), "format": args.format, "artifact": name})
+    if args.format == "tflite":
+        report["quantize"] = args.quantize
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"[RESULTS] top-1 agreement {report['top1_agreement'] * 100:.2f}% on {report['images']} images, "
+          f"max |dp| {report['max_abs_prob_diff']:.4f}")
+    if report["labelled_images"]:
+        print(f"  Keras accuracy   : {report['keras_accuracy'] * 100:.2f}%")
+        print(f"  Exported accuracy: {report[args.format + '_accuracy'] * 100:.2f}%")
+    print(f"  Latency: keras {report['keras_ms_per_image']:.1f} ms/img, "
+          f"{args.format} {report[args.format + '_ms_per_image']:.1f} ms/img")
+    print(f"[SUCCESS] Parity report: {report_path}")
+
+    if args.min_agreement is not None and report["top1_agreement"] < args.min_agreement:
+        print(f"[ERROR] Agreement below --min-agreement {args.min_agreement}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
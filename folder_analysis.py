@@ -0,0 +1,117 @@
+"""Folder analysis pipeline for the desktop app
+
+A producer thread walks the folder and hands decodes to a thread pool; decode
+threads write straight into a preallocated batch buffer and each full batch
+goes through one ``model.predict`` call while the next batch decodes. Every
+outcome is put on ``FolderAnalysis.events`` for the Tk main loop to drain
+with ``root.after``, so nothing here touches a widget.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import preprocessing
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Event kinds on FolderAnalysis.events: (kind, path, payload)
+EVENT_RESULT = "result"   # payload: raw probability vector
+EVENT_ERROR = "error"     # payload: error message for one image
+EVENT_FAILED = "failed"   # payload: error message, the run stopped
+EVENT_DONE = "done"       # payload: None, always the last event
+
+
+def list_images(folder):
+    """Image paths under folder (recursive), in a stable order"""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("."):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+class FolderAnalysis:
+    """Decode and classify a list of images in the background
+
+    ``scale`` and ``resample`` are passed to preprocessing.preprocess_into;
+    the desktop app resizes with LANCZOS.
+    """
+
+    def __init__(self, model, paths, batch_size=16, decode_workers=4,
+                 scale=preprocessing.MODEL_INPUT_SCALE, resample=Image.Resampling.LANCZOS):
+        self.model = model
+        self.paths = list(paths)
+        self.total = len(self.paths)
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = max(1, int(decode_workers))
+        self.scale = scale
+        self.resample = resample
+        self.events = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="folder-analysis", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop after the batch in flight; queued decodes are dropped"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _decode(self, path, out):
+        img = preprocessing.open_image(path)
+        preprocessing.preprocess_into(img, out, scale=self.scale, resample=self.resample)
+
+    def _iter_decoded(self, executor):
+        """Yield (buffer, [(path, future)]) per batch, one batch decoding ahead"""
+        pending = None
+        buffer, chunk = preprocessing.allocate_batch(self.batch_size), []
+        for path in self.paths:
+            if self.cancelled:
+                return
+            chunk.append((path, executor.submit(self._decode, path, buffer[len(chunk)])))
+            if len(chunk) == self.batch_size:
+                if pending:
+                    yield pending
+                pending = (buffer, chunk)
+                buffer, chunk = preprocessing.allocate_batch(self.batch_size), []
+        if pending:
+            yield pending
+        if chunk:
+            yield buffer, chunk
+
+    def _run(self):
+        executor = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="folder-decode")
+        try:
+            for buffer, chunk in self._iter_decoded(executor):
+                if self.cancelled:
+                    break
+                decoded = []
+                for i, (path, future) in enumerate(chunk):
+                    try:
+                        future.result()
+                        decoded.append(i)
+                    except Exception as e:
+                        self.events.put((EVENT_ERROR, path, f"Could not decode image: {e}"))
+                if not decoded:
+                    continue
+                # Fancy indexing copies, so only do it when some slots failed
+                batch = buffer[:len(chunk)] if len(decoded) == len(chunk) else buffer[decoded]
+                probabilities = self.model.predict(batch, verbose=0)
+                for i, probs in zip(decoded, probabilities):
+                    self.events.put((EVENT_RESULT, chunk[i][0], probs))
+        except Exception as e:
+            self.events.put((EVENT_FAILED, None, str(e)))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.events.put((EVENT_DONE, None, None))
@@ -0,0 +1,87 @@
+"""Gunicorn configuration
+
+With MODEL_SERVER=1 the master starts model_server.py before forking
+workers, and workers reach it over a Unix socket instead of each loading
+TensorFlow and the model. TensorFlow is not fork-safe, so loading it in the
+master and relying on --preload is not supported.
+
+SERVER_MODE=asgi serves asgi:app with uvicorn workers instead of app:app on
+gthread: uploads are received asynchronously, so a worker is not tied up
+by slow clients (see asgi.py).
+"""
+
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+
+# The config is loaded before gunicorn changes into the app directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from admission import ADMISSION_MAX_IN_FLIGHT, ADMISSION_THREADS
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# The admission cap (ADMISSION_MAX_IN_FLIGHT) plus waiter threads: requests
+# past the cap queue in admission control's lanes, or are shed with 503s,
+# rather than in the listen backlog
+threads = int(os.environ.get("GUNICORN_THREADS", ADMISSION_THREADS))
+if threads <= ADMISSION_MAX_IN_FLIGHT:
+    print(f"[WARNING] GUNICORN_THREADS={threads} is not above ADMISSION_MAX_IN_FLIGHT="
+          f"{ADMISSION_MAX_IN_FLIGHT} - admission control will never queue or shed")
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+if SERVER_MODE == "asgi":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "app:app"
+    worker_class = "gthread"
+timeout = 120
+
+MODEL_SERVER = os.environ.get("MODEL_SERVER", "0") == "1"
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/mango-model.sock")
+
+_model_server = None
+
+# prometheus_client multiprocess mode: every worker writes its metrics here
+# and /metrics aggregates them. Must be set before workers import app.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/mango-prometheus")
+
+
+def on_starting(server):
+    """Start the shared model server and wait until it answers"""
+    global _model_server
+    # Stale files from a previous run would be aggregated too
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+    if not MODEL_SERVER:
+        return
+    # Random per start unless the deployment provides one; the model server
+    # and every worker inherit it
+    os.environ.setdefault("MODEL_SERVER_AUTHKEY", secrets.token_hex(32))
+    from model_server import wait_for_server
+
+    _model_server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py"),
+         "--socket", MODEL_SERVER_SOCKET])
+    info = wait_for_server(MODEL_SERVER_SOCKET)
+    # Inherited by every worker forked after this point
+    os.environ["MODEL_SERVER_SOCKET"] = MODEL_SERVER_SOCKET
+    server.log.info("Model server ready (pid %s, model_loaded=%s)", _model_server.pid, info["model_loaded"])
+
+
+def child_exit(server, worker):
+    """Drop live gauges (in-flight requests) of a dead worker"""
+    try:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    except ImportError:
+        pass
+
+
+def on_exit(server):
+    if _model_server is not None:
+        _model_server.terminate()
+        _model_server.wait(timeout=10)
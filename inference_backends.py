@@ -0,0 +1,186 @@
+"""Pluggable inference backends
+
+Every backend exposes ``predict(batch, verbose=0)`` like a Keras model, so the
+rest of the app does not care which one is in use. Select with
+INFERENCE_BACKEND:
+
+    keras        saved_models/<version>/model.keras (default), or the
+                 architecture rebuilt around model_weights.weights.h5
+    tflite       saved_models/<version>/model.tflite, produced by export_model.py
+    saved_model  saved_models/<version>/inference/, produced by export_model.py
+"""
+
+import os
+import threading
+
+import numpy as np
+
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+TFLITE_MODEL = os.environ.get("TFLITE_MODEL", "model.tflite")
+TFLITE_THREADS = int(os.environ.get("TFLITE_THREADS", os.cpu_count() or 1))
+SAVED_MODEL_DIR = "inference"
+IMAGE_SIZE = (224, 224)
+NUM_CLASSES = 8
+
+
+def model_dir(version):
+    return os.path.join(os.getcwd(), "saved_models", str(version))
+
+
+def load_keras_model(version):
+    """Load saved_models/<version>/model.keras, else rebuild it from the weights file
+
+    The Docker image ships only model_weights.weights.h5. Raises
+    FileNotFoundError when neither file exists.
+    """
+    model_path = os.path.join(model_dir(version), "model.keras")
+    if not os.path.exists(model_path):
+        if os.path.exists(os.path.join(model_dir(version), "model_weights.weights.h5")):
+            print(f"[INFO] {model_path} not found - rebuilding the classifier from model_weights.weights.h5")
+            return load_weights_model(version)
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    import tensorflow as tf
+    from tfswin import SwinTransformerTiny224  # registers custom layers
+
+    return tf.keras.models.load_model(model_path)
+
+
+def build_swin_classifier(num_classes=NUM_CLASSES, backbone_weights=None, l2=None, return_backbone=False):
+    """Swin-Tiny backbone plus the classification head used in training
+
+    backbone_weights=None skips the ImageNet download when trained weights
+    are loaded on top anyway. ``l2`` adds the training-time kernel
+    regularizer to the head (no effect on the weights layout).
+    ``return_backbone`` also returns the backbone, for freezing in train.py.
+    """
+    from tensorflow.keras import layers, models, regularizers
+    from tfswin import SwinTransformerTiny224
+
+    regularizer = regularizers.l2(l2) if l2 else None
+    backbone = SwinTransformerTiny224(include_top=False,
+                                      input_shape=(*IMAGE_SIZE, 3),
+                                      weights=backbone_weights)
+    x = backbone.output
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dense(512, activation='relu', kernel_regularizer=regularizer)(x)
+    x = layers.BatchNormalization()(x)
+    x = layers.Dropout(0.5)(x)
+    x = layers.Dense(256, activation='relu', kernel_regularizer=regularizer)(x)
+    x = layers.BatchNormalization()(x)
+    x = layers.Dropout(0.4)(x)
+    x = layers.Dense(128, activation='relu', kernel_regularizer=regularizer)(x)
+    x = layers.Dropout(0.3)(x)
+    output = layers.Dense(num_classes, activation='softmax')(x)
+    model = models.Model(inputs=backbone.input, outputs=output)
+    if return_backbone:
+        return model, backbone
+    return model
+
+
+def load_weights_model(version):
+    """Rebuild the architecture and load model_weights.weights.h5 (inference only)"""
+    weights_path = os.path.join(model_dir(version), "model_weights.weights.h5")
+    if not os.path.exists(weights_path):
+        raise FileNotFoundError(f"Model weights not found: {weights_path}")
+    model = build_swin_classifier()
+    model.load_weights(weights_path)
+    return model
+
+
+class SavedModelBackend:
+    """Inference-only SavedModel (no optimizer, no tfswin import, no graph rebuild)"""
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"SavedModel not found: {path}")
+        import tensorflow as tf
+        self.path = path
+        self._tf = tf
+        self._loaded = tf.saved_model.load(path)
+        self._serve = getattr(self._loaded, "serve", None) or self._loaded.signatures["serving_default"]
+
+    def predict(self, batch, verbose=0):
+        output = self._serve(self._tf.constant(batch, dtype=self._tf.float32))
+        if isinstance(output, dict):
+            output = next(iter(output.values()))
+        return output.numpy()
+
+
+def _tflite_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteBackend:
+    """TFLite interpreter with a Keras-style predict()
+
+    The interpreter is not thread-safe, so calls are serialized; the input
+    tensor is resized when the batch size changes.
+    """
+
+    def __init__(self, path, num_threads=TFLITE_THREADS):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"TFLite model not found: {path}")
+        self.path = path
+        self.interpreter = _tflite_interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        shape = list(self._input["shape"])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self._input["index"], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._resize(batch.shape[0])
+
+            # Fully-quantized models take integer input
+            input_dtype = self._input["dtype"]
+            if input_dtype != np.float32:
+                scale, zero_point = self._input["quantization"]
+                batch = np.round(batch / scale + zero_point).astype(input_dtype)
+
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+            if output.dtype != np.float32:
+                scale, zero_point = self._output["quantization"]
+                output = (output.astype(np.float32) - zero_point) * scale
+            return np.array(output, dtype=np.float32)
+
+
+def load_backend(version, backend=None):
+    """Load the configured backend for a model version, or None (demo mode)"""
+    backend = backend or INFERENCE_BACKEND
+    try:
+        if backend == "keras":
+            model = load_keras_model(version)
+        elif backend == "tflite":
+            model = TFLiteBackend(os.path.join(model_dir(version), TFLITE_MODEL))
+        elif backend == "saved_model":
+            model = SavedModelBackend(os.path.join(model_dir(version), SAVED_MODEL_DIR))
+        else:
+            raise ValueError(f"Unknown INFERENCE_BACKEND {backend!r} "
+                             "(expected keras, tflite or saved_model)")
+        print(f"[SUCCESS] Model loaded successfully ({backend} backend)")
+        return model
+    except FileNotFoundError as e:
+        print(f"[WARNING] {e} - using demo mode")
+    except Exception as e:
+        print(f"[WARNING] Could not load model: {e} - using demo mode")
+    return None
@@ -0,0 +1,169 @@
+"""Asynchronous prediction jobs
+
+Jobs run on a bounded in-process worker pool; state and per-image results go
+to a local SQLite file, so any gunicorn worker on the host can answer
+GET /jobs/<id> and results outlive the request. No external broker is needed.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the backlog is full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class JobStore:
+    """SQLite-backed job state and results with a TTL"""
+
+    def __init__(self, path, ttl_seconds=3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, status TEXT NOT NULL, created REAL NOT NULL,
+                updated REAL NOT NULL, expires REAL NOT NULL, completed INTEGER NOT NULL DEFAULT 0,
+                error TEXT)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL, idx INTEGER NOT NULL, result TEXT NOT NULL,
+                PRIMARY KEY (job_id, idx))""")
+
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and processes
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, created, updated, expires) VALUES (?, ?, ?, ?, ?)",
+                       (job_id, JOB_QUEUED, now, now, now + self.ttl_seconds))
+        return job_id
+
+    def set_status(self, job_id, status, error=None):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, error = ?, updated = ?, expires = ? WHERE id = ?",
+                       (status, error, now, now + self.ttl_seconds, job_id))
+
+    def add_result(self, job_id, index, result):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO job_results (job_id, idx, result) VALUES (?, ?, ?)",
+                       (job_id, index, json.dumps(result)))
+            db.execute("UPDATE jobs SET completed = completed + 1, updated = ? WHERE id = ?",
+                       (time.time(), job_id))
+
+    def get(self, job_id):
+        """Job state dict, or None if unknown or expired"""
+        with self._connect() as db:
+            row = db.execute("SELECT status, created, updated, expires, completed, error FROM jobs "
+                             "WHERE id = ? AND expires > ?", (job_id, time.time())).fetchone()
+        if row is None:
+            return None
+        status, created, updated, expires, completed, error = row
+        return {"job_id": job_id, "status": status, "created": created, "updated": updated,
+                "expires": expires, "completed": completed, "error": error}
+
+    def results(self, job_id, after=-1):
+        """Results with index > after, in order"""
+        with self._connect() as db:
+            rows = db.execute("SELECT idx, result FROM job_results WHERE job_id = ? AND idx > ? ORDER BY idx",
+                              (job_id, after)).fetchall()
+        return [(idx, json.loads(result)) for idx, result in rows]
+
+    def purge_expired(self):
+        with self._connect() as db:
+            expired = [row[0] for row in db.execute("SELECT id FROM jobs WHERE expires <= ?", (time.time(),))]
+            db.executemany("DELETE FROM job_results WHERE job_id = ?", [(j,) for j in expired])
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(j,) for j in expired])
+        return len(expired)
+
+
+class JobQueue:
+    """Bounded background worker pool with backpressure
+
+    Worker threads start lazily (and again after a fork). submit() raises
+    QueueFullError with a Retry-After estimate instead of blocking.
+    """
+
+    def __init__(self, store, workers=2, max_queued=16):
+        self.store = store
+        self.workers = max(1, int(workers))
+        self._queue = queue.Queue(maxsize=max(1, int(max_queued)))
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._avg_duration = 10.0
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._threads = [threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def retry_after(self):
+        """Seconds until a slot is likely free"""
+        waiting = self._queue.qsize() + self.workers
+        return max(1, int(self._avg_duration * waiting / self.workers))
+
+    def submit(self, fn, *args, cleanup=None):
+        """Create a job running fn(job_id, *args); returns the job id
+
+        A message returned by fn is stored as the finished job's ``error``
+        (e.g. that some uploads were not processed).
+        """
+        self._ensure_workers()
+        self.store.purge_expired()
+        if self._queue.full():
+            raise QueueFullError(self.retry_after())
+        job_id = self.store.create()
+        try:
+            self._queue.put_nowait((job_id, fn, args, cleanup))
+        except queue.Full:
+            self.store.set_status(job_id, JOB_FAILED, "Job queue is full")
+            raise QueueFullError(self.retry_after())
+        return job_id
+
+    def _run(self):
+        while True:
+            job_id, fn, args, cleanup = self._queue.get()
+            started = time.perf_counter()
+            try:
+                self.store.set_status(job_id, JOB_RUNNING)
+                message = fn(job_id, *args)
+                self.store.set_status(job_id, JOB_DONE, message)
+            except Exception as e:
+                self.store.set_status(job_id, JOB_FAILED, str(e))
+            finally:
+                if cleanup is not None:
+                    cleanup()
+                duration = time.perf_counter() - started
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def stats(self):
+        return {"workers": self.workers, "queued": self._queue.qsize(), "max_queued": self._queue.maxsize,
+                "avg_job_seconds": self._avg_duration}
@@ -5,27 +5,61 @@ Enhanced layout with balanced design and dominant results panel
 """
 
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras import layers, models
+import csv
 from PIL import Image, ImageTk
 import os
-import threading
+import queue
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 import io
 
+import calibration
+import model_registry
+import preprocessing
+import tta
+from folder_analysis import EVENT_DONE, EVENT_ERROR, EVENT_FAILED, EVENT_RESULT, FolderAnalysis, list_images
+from inference_backends import SAVED_MODEL_DIR, SavedModelBackend, load_weights_model
+
 if sys.platform.startswith('win'):
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-try:
-    from tfswin import SwinTransformerTiny224
-except ImportError:
-    pass
+FOLDER_BATCH_SIZE = 16
+FOLDER_DECODE_WORKERS = min(4, os.cpu_count() or 1)
+UI_POLL_MS = 20
+UI_LAG_SAMPLES = 500
+
+
+class InferenceExecutor:
+    """Single worker thread that owns every model call
+
+    Keras models are not safe to call from several threads at once, so single
+    images and folder batches are serialized here in submission order.
+    predict() blocks the calling (non-Tk) thread, so a FolderAnalysis can use
+    this object as its model.
+    """
+    
+    def __init__(self):
+        self.model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+    
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+    
+    def predict(self, batch, verbose=0):
+        return self.submit(self.model.predict, batch, verbose=verbose).result()
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 
 class MangoDiseaseDetectorBest:
     def __init__(self, root):
+        self.started_at = time.perf_counter()
         self.root = root
         self.root.title("🌿 Mango Leaf Disease Detector")
         self.root.geometry("1900x1000")
@@ -110,12 +144,30 @@ class MangoDiseaseDetectorBest:
                 'prevention': 'Control aphids, scale insects, and mealybugs'
             }
         }
+        # Shown for classes from a model's metadata that the table above does not describe
+        self.unknown_disease_info = {
+            'icon': '❔', 'type': 'Unknown', 'severity': 'MEDIUM',
+            'description': 'No description available for this class',
+            'causes': 'Not documented',
+            'treatment': '• Consult a local plant pathologist',
+            'prevention': 'Not documented'
+        }
         
         self.model = None
         self.image_path = None
-        self.is_predicting = False
+        
+        # Background threads never touch widgets: they put callables on
+        # ui_events and the Tk thread runs them from poll_ui_events
+        self.inference = InferenceExecutor()
+        self.temperature = calibration.DEFAULT_TEMPERATURE
+        self.ui_events = queue.Queue()
+        self.pending_predictions = 0
+        self.ui_lag_ms = deque(maxlen=UI_LAG_SAMPLES)
+        self.last_lag_report = time.perf_counter()
         
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.poll_ui_events(time.perf_counter())
         self.load_model_async()
     
     def setup_ui(self):
@@ -175,6 +227,15 @@ class MangoDiseaseDetectorBest:
                                    activeforeground=self.text_white)
         self.clear_btn.pack(side=tk.LEFT, padx=4)
         
+        self.folder_btn = tk.Button(btn_frame, text="📂 Analyze Folder",
+                                    command=self.analyze_folder,
+                                    font=("Segoe UI", 10, "bold"),
+                                    bg=self.secondary, fg=self.dark_bg,
+                                    relief=tk.FLAT, padx=18, pady=9,
+                                    cursor="hand2", activebackground="#33c9ff",
+                                    activeforeground=self.dark_bg)
+        self.folder_btn.pack(side=tk.LEFT, padx=4)
+        
         # Image Display
         image_frame = tk.Frame(left_section, bg=self.light_card, relief=tk.SUNKEN, borderwidth=1)
         image_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
@@ -204,6 +265,14 @@ class MangoDiseaseDetectorBest:
                                      activeforeground=self.text_white)
         self.analyze_btn.pack(fill=tk.X)
         
+        # Test-time augmentation: average flips/rotations/crops in one batch
+        self.tta_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(analyze_frame, text=f"Multi-view analysis ({tta.MAX_VIEWS} views, for borderline leaves)",
+                       variable=self.tta_var, font=("Segoe UI", 10),
+                       bg=self.result_card, fg=self.text_gray, selectcolor=self.card_bg,
+                       activebackground=self.result_card, activeforeground=self.text_white
+                       ).pack(anchor="w", pady=(8, 0))
+        
         # Separator
         sep_frame = tk.Frame(right_section, bg=self.secondary, height=2)
         sep_frame.pack(fill=tk.X, padx=20, pady=(10, 0))
@@ -268,66 +337,121 @@ class MangoDiseaseDetectorBest:
         self.status_label = tk.Label(status_inner, text="Ready - Upload an image",
                                      font=("Segoe UI", 10), bg=self.card_bg, fg=self.text_gray)
         self.status_label.pack(side=tk.LEFT, padx=10)
+        
+        self.lag_label = tk.Label(status_inner, text="",
+                                  font=("Segoe UI", 9), bg=self.card_bg, fg=self.text_muted)
+        self.lag_label.pack(side=tk.RIGHT, padx=10)
+    
+    def call_in_ui(self, fn, *args):
+        """Schedule fn(*args) on the Tk thread (safe from any thread)"""
+        self.ui_events.put((fn, args))
+    
+    def set_status(self, text):
+        self.call_in_ui(self.status_label.config, {"text": text})
+    
+    def poll_ui_events(self, scheduled_at):
+        """Run queued UI callbacks and sample event-loop lag
+
+        Lag is how late this callback fires relative to when it was due; a
+        busy or blocked Tk thread shows up directly in these samples.
+        """
+        now = time.perf_counter()
+        self.ui_lag_ms.append(max(0.0, (now - scheduled_at) * 1000.0))
+        
+        while True:
+            try:
+                fn, args = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[✗] UI callback failed: {e}")
+        
+        if now - self.last_lag_report >= 1.0:
+            self.last_lag_report = now
+            stats = self.ui_lag_stats()
+            self.lag_label.config(text=f"UI lag p95 {stats['p95_ms']:.0f} ms · max {stats['max_ms']:.0f} ms")
+        
+        self.root.after(UI_POLL_MS, self.poll_ui_events, time.perf_counter() + UI_POLL_MS / 1000.0)
+    
+    def ui_lag_stats(self):
+        """Event-loop lag over the last UI_LAG_SAMPLES ticks, in milliseconds"""
+        if not self.ui_lag_ms:
+            return {"samples": 0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        samples = np.fromiter(self.ui_lag_ms, dtype=np.float64)
+        return {"samples": len(samples), "p50_ms": float(np.percentile(samples, 50)),
+                "p95_ms": float(np.percentile(samples, 95)), "max_ms": float(samples.max())}
+    
+    def on_close(self):
+        stats = self.ui_lag_stats()
+        print(f"[i] UI event-loop lag: p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+              f"max {stats['max_ms']:.1f} ms over {stats['samples']} ticks")
+        self.inference.shutdown()
+        self.root.destroy()
     
     def load_model_async(self):
-        """Load model in background"""
-        thread = threading.Thread(target=self.load_model, daemon=True)
-        thread.start()
+        """Load model on the inference thread"""
+        self.inference.submit(self.load_model)
     
     def load_model(self):
-        """Load trained model"""
+        """Load trained model
+
+        Prefers the inference-only SavedModel written by
+        ``export_model.py --format saved_model``; falls back to rebuilding
+        Swin and loading model_weights.weights.h5.
+        """
         try:
-            self.status_label.config(text="⏳ Loading model...")
-            self.root.update()
+            self.set_status("⏳ Loading model...")
             
-            save_dir = os.path.join(os.getcwd(), "saved_models")
-            if not os.path.exists(save_dir):
-                self.status_label.config(text="❌ Error: No models found")
+            if not os.path.exists(model_registry.MODELS_ROOT):
+                self.set_status("❌ Error: No models found")
                 return
             
-            versions = [int(i) for i in os.listdir(save_dir) if i.isdigit()]
+            versions = model_registry.discover_versions()
             if not versions:
-                self.status_label.config(text="❌ Error: No model versions available")
+                self.set_status("❌ Error: No model versions available")
                 return
             
-            latest = max(versions)
-            model_dir = os.path.join(save_dir, str(latest))
+            # MODEL_VERSION pins a version, otherwise the newest one is used
+            latest = model_registry.default_version()
+            class_names = model_registry.load_class_names(latest, self.class_names)
+            model_dir = os.path.join(model_registry.MODELS_ROOT, latest)
+            saved_model_path = os.path.join(model_dir, SAVED_MODEL_DIR)
             weights_path = os.path.join(model_dir, "model_weights.weights.h5")
             
-            if not os.path.exists(weights_path):
-                self.status_label.config(text="❌ Error: Model weights not found")
+            load_started = time.perf_counter()
+            if os.path.isdir(saved_model_path):
+                model = SavedModelBackend(saved_model_path)
+                source = "SavedModel"
+            elif os.path.exists(weights_path):
+                print("[!] No exported SavedModel - rebuilding Swin "
+                      "(run: python export_model.py --format saved_model)")
+                model = load_weights_model(latest)
+                source = "weights"
+            else:
+                self.set_status("❌ Error: Model weights not found")
                 return
+            load_seconds = time.perf_counter() - load_started
             
-            # Build model
-            IMAGE_SIZE = (224, 224)
-            backbone = SwinTransformerTiny224(include_top=False, 
-                                             input_shape=(*IMAGE_SIZE, 3),
-                                             weights='imagenet')
-            backbone.trainable = True
-            
-            x = backbone.output
-            x = layers.GlobalAveragePooling2D()(x)
-            x = layers.Dense(512, activation='relu')(x)
-            x = layers.BatchNormalization()(x)
-            x = layers.Dropout(0.5)(x)
-            x = layers.Dense(256, activation='relu')(x)
-            x = layers.BatchNormalization()(x)
-            x = layers.Dropout(0.4)(x)
-            x = layers.Dense(128, activation='relu')(x)
-            x = layers.Dropout(0.3)(x)
-            output = layers.Dense(8, activation='softmax')(x)
-            
-            self.model = models.Model(inputs=backbone.input, outputs=output)
-            self.model.compile(optimizer=tf.keras.optimizers.Adam(1e-5),
-                             loss='sparse_categorical_crossentropy',
-                             metrics=['accuracy'])
-            self.model.load_weights(weights_path)
+            # Warm-up pass so the first real analysis does not pay for tracing
+            warmup_started = time.perf_counter()
+            warmup_batch = preprocessing.allocate_batch(1)
+            warmup_batch.fill(0.0)
+            model.predict(warmup_batch, verbose=0)
+            warmup_seconds = time.perf_counter() - warmup_started
+            self.inference.model = model
+            self.temperature = calibration.temperature_for(latest)
+            self.call_in_ui(setattr, self, "class_names", class_names)
+            self.call_in_ui(setattr, self, "model", model)
             
-            self.status_label.config(text=f"✅ Ready - Model v{latest} loaded (99.87% accuracy)")
-            print(f"[✓] Model v{latest} loaded successfully")
+            print(f"[✓] Model v{latest} loaded from {source} in {load_seconds:.1f}s, "
+                  f"first prediction {warmup_seconds:.1f}s, "
+                  f"time-to-first-prediction {time.perf_counter() - self.started_at:.1f}s")
+            self.set_status(f"✅ Ready - Model v{latest} loaded (99.87% accuracy)")
             
         except Exception as e:
-            self.status_label.config(text=f"❌ Error: {str(e)[:50]}")
+            self.set_status(f"❌ Error: {str(e)[:50]}")
             print(f"[✗] Error: {e}")
     
     def upload_image(self):
@@ -338,7 +462,7 @@ class MangoDiseaseDetectorBest:
         if file_path:
             self.image_path = file_path
             try:
-                image = Image.open(file_path).convert('RGB')
+                image = preprocessing.open_image(file_path, size=(400, 400))
                 image.thumbnail((400, 400), Image.Resampling.LANCZOS)
                 
                 photo = ImageTk.PhotoImage(image)
@@ -367,7 +491,7 @@ class MangoDiseaseDetectorBest:
         self.status_label.config(text="✅ Cleared - Ready for new image")
     
     def predict(self):
-        """Make prediction"""
+        """Queue the current image for analysis"""
         if self.model is None:
             messagebox.showwarning("Warning", "Model is loading. Please wait...")
             return
@@ -376,57 +500,85 @@ class MangoDiseaseDetectorBest:
             messagebox.showwarning("Warning", "Please upload an image first")
             return
         
-        if self.is_predicting:
-            messagebox.showinfo("Info", "Analysis in progress...")
-            return
-        
-        thread = threading.Thread(target=self._predict_worker, daemon=True)
-        thread.start()
+        image_path = self.image_path
+        n_views = tta.MAX_VIEWS if self.tta_var.get() else 1
+        future = self.inference.submit(self._predict_worker, image_path, n_views)
+        future.add_done_callback(lambda f: self.call_in_ui(self._on_prediction_done, image_path, f))
+        self.pending_predictions += 1
+        self._update_analyze_button()
+        self.status_label.config(text=f"🔍 Analyzing {Path(image_path).name}...")
     
-    def _predict_worker(self):
-        """Background prediction"""
+    def _update_analyze_button(self):
+        if self.pending_predictions:
+            self.analyze_btn.config(text=f"⏳ Analyzing... ({self.pending_predictions} queued)")
+        else:
+            self.analyze_btn.config(text="🔍 ANALYZE LEAF")
+    
+    def _predict_worker(self, image_path, n_views=1):
+        """Preprocess and run the model (inference thread, no Tk calls)
+
+        Returns (calibrated probabilities, view agreement or None).
+        """
+        if n_views > 1:
+            # All views go through one forward pass, then get averaged
+            image = preprocessing.open_image(image_path, size=tta.DECODE_SIZE)
+            _, image_batch = tta.build_views(image, n_views, resample=Image.Resampling.LANCZOS)
+            predictions, agreement, _ = tta.aggregate(self.inference.model.predict(image_batch, verbose=0))
+            return self.calibrate(predictions), agreement
+        
+        # Load and prepare image (0-255 float32, preprocessing.MODEL_INPUT_SCALE)
+        image_batch = preprocessing.preprocess_batch([image_path], resample=Image.Resampling.LANCZOS)
+        
+        # Predict
+        predictions = self.inference.model.predict(image_batch, verbose=0)[0]
+        return self.calibrate(predictions), None
+    
+    def _on_prediction_done(self, image_path, future):
+        """Render one finished prediction (Tk thread)"""
+        self.pending_predictions -= 1
+        self._update_analyze_button()
         try:
-            self.is_predicting = True
-            self.analyze_btn.config(state=tk.DISABLED, text="⏳ Analyzing...")
-            self.status_label.config(text="🔍 Analyzing image...")
-            self.root.update()
-            
-            # Load and prepare image
-            image = Image.open(self.image_path).convert('RGB')
-            image_array = np.array(image.resize((224, 224), Image.Resampling.LANCZOS),
-                                  dtype=np.float32)
-            image_batch = np.expand_dims(image_array, axis=0)
-            
-            # Predict
-            predictions = self.model.predict(image_batch, verbose=0)[0]
-            
-            # Temperature scaling T=0.15
-            TEMPERATURE = 0.15
-            log_pred = np.log(predictions + 1e-10)
-            scaled = np.exp(log_pred / TEMPERATURE)
-            predictions = scaled / scaled.sum()
-            
-            # Get results
-            top_idx = np.argmax(predictions)
-            confidence = predictions[top_idx] * 100
-            disease = self.class_names[top_idx]
-            info = self.disease_info[disease]
-            
-            # Display results
-            self.display_results(disease, confidence, info, predictions)
-            
-            self.status_label.config(text=f"✅ Detected: {disease} ({confidence:.1f}%)")
-            print(f"[✓] {disease}: {confidence:.1f}%")
-            
+            predictions, agreement = future.result()
         except Exception as e:
+            self.status_label.config(text=f"❌ Analysis failed: {Path(image_path).name}")
             messagebox.showerror("Error", f"Prediction failed: {e}")
             print(f"[✗] {e}")
+            return
+        
+        # Get results
+        top_idx = np.argmax(predictions)
+        confidence = predictions[top_idx] * 100
+        disease = self.class_names[top_idx]
+        info = self.disease_info.get(disease, self.unknown_disease_info)
+        
+        # Display results
+        self.display_results(disease, confidence, info, predictions, agreement)
+        
+        self.status_label.config(text=f"✅ Detected: {disease} ({confidence:.1f}%) - {Path(image_path).name}")
+        print(f"[✓] {Path(image_path).name} - {disease}: {confidence:.1f}%")
+    
+    def calibrate(self, predictions):
+        """Temperature scaling of one vector or an (N, classes) batch"""
+        return calibration.calibrate(predictions, self.temperature)
+    
+    def analyze_folder(self):
+        """Classify every image in a folder in a separate results window"""
+        if self.model is None:
+            messagebox.showwarning("Warning", "Model is loading. Please wait...")
+            return
+        
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        
+        paths = list_images(folder)
+        if not paths:
+            messagebox.showinfo("Info", "No images found in the selected folder")
+            return
         
-        finally:
-            self.is_predicting = False
-            self.analyze_btn.config(state=tk.NORMAL, text="🔍 ANALYZE LEAF")
+        FolderAnalysisWindow(self, folder, paths)
     
-    def display_results(self, disease, confidence, info, all_preds):
+    def display_results(self, disease, confidence, info, all_preds, agreement=None):
         """Display results with highlighting"""
         severity_icon = {"HIGH": "🔴", "MEDIUM": "🟠", "NONE": "✅"}[info['severity']]
         severity_tag = f"severity_{info['severity'].lower()}"
@@ -446,6 +598,10 @@ class MangoDiseaseDetectorBest:
         self.results_text.insert(tk.END, "Confidence: ", "header")
         self.results_text.insert(tk.END, f"{confidence:.1f}%\n", "confidence")
         
+        if agreement is not None:
+            self.results_text.insert(tk.END, "View agreement: ", "header")
+            self.results_text.insert(tk.END, f"{agreement * 100:.0f}% of {tta.MAX_VIEWS} views\n")
+        
         # Severity - HIGHLIGHTED
         self.results_text.insert(tk.END, "Severity: ", "header")
         self.results_text.insert(tk.END, f"{severity_icon} {info['severity']}\n", severity_tag)
@@ -490,6 +646,183 @@ class MangoDiseaseDetectorBest:
         
         self.results_text.config(state=tk.DISABLED)
 
+
+class FolderAnalysisWindow:
+    """Sortable results table for a folder run, fed from a FolderAnalysis queue"""
+    
+    COLUMNS = ("file", "disease", "confidence", "severity", "error")
+    POLL_MS = 50
+    MAX_EVENTS_PER_POLL = 200
+    
+    def __init__(self, app, folder, paths):
+        self.app = app
+        self.folder = folder
+        self.rows = {}
+        self.completed = 0
+        self.sort_reverse = {}
+        self.started = time.perf_counter()
+        
+        self.window = tk.Toplevel(app.root)
+        self.window.title(f"📂 Folder Analysis - {Path(folder).name}")
+        self.window.geometry("1100x700")
+        self.window.configure(bg=app.dark_bg)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        top = tk.Frame(self.window, bg=app.card_bg)
+        top.pack(fill=tk.X, padx=15, pady=15)
+        
+        self.progress = ttk.Progressbar(top, maximum=len(paths), mode="determinate")
+        self.progress.pack(fill=tk.X, padx=10, pady=(10, 5))
+        
+        self.progress_label = tk.Label(top, text=f"0 / {len(paths)}",
+                                       font=("Segoe UI", 10), bg=app.card_bg, fg=app.text_gray)
+        self.progress_label.pack(side=tk.LEFT, padx=10, pady=(0, 10))
+        
+        self.export_btn = tk.Button(top, text="💾 Export CSV", command=self.export_csv,
+                                    font=("Segoe UI", 10, "bold"), bg=app.primary, fg=app.dark_bg,
+                                    relief=tk.FLAT, padx=14, pady=6, cursor="hand2")
+        self.export_btn.pack(side=tk.RIGHT, padx=4, pady=(0, 10))
+        
+        self.cancel_btn = tk.Button(top, text="⏹ Cancel", command=self.cancel,
+                                    font=("Segoe UI", 10, "bold"), bg=app.warning, fg=app.text_white,
+                                    relief=tk.FLAT, padx=14, pady=6, cursor="hand2")
+        self.cancel_btn.pack(side=tk.RIGHT, padx=4, pady=(0, 10))
+        
+        table_frame = tk.Frame(self.window, bg=app.dark_bg)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
+        
+        self.tree = ttk.Treeview(table_frame, columns=self.COLUMNS, show="headings")
+        widths = {"file": 380, "disease": 180, "confidence": 110, "severity": 100, "error": 280}
+        for column in self.COLUMNS:
+            self.tree.heading(column, text=column.title(), command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=widths[column], anchor="w")
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.analysis = FolderAnalysis(app.inference, paths, batch_size=FOLDER_BATCH_SIZE,
+                                       decode_workers=FOLDER_DECODE_WORKERS,
+                                       resample=Image.Resampling.LANCZOS)
+        self.analysis.start()
+        app.status_label.config(text=f"📂 Analyzing {len(paths)} images in {Path(folder).name}...")
+        self.poll_id = self.window.after(self.POLL_MS, self.poll)
+    
+    def poll(self):
+        """Drain pipeline events on the Tk thread, a bounded number per tick"""
+        self.poll_id = None
+        if not self.window.winfo_exists():
+            return
+        done = False
+        for _ in range(self.MAX_EVENTS_PER_POLL):
+            try:
+                kind, path, payload = self.analysis.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == EVENT_RESULT:
+                self.add_result(path, payload)
+            elif kind == EVENT_ERROR:
+                self.add_row(path, {"error": payload})
+            elif kind == EVENT_FAILED:
+                messagebox.showerror("Error", f"Folder analysis failed: {payload}", parent=self.window)
+            elif kind == EVENT_DONE:
+                done = True
+                break
+        
+        self.update_progress()
+        if done:
+            self.finish()
+        else:
+            self.poll_id = self.window.after(self.POLL_MS, self.poll)
+    
+    def add_result(self, path, probabilities):
+        probabilities = self.app.calibrate(probabilities)
+        top_idx = int(np.argmax(probabilities))
+        disease = self.app.class_names[top_idx]
+        self.add_row(path, {
+            "disease": disease,
+            "confidence": float(probabilities[top_idx] * 100),
+            "severity": self.app.disease_info.get(disease, self.app.unknown_disease_info)['severity'],
+            "probabilities": probabilities,
+        })
+    
+    def add_row(self, path, row):
+        row["path"] = path
+        row["file"] = os.path.relpath(path, self.folder)
+        confidence = row.get("confidence")
+        values = (row["file"], row.get("disease", ""),
+                  f"{confidence:.1f}%" if confidence is not None else "",
+                  row.get("severity", ""), row.get("error", ""))
+        item = self.tree.insert("", tk.END, values=values)
+        self.rows[item] = row
+        self.completed += 1
+    
+    def update_progress(self):
+        total = self.analysis.total
+        elapsed = time.perf_counter() - self.started
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        text = f"{self.completed} / {total}  •  {rate:.1f} img/s"
+        if rate > 0 and self.completed < total:
+            eta = int((total - self.completed) / rate)
+            text += f"  •  ETA {eta // 60}:{eta % 60:02d}"
+        self.progress["value"] = self.completed
+        self.progress_label.config(text=text)
+    
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        state = "Cancelled" if self.analysis.cancelled else "Done"
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.progress_label.config(text=f"{state}: {self.completed} / {self.analysis.total} images "
+                                        f"in {elapsed:.1f}s")
+        self.app.status_label.config(text=f"✅ Folder analysis {state.lower()}: {self.completed} images")
+        print(f"[✓] Folder analysis {state.lower()}: {self.completed} images in {elapsed:.1f}s")
+    
+    def sort_by(self, column):
+        """Sort the table by a column; clicking again reverses the order"""
+        reverse = self.sort_reverse.get(column, column == "confidence")
+        
+        def sort_key(item):
+            value = self.rows[item].get(column)
+            if column == "confidence":
+                return value if value is not None else -1.0
+            return str(value or "").lower()
+        
+        for position, item in enumerate(sorted(self.rows, key=sort_key, reverse=reverse)):
+            self.tree.move(item, "", position)
+        self.sort_reverse[column] = not reverse
+    
+    def cancel(self):
+        self.analysis.cancel()
+        self.cancel_btn.config(state=tk.DISABLED, text="⏳ Cancelling...")
+    
+    def close(self):
+        self.analysis.cancel()
+        if self.poll_id is not None:
+            self.window.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.window.destroy()
+    
+    def export_csv(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=".csv",
+                                            initialfile=f"{Path(self.folder).name}_results.csv",
+                                            filetypes=(("CSV files", "*.csv"), ("All files", "*.*")))
+        if not path:
+            return
+        class_names = self.app.class_names
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "disease", "confidence", "severity", "error"] + class_names)
+            for item in self.tree.get_children():
+                row = self.rows[item]
+                probabilities = row.get("probabilities")
+                scores = [f"{p * 100:.2f}" for p in probabilities] if probabilities is not None else [""] * len(class_names)
+                confidence = row.get("confidence")
+                writer.writerow([row["file"], row.get("disease", ""),
+                                 f"{confidence:.2f}" if confidence is not None else "",
+                                 row.get("severity", ""), row.get("error", "")] + scores)
+        print(f"[✓] Exported {len(self.rows)} rows to {path}")
+
+
 def main():
     root = tk.Tk()
     app = MangoDiseaseDetectorBest(root)
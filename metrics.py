@@ -0,0 +1,117 @@
+"""Prometheus metrics for the inference service
+
+Uses prometheus_client in multiprocess mode when PROMETHEUS_MULTIPROC_DIR is
+set (gunicorn.conf.py sets it up), so /metrics aggregates every gunicorn
+worker. Without prometheus_client installed the metrics are no-ops and
+/metrics reports that it is unavailable.
+"""
+
+import os
+
+import numpy as np
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                                   Gauge, Histogram, generate_latest, multiprocess)
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    """Stand-in when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+# Latency buckets in seconds: 1 ms .. 60 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Browser-resized uploads land in the first buckets, original phone photos in the last
+UPLOAD_BYTES_BUCKETS = (16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+
+if PROMETHEUS_AVAILABLE:
+    REQUEST_LATENCY = Histogram("mango_request_latency_seconds", "HTTP request latency",
+                                ["endpoint", "status"], buckets=LATENCY_BUCKETS)
+    DECODE_TIME = Histogram("mango_image_decode_seconds", "Image decode time per image",
+                            buckets=LATENCY_BUCKETS)
+    PREPROCESS_TIME = Histogram("mango_preprocess_seconds", "Resize and normalize time per image",
+                                buckets=LATENCY_BUCKETS)
+    MODEL_TIME = Histogram("mango_model_forward_seconds", "Model forward pass time per call",
+                           ["route"], buckets=LATENCY_BUCKETS)
+    PREDICTIONS = Counter("mango_predictions_total", "Predictions by class", ["disease"])
+    CONFIDENCE_BANDS = Counter("mango_confidence_band_total", "Predictions by confidence band", ["band"])
+    CACHE_LOOKUPS = Counter("mango_prediction_cache_total", "Prediction cache lookups", ["result"])
+    UPLOAD_BYTES = Histogram("mango_upload_bytes", "Size of each accepted uploaded image",
+                             buckets=UPLOAD_BYTES_BUCKETS)
+    UPLOAD_REJECTIONS = Counter("mango_upload_rejections_total", "Uploads refused before decoding", ["reason"])
+    IN_FLIGHT = Gauge("mango_inflight_requests", "Requests being handled", multiprocess_mode="livesum")
+    MODEL_MEMORY = Gauge("mango_model_memory_bytes", "Memory held by model weights",
+                         multiprocess_mode="max")
+    ADMISSION_WAIT = Histogram("mango_admission_wait_seconds", "Time waiting for an in-flight slot",
+                               ["lane"], buckets=LATENCY_BUCKETS)
+    ADMISSION_REJECTIONS = Counter("mango_admission_rejections_total", "Requests refused by admission control",
+                                   ["reason"])
+    WARMUP_SECONDS = Gauge("mango_model_warmup_seconds", "Time to warm a model version at every batch size",
+                           ["version"], multiprocess_mode="max")
+else:
+    REQUEST_LATENCY = DECODE_TIME = PREPROCESS_TIME = MODEL_TIME = _NoopMetric()
+    PREDICTIONS = CONFIDENCE_BANDS = CACHE_LOOKUPS = IN_FLIGHT = MODEL_MEMORY = _NoopMetric()
+    UPLOAD_BYTES = UPLOAD_REJECTIONS = WARMUP_SECONDS = ADMISSION_WAIT = ADMISSION_REJECTIONS = _NoopMetric()
+
+
+def observe_stages(timings, route="predict"):
+    """Record StageTimer timings (milliseconds) for one image"""
+    if "decode" in timings:
+        DECODE_TIME.observe(timings["decode"] / 1000.0)
+    preprocess_ms = timings.get("resize", 0.0) + timings.get("normalize", 0.0)
+    if preprocess_ms:
+        PREPROCESS_TIME.observe(preprocess_ms / 1000.0)
+    if "model" in timings:
+        MODEL_TIME.labels(route=route).observe(timings["model"] / 1000.0)
+
+
+def record_prediction(disease, band):
+    PREDICTIONS.labels(disease=disease).inc()
+    CONFIDENCE_BANDS.labels(band=band).inc()
+
+
+def model_memory_bytes(model):
+    """Bytes of weights held by a Keras model, or the size of an exported artifact"""
+    if model is None:
+        return 0
+    weights = getattr(model, "weights", None)
+    if weights is not None:
+        return int(sum(int(np.prod(w.shape)) * np.dtype(w.dtype).itemsize for w in weights))
+    path = getattr(model, "path", None)
+    if path and os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def render():
+    """(body, content type) for the /metrics endpoint, aggregated across workers"""
+    if not PROMETHEUS_AVAILABLE:
+        return None, CONTENT_TYPE_LATEST
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
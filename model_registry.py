@@ -0,0 +1,319 @@
+"""Model registry shared by app.py, model_server.py and mango_ui_best.py
+
+Versions live in saved_models/<n>/ next to the metadata.json written by the
+training notebook; its ``class_names`` are the label order for that version.
+
+The registry keeps one or two versions loaded and routes each request:
+
+    MODEL_VERSION      primary version (default: newest in saved_models/)
+    MODEL_VERSION_B    optional second version for an A/B split
+    MODEL_AB_SPLIT     fraction of traffic sent to MODEL_VERSION_B (0-1)
+
+A caller takes a LoadedModel from select() and uses that object for the whole
+request. configure() loads and warms new versions before swapping them in, so
+requests that are already running finish on the version they started with.
+
+Warming runs a zero batch at every size in ``warmup_batch_sizes`` so graph
+tracing and kernel selection happen before the version takes traffic.
+WARMUP_BATCH_SIZES (comma-separated) overrides the sizes the callers pass.
+After warm-up a version only runs at those sizes: LoadedModel.predict splits
+larger batches and zero-pads a partial one up to the next warmed size.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+import preprocessing
+
+MODELS_ROOT = os.path.join(os.getcwd(), "saved_models")
+MODEL_VERSION = os.environ.get("MODEL_VERSION") or None
+MODEL_VERSION_B = os.environ.get("MODEL_VERSION_B") or None
+MODEL_AB_SPLIT = float(os.environ.get("MODEL_AB_SPLIT", 0.0))
+WARMUP_BATCH_SIZES = os.environ.get("WARMUP_BATCH_SIZES") or None
+
+# Label order used when a version has no metadata.json
+DEFAULT_CLASS_NAMES = ['Anthracnose', 'Bacterial Canker', 'Cutting Weevil', 'Die Back',
+                       'Gall Midge', 'Healthy', 'Powdery Mildew', 'Sooty Mould']
+
+
+class ModelRegistryError(Exception):
+    """A model version could not be found, loaded or validated"""
+
+
+class VersionNotLoadedError(ModelRegistryError, KeyError):
+    """A request pinned a version that is not currently loaded"""
+
+
+def discover_versions(root=MODELS_ROOT):
+    """Numeric version directories under root, oldest first"""
+    if not os.path.isdir(root):
+        return []
+    return [str(v) for v in sorted(int(name) for name in os.listdir(root) if name.isdigit())]
+
+
+def latest_version(root=MODELS_ROOT):
+    versions = discover_versions(root)
+    return versions[-1] if versions else None
+
+
+def read_metadata(version, root=MODELS_ROOT):
+    """saved_models/<version>/metadata.json as a dict ({} if absent)"""
+    path = os.path.join(root, str(version), "metadata.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def default_version(root=MODELS_ROOT):
+    """MODEL_VERSION if set, else the newest version on disk, else "7" """
+    return MODEL_VERSION or latest_version(root) or "7"
+
+
+def warmup_batch_sizes(max_batch_size, *extra_sizes):
+    """Sizes to warm: WARMUP_BATCH_SIZES if set, else 1..max_batch_size plus ``extra_sizes``"""
+    if WARMUP_BATCH_SIZES:
+        sizes = {int(size) for size in WARMUP_BATCH_SIZES.split(",") if size.strip()}
+    else:
+        sizes = set(range(1, max(1, int(max_batch_size)) + 1)) | {int(size) for size in extra_sizes}
+    return sorted(size for size in sizes if size > 0)
+
+
+def load_class_names(version, default=DEFAULT_CLASS_NAMES, root=MODELS_ROOT):
+    """Label order for a version: metadata.json class_names, else ``default``
+
+    Raises ModelRegistryError when the metadata lists a different number of
+    classes than expected or repeats a name.
+    """
+    class_names = read_metadata(version, root).get("class_names")
+    if not class_names:
+        print(f"[WARNING] No class_names in metadata.json for v{version} - using built-in labels")
+        return list(default)
+    class_names = [str(name) for name in class_names]
+    if len(set(class_names)) != len(class_names):
+        raise ModelRegistryError(f"v{version} metadata.json has duplicate class_names")
+    if len(class_names) != len(default):
+        raise ModelRegistryError(f"v{version} metadata.json lists {len(class_names)} classes, "
+                                 f"expected {len(default)}")
+    unknown = sorted(set(class_names) - set(default))
+    if unknown:
+        print(f"[WARNING] v{version} has classes without disease info: {', '.join(unknown)}")
+    if class_names != list(default) and not unknown:
+        print(f"[INFO] v{version} uses a different label order than the built-in list")
+    return class_names
+
+
+class LoadedModel:
+    """One loaded version: the model, its label order and optional micro-batcher
+
+    ``embedder`` (see embeddings.build_embedder) returns the pooled backbone
+    features alongside the probabilities; None when the backend has no
+    intermediate outputs.
+    """
+
+    def __init__(self, version, model, class_names, batcher=None, info=None, embedder=None):
+        self.version = str(version)
+        self.model = model
+        self.class_names = list(class_names)
+        self.batcher = batcher
+        self.embedder = embedder
+        self.info = info or {}
+        self.loaded_at = time.time()
+        # Sorted warmed batch sizes, set by ModelRegistry.warm_up; empty runs any size
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        """Probabilities for an (N, height, width, 3) batch, run at warmed batch sizes only"""
+        sizes = self.batch_sizes
+        if not sizes or len(batch) in sizes:
+            return self.model.predict(batch, verbose=0)
+        outputs = []
+        for start in range(0, len(batch), sizes[-1]):
+            chunk = batch[start:start + sizes[-1]]
+            count = len(chunk)
+            size = next(size for size in sizes if size >= count)
+            if size != count:
+                chunk = np.concatenate([chunk, np.zeros((size - count, *chunk.shape[1:]), dtype=chunk.dtype)])
+            outputs.append(np.asarray(self.model.predict(chunk, verbose=0))[:count])
+        return np.concatenate(outputs)
+
+    def predict_one(self, image):
+        """Probability vector for one (height, width, 3) image, micro-batched if enabled"""
+        if self.batcher is not None:
+            return self.batcher.predict(image)
+        return self.model.predict(np.expand_dims(image, axis=0), verbose=0)[0]
+
+    def embed(self, batch):
+        """(embeddings, probabilities) for a batch from one forward pass"""
+        if self.embedder is None:
+            from embeddings import EmbeddingsUnavailable
+            raise EmbeddingsUnavailable(f"Model v{self.version} backend does not expose embeddings")
+        embeddings, probabilities = self.embedder.predict(batch, verbose=0)
+        return np.asarray(embeddings), np.asarray(probabilities)
+
+    def close(self):
+        """Release the batcher thread; the model itself is freed with the last reference"""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def stats(self):
+        return {"version": self.version, "loaded_at": self.loaded_at, "classes": len(self.class_names),
+                "embeddings": self.embedder is not None,
+                "batching": self.batcher.stats() if self.batcher is not None else None, **self.info}
+
+
+def backend_loader(batching=True, max_batch_size=8, max_wait_ms=5.0, backend=None):
+    """Registry loader using inference_backends.load_backend (+ a MicroBatcher)"""
+    from batching import MicroBatcher
+    from embeddings import build_embedder
+    from inference_backends import INFERENCE_BACKEND, load_backend
+    from metrics import model_memory_bytes
+
+    def load(version):
+        class_names = load_class_names(version)
+        model = load_backend(version, backend)
+        if model is None:
+            raise ModelRegistryError(f"Could not load model v{version}")
+        batcher = None
+        if batching:
+            batcher = MicroBatcher(lambda batch: model.predict(batch, verbose=0),
+                                   max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        return LoadedModel(version, model, class_names, batcher=batcher, embedder=build_embedder(model),
+                           info={"backend": backend or INFERENCE_BACKEND,
+                                 "model_memory_bytes": model_memory_bytes(model)})
+    return load
+
+
+class ModelRegistry:
+    """Loaded versions plus the routing between them
+
+    ``loader(version)`` returns a LoadedModel (or raises); it is called
+    outside the lock, so a slow load never blocks predictions.
+    """
+
+    def __init__(self, loader, warmup_batch_sizes=(1,)):
+        self.loader = loader
+        self.warmup_batch_sizes = sorted(set(warmup_batch_sizes)) or [1]
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._models = {}
+        self.primary = None
+        self.secondary = None
+        self.split = 0.0
+        self.reloads = 0
+
+    def load(self, version):
+        """Load, warm up and validate one version without routing traffic to it"""
+        version = str(version)
+        started = time.perf_counter()
+        loaded = self.loader(version)
+        loaded_at = time.perf_counter()
+        try:
+            warmup_ms = self.warm_up(loaded)
+        except Exception:
+            loaded.close()
+            raise
+        warmup_seconds = time.perf_counter() - loaded_at
+        loaded.info.setdefault("load_seconds", loaded_at - started)
+        loaded.info["warmup_seconds"] = warmup_seconds
+        loaded.info["warmup_ms"] = warmup_ms
+        print(f"[INFO] v{version} warmed at batch sizes {self.warmup_batch_sizes} in {warmup_seconds:.1f}s")
+        return loaded
+
+    def warm_up(self, loaded):
+        """Run a zero batch at every warmup size; returns {batch size: ms}
+
+        Raises ModelRegistryError when the output width does not match the
+        version's class names.
+        """
+        buffer = preprocessing.allocate_batch(max(self.warmup_batch_sizes))
+        buffer.fill(0.0)
+        timings = {}
+        for size in self.warmup_batch_sizes:
+            started = time.perf_counter()
+            output = np.asarray(loaded.predict(buffer[:size]))
+            timings[size] = (time.perf_counter() - started) * 1000.0
+            if output.shape[-1] != len(loaded.class_names):
+                raise ModelRegistryError(f"v{loaded.version} outputs {output.shape[-1]} classes but has "
+                                         f"{len(loaded.class_names)} class names")
+        if loaded.batcher is not None:
+            loaded.predict_one(buffer[0])  # starts the batcher thread
+        if loaded.embedder is not None:
+            loaded.embed(buffer[:1])
+        loaded.batch_sizes = list(self.warmup_batch_sizes)
+        return timings
+
+    def configure(self, primary, secondary=None, split=0.0):
+        """Route traffic to ``primary`` (and ``split`` of it to ``secondary``)
+
+        Versions already loaded are reused; new ones are loaded and warmed
+        before the swap. Versions no longer routed are closed afterwards, and
+        requests still holding them finish normally.
+        """
+        primary = str(primary)
+        secondary = str(secondary) if secondary else None
+        split = min(max(float(split), 0.0), 1.0) if secondary else 0.0
+        with self._reload_lock:
+            wanted = [v for v in (primary, secondary) if v]
+            with self._lock:
+                fresh = {v: self._models[v] for v in wanted if v in self._models}
+            for version in wanted:
+                if version not in fresh:
+                    fresh[version] = self.load(version)
+
+            with self._lock:
+                retired = [m for v, m in self._models.items() if v not in fresh]
+                self._models = fresh
+                self.primary, self.secondary, self.split = primary, secondary, split
+                self.reloads += 1
+            for loaded in retired:
+                loaded.close()
+                print(f"[INFO] Model v{loaded.version} retired")
+        print(f"[SUCCESS] Serving v{primary}" + (f", {split:.0%} to v{secondary}" if secondary else ""))
+        return self.routing()
+
+    def get(self, version):
+        with self._lock:
+            loaded = self._models.get(str(version))
+        if loaded is None:
+            raise VersionNotLoadedError(f"Model version {version} is not loaded")
+        return loaded
+
+    def select(self, pin=None, key=None):
+        """LoadedModel for one request
+
+        ``pin`` forces a loaded version. Otherwise the A/B split applies;
+        with a ``key`` (e.g. a client id) the choice is sticky per key.
+        """
+        if pin:
+            return self.get(pin)
+        with self._lock:
+            if self.primary is None:
+                raise ModelRegistryError("No model version loaded")
+            version = self.primary
+            if self.secondary and self.split > 0.0:
+                if key:
+                    bucket = int.from_bytes(hashlib.sha256(str(key).encode()).digest()[:8], "big") / 2.0 ** 64
+                else:
+                    bucket = random.random()
+                if bucket < self.split:
+                    version = self.secondary
+            return self._models[version]
+
+    def routing(self):
+        with self._lock:
+            return {"primary": self.primary, "secondary": self.secondary, "split": self.split,
+                    "loaded": {v: m.class_names for v, m in self._models.items()}}
+
+    def stats(self):
+        with self._lock:
+            models = list(self._models.values())
+            routing = {"primary": self.primary, "secondary": self.secondary, "split": self.split,
+                       "reloads": self.reloads}
+        return {**routing, "versions": {m.version: m.stats() for m in models}}
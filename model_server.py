@@ -0,0 +1,285 @@
+"""Shared model server for gunicorn workers
+
+One process loads and warms the model; workers send preprocessed batches over
+a local Unix socket. Adding workers no longer multiplies the model's memory,
+and requests from all workers are micro-batched together.
+
+The server owns the ModelRegistry, so version routing (MODEL_VERSION,
+MODEL_VERSION_B, MODEL_AB_SPLIT) and hot reloads apply to every worker;
+RemoteRegistry is the worker-side view of it.
+
+Run standalone:
+    python model_server.py --socket /tmp/mango-model.sock
+or let gunicorn.conf.py start it (MODEL_SERVER=1).
+
+Connections are authenticated with MODEL_SERVER_AUTHKEY, which must be set
+in the environment. gunicorn.conf.py generates a random key per start when
+it is not set.
+"""
+
+import argparse
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+import model_registry
+from embeddings import EmbeddingsUnavailable
+from model_registry import ModelRegistry, VersionNotLoadedError
+
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/mango-model.sock")
+
+# How long a worker trusts its copy of the server's routing table
+ROUTING_TTL_SECONDS = 2.0
+
+
+def server_authkey():
+    """MODEL_SERVER_AUTHKEY from the environment; there is no built-in default"""
+    authkey = os.environ.get("MODEL_SERVER_AUTHKEY")
+    if not authkey:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY is not set")
+    return authkey.encode()
+
+
+class RemoteModel:
+    """Client for the model server with the same predict() call as a Keras model"""
+
+    def __init__(self, socket_path=MODEL_SERVER_SOCKET, authkey=None):
+        self.socket_path = socket_path
+        self.authkey = authkey or server_authkey()
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread (and per process after fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _call(self, message, payload=None):
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(message)
+                if payload is not None:
+                    conn.send_bytes(payload)
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Server restarted - reconnect once
+                self._local.conn = None
+                if attempt:
+                    raise
+        if status == "missing":
+            raise VersionNotLoadedError(result)
+        if status == "unavailable":
+            raise EmbeddingsUnavailable(result)
+        if status != "ok":
+            raise RuntimeError(f"Model server error: {result}")
+        return result
+
+    def info(self):
+        return self._call(("info",))
+
+    def routing(self):
+        return self._call(("routing",))
+
+    def configure(self, primary, secondary=None, split=0.0):
+        return self._call(("configure", primary, secondary, split))
+
+    def predict(self, batch, verbose=0, version=None):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self._call(("predict", batch.shape, version), memoryview(batch).cast("B"))
+
+    def embed(self, batch, version=None):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self._call(("embed", batch.shape, version), memoryview(batch).cast("B"))
+
+
+class RemoteLoadedModel:
+    """Worker-side handle for one version served by the model server
+
+    Same interface as model_registry.LoadedModel. If the version is retired
+    by a reload mid-request, the call is retried once on the new primary and
+    ``version`` is updated so the response reports what actually served it.
+    """
+
+    def __init__(self, registry, version, class_names):
+        self.registry = registry
+        self.version = version
+        self.class_names = class_names
+
+    def _call(self, method, batch):
+        try:
+            return method(batch, version=self.version)
+        except VersionNotLoadedError:
+            self.registry.refresh()
+            replacement = self.registry.select()
+            self.version, self.class_names = replacement.version, replacement.class_names
+            return method(batch, version=self.version)
+
+    def predict(self, batch):
+        return self._call(self.registry.remote.predict, batch)
+
+    def embed(self, batch):
+        return self._call(self.registry.remote.embed, batch)
+
+    def predict_one(self, image):
+        # The server micro-batches across workers, so send single images as-is
+        return self.predict(np.expand_dims(image, axis=0))[0]
+
+    def close(self):
+        pass
+
+
+class RemoteRegistry(ModelRegistry):
+    """ModelRegistry interface backed by the model server's registry"""
+
+    def __init__(self, remote):
+        super().__init__(loader=None)
+        self.remote = remote
+        self._class_names = {}
+        self._fetched = 0.0
+        self.refresh()
+
+    def refresh(self):
+        routing = self.remote.routing()
+        with self._lock:
+            self.primary, self.secondary, self.split = routing["primary"], routing["secondary"], routing["split"]
+            self._class_names = routing["loaded"]
+            self._models = {v: RemoteLoadedModel(self, v, names) for v, names in self._class_names.items()}
+            self._fetched = time.monotonic()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._fetched > ROUTING_TTL_SECONDS:
+            self.refresh()
+
+    def get(self, version):
+        self._maybe_refresh()
+        loaded = super().get(version)
+        # A fresh handle per request: RemoteLoadedModel.version may change on retry
+        return RemoteLoadedModel(self, loaded.version, loaded.class_names)
+
+    def select(self, pin=None, key=None):
+        self._maybe_refresh()
+        loaded = super().select(pin, key)
+        return RemoteLoadedModel(self, loaded.version, loaded.class_names)
+
+    def configure(self, primary, secondary=None, split=0.0):
+        routing = self.remote.configure(primary, secondary, split)
+        self.refresh()
+        return routing
+
+    def stats(self):
+        return self.remote.info().get("registry")
+
+
+def wait_for_server(socket_path=MODEL_SERVER_SOCKET, timeout=300.0):
+    """Block until the model server answers, returns its info dict"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return RemoteModel(socket_path).info()
+        except (OSError, EOFError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def server_info(registry):
+    """Current model state; built per request so it follows hot reloads"""
+    primary = registry.get(registry.primary) if registry.primary else None
+    return {"model_loaded": primary is not None,
+            "model_version": primary.version if primary else None,
+            "backend": primary.info.get("backend") if primary else None, "pid": os.getpid(),
+            "model_memory_bytes": primary.info.get("model_memory_bytes", 0) if primary else 0,
+            "registry": registry.stats()}
+
+
+def handle_connection(conn, registry):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if message[0] == "info":
+                    conn.send(("ok", server_info(registry)))
+                elif message[0] == "routing":
+                    conn.send(("ok", registry.routing()))
+                elif message[0] == "configure":
+                    conn.send(("ok", registry.configure(*message[1:])))
+                elif message[0] in ("predict", "embed"):
+                    shape, version = message[1], message[2] if len(message) > 2 else None
+                    batch = np.frombuffer(conn.recv_bytes(), dtype=np.float32).reshape(shape)
+                    if registry.primary is None:
+                        conn.send(("error", "model not loaded"))
+                        continue
+                    loaded = registry.get(version) if version else registry.select()
+                    if message[0] == "embed":
+                        conn.send(("ok", loaded.embed(batch)))
+                        continue
+                    # Per-image submit so batches from different workers are merged
+                    futures = [loaded.batcher.submit(image) for image in batch]
+                    conn.send(("ok", np.stack([f.result() for f in futures])))
+                else:
+                    conn.send(("error", f"unknown request {message[0]!r}"))
+            except (EOFError, OSError):
+                return
+            except VersionNotLoadedError as e:
+                conn.send(("missing", e.args[0]))
+            except EmbeddingsUnavailable as e:
+                conn.send(("unavailable", str(e)))
+            except Exception as e:
+                conn.send(("error", str(e)))
+
+
+def serve(socket_path=MODEL_SERVER_SOCKET, version=None):
+    """Load the model once and answer predict requests on a Unix socket"""
+    version = version or model_registry.default_version()
+    max_batch_size = int(os.environ.get("BATCH_MAX_SIZE", 8))
+    # Every request goes through the micro-batcher here, so it only forms 1..max_batch_size
+    registry = ModelRegistry(model_registry.backend_loader(
+        max_batch_size=max_batch_size,
+        max_wait_ms=float(os.environ.get("BATCH_MAX_WAIT_MS", 5))),
+        warmup_batch_sizes=model_registry.warmup_batch_sizes(max_batch_size))
+    authkey = server_authkey()
+    try:
+        registry.configure(version, model_registry.MODEL_VERSION_B, model_registry.MODEL_AB_SPLIT)
+    except Exception as e:
+        # Any load failure leaves a running server that can still be reloaded
+        print(f"[WARNING] {e} - model server has no model")
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+    os.chmod(socket_path, 0o600)
+    print(f"[SUCCESS] Model server listening on {socket_path}")
+
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"[WARNING] Rejected model server connection: {e}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn, registry), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared model server for gunicorn workers")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET)
+    parser.add_argument("--version", default=None, help="saved_models/<version> to load")
+    args = parser.parse_args()
+    serve(args.socket, args.version)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Content-addressed prediction cache
+
+Probability vectors are keyed by a hash of the uploaded bytes plus the model
+version. An in-memory LRU bounded in bytes sits in front of an optional disk
+tier that survives worker restarts and is shared by all workers on a host.
+The disk tier is bounded too: past ``disk_max_bytes`` the least recently
+used files (by mtime, refreshed on every disk hit) are deleted.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import preprocessing
+
+# Approximate per-entry bookkeeping (key string, OrderedDict node, array header)
+ENTRY_OVERHEAD = 200
+# Pruning the disk tier goes down to this fraction of the budget, so the
+# directory is not rescanned on every write once it is full
+DISK_PRUNE_TARGET = 0.9
+
+
+class PredictionCache:
+    """LRU cache of probability vectors bounded by size in bytes"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            self._prune_disk()
+
+    @staticmethod
+    def key(data, model_version):
+        """Hash of the uploaded bytes plus the model version and its input scale"""
+        digest = hashlib.sha256(f"{model_version}\0{preprocessing.MODEL_INPUT_SCALE}\0".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        """Return the cached probability vector or None"""
+        with self._lock:
+            probabilities = self._entries.get(key)
+            if probabilities is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return probabilities
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                probabilities = np.load(path, allow_pickle=False)
+                os.utime(path)  # recently used: evicted last
+            except (OSError, ValueError):
+                probabilities = None
+            if probabilities is not None:
+                self._remember(key, probabilities)
+                with self._lock:
+                    self.disk_hits += 1
+                return probabilities
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, probabilities):
+        """Store a probability vector in memory and, if enabled, on disk"""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        self._remember(key, probabilities)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                return
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename so other workers never read a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, probabilities, allow_pickle=False)
+                os.replace(tmp_path, path)
+                with self._lock:
+                    self._disk_bytes += os.path.getsize(path)
+                    over = self._disk_bytes > self.disk_max_bytes
+                if over:
+                    self._prune_disk()
+            except OSError as e:
+                print(f"[WARNING] Could not write prediction cache entry: {e}")
+
+    def _disk_files(self):
+        """(mtime, path, size) of every entry in the disk tier"""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed by another worker
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _prune_disk(self):
+        """Delete least recently used files until the disk tier is under budget
+
+        Rescans the directory, since other workers write to it too.
+        """
+        files = self._disk_files()
+        total = sum(size for _, _, size in files)
+        if total <= self.disk_max_bytes:
+            with self._lock:
+                self._disk_bytes = total
+            return
+        target = self.disk_max_bytes * DISK_PRUNE_TARGET
+        evicted = 0
+        for _, path, size in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except OSError:
+                pass  # already removed by another worker
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self.disk_evictions += evicted
+
+    def _remember(self, key, probabilities):
+        size = probabilities.nbytes + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes + ENTRY_OVERHEAD
+            self._entries[key] = probabilities
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self._disk_bytes if self.disk_dir else None,
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else None,
+                "disk_evictions": self.disk_evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
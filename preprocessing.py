@@ -0,0 +1,115 @@
+"""Image decode and preprocessing shared by app.py and mango_ui_best.py
+
+JPEGs are decoded at reduced resolution (PIL draft mode) so a 12 MP phone
+photo is never fully decoded just to be shrunk to 224x224. Resized pixels are
+written straight into a preallocated float32 buffer and scaled in place.
+"""
+
+import io
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = (224, 224)
+# The model was trained on 0-255 pixels (train.py, the notebook). The web
+# app, the desktop app and calibration all feed it this range, so a fitted
+# temperature means the same thing everywhere
+MODEL_INPUT_SCALE = 1.0
+
+# Refuse images above this many pixels before any pixel buffer is allocated
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+
+
+class ImageTooLargeError(ValueError):
+    """Image dimensions exceed MAX_IMAGE_PIXELS (possible decompression bomb)"""
+
+
+class StageTimer:
+    """Accumulate wall time per preprocessing stage, in milliseconds"""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000.0
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def _stage(timer, name):
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
+
+
+def open_image(source, size=IMAGE_SIZE, max_pixels=MAX_IMAGE_PIXELS, timer=None):
+    """Decode an image (path, bytes or file object) to RGB at reduced resolution
+
+    Only the header is read before the pixel limit is checked. For JPEGs the
+    decoder is asked for the smallest DCT scale that is still at least
+    ``size``, so large photos decode at 1/2, 1/4 or 1/8 resolution.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with _stage(timer, "decode"):
+        img = Image.open(source)
+        width, height = img.size
+        if max_pixels and width * height > max_pixels:
+            raise ImageTooLargeError(
+                f"Image is {width}x{height} pixels, limit is {max_pixels} pixels")
+        img.draft("RGB", size)
+        if img.mode == "RGB":
+            img.load()  # already RGB (most JPEGs): no converted copy
+        else:
+            img = img.convert("RGB")
+    return img
+
+
+def allocate_batch(batch_size, size=IMAGE_SIZE):
+    """Preallocated float32 batch buffer of shape (N, height, width, 3)"""
+    width, height = size
+    return np.empty((batch_size, height, width, 3), dtype=np.float32)
+
+
+def preprocess_into(img, out, scale=MODEL_INPUT_SCALE, resample=Image.Resampling.BICUBIC, timer=None):
+    """Resize an RGB image into ``out`` (height, width, 3) float32 and scale in place"""
+    height, width = out.shape[:2]
+    with _stage(timer, "resize"):
+        if img.size != (width, height):
+            img = img.resize((width, height), resample)
+        # uint8 -> float32 cast happens during the copy, no float64 intermediate
+        out[...] = np.asarray(img)
+    with _stage(timer, "normalize"):
+        if scale != 1.0:
+            np.multiply(out, scale, out=out)
+    return out
+
+
+def preprocess(source, out=None, size=IMAGE_SIZE, scale=MODEL_INPUT_SCALE,
+               resample=Image.Resampling.BICUBIC, max_pixels=MAX_IMAGE_PIXELS, timer=None):
+    """Decode and preprocess one image into ``out`` (allocated if not given)"""
+    if out is None:
+        out = allocate_batch(1, size)[0]
+    img = open_image(source, size=size, max_pixels=max_pixels, timer=timer)
+    return preprocess_into(img, out, scale=scale, resample=resample, timer=timer)
+
+
+def preprocess_batch(sources, size=IMAGE_SIZE, scale=MODEL_INPUT_SCALE,
+                     resample=Image.Resampling.BICUBIC, max_pixels=MAX_IMAGE_PIXELS, timer=None):
+    """Decode and preprocess several images into one (N, height, width, 3) batch"""
+    batch = allocate_batch(len(sources), size)
+    for i, source in enumerate(sources):
+        preprocess(source, out=batch[i], size=size, scale=scale, resample=resample,
+                   max_pixels=max_pixels, timer=timer)
+    return batch
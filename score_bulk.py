@@ -0,0 +1,359 @@
+"""Offline bulk scoring of image archives
+
+Re-scores a directory tree (or a list of paths) with a model version from
+saved_models/, using the same preprocessing and backend loading as app.py.
+Images are decoded in parallel by a tf.data pipeline (or a thread pool when
+TensorFlow is not installed, e.g. the TFLite backend on tflite_runtime) and
+scored in large batches while the next batches decode.
+
+Usage:
+    python score_bulk.py --input /data/archive --output scores_v8.parquet --version 8
+    python score_bulk.py --file-list paths.txt --output scores.jsonl --batch-size 128
+
+Results are written incrementally: CSV and JSONL are appended and flushed
+every batch, Parquet (needs pyarrow) is written as numbered part files in a
+directory. A checkpoint (<output>.checkpoint.json) records how many images
+are safely on disk; rerunning the same command resumes from there, trimming
+any rows written after the last checkpoint. If the output the checkpoint
+describes is missing or shorter, everything is scored again. Pass --restart
+to start over.
+
+Probabilities are temperature-calibrated exactly as the API does
+(calibration.temperature_for), so offline scores match /predict.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import calibration
+import preprocessing
+from model_registry import ModelRegistry, backend_loader, default_version
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+FORMATS = ("csv", "jsonl", "parquet")
+
+
+def list_inputs(input_dir=None, file_list=None):
+    """Image paths in a stable order (the checkpoint is an offset into it)"""
+    paths = []
+    if input_dir:
+        for root, dirs, files in os.walk(input_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("."):
+                    paths.append(os.path.join(root, name))
+    if file_list:
+        with open(file_list, encoding="utf-8") as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    return paths
+
+
+def inputs_digest(paths):
+    """Fingerprint of the input list, so a checkpoint is never applied to other inputs"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode("utf-8", "surrogateescape") + b"\0")
+    return digest.hexdigest()
+
+
+def _load(path):
+    """(image, error) for one path; failures become a zero image plus a message"""
+    try:
+        return preprocessing.preprocess(path), ""
+    except Exception as e:
+        width, height = preprocessing.IMAGE_SIZE
+        return np.zeros((height, width, 3), dtype=np.float32), f"Could not decode image: {e}"
+
+
+def tf_batches(paths, batch_size, workers):
+    """Yield (images, errors) batches from a tf.data pipeline with parallel decode"""
+    import tensorflow as tf
+
+    width, height = preprocessing.IMAGE_SIZE
+
+    def load(path):
+        image, error = _load(path.decode("utf-8", "surrogateescape"))
+        return image, error.encode()
+
+    def load_tf(path):
+        image, error = tf.numpy_function(load, [path], (tf.float32, tf.string))
+        return tf.ensure_shape(image, (height, width, 3)), tf.ensure_shape(error, ())
+
+    dataset = (tf.data.Dataset.from_tensor_slices(paths)
+               .map(load_tf, num_parallel_calls=workers or tf.data.AUTOTUNE, deterministic=True)
+               .batch(batch_size)
+               .prefetch(tf.data.AUTOTUNE))
+    for images, errors in dataset.as_numpy_iterator():
+        yield images, [e.decode() for e in errors]
+
+
+def thread_batches(paths, batch_size, workers):
+    """Same as tf_batches on a thread pool, one batch decoding ahead"""
+    executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="decode")
+
+    def submit(chunk):
+        return [executor.submit(_load, path) for path in chunk]
+
+    try:
+        chunks = (paths[i:i + batch_size] for i in range(0, len(paths), batch_size))
+        pending = None
+        for chunk in chunks:
+            futures = submit(chunk)
+            if pending is not None:
+                yield collect(pending)
+            pending = futures
+        if pending is not None:
+            yield collect(pending)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def collect(futures):
+    batch = preprocessing.allocate_batch(len(futures))
+    errors = []
+    for i, future in enumerate(futures):
+        batch[i], error = future.result()
+        errors.append(error)
+    return batch, errors
+
+
+class Checkpoint:
+    """Progress file written atomically after each durable flush"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class RowWriter:
+    """Append-only CSV or JSONL output; flush() returns the durable byte offset"""
+
+    def __init__(self, path, fmt, columns, resume_offset=None):
+        self.fmt = fmt
+        self.columns = columns
+        exists = resume_offset is not None and os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "wb")
+        if exists:
+            # Drop rows written after the last checkpoint
+            self.file.truncate(resume_offset)
+            self.file.seek(resume_offset)
+        self.text = io.TextIOWrapper(self.file, encoding="utf-8", newline="")
+        self.csv = csv.DictWriter(self.text, fieldnames=columns) if fmt == "csv" else None
+        if self.csv is not None and not exists:
+            self.csv.writeheader()
+
+    def write(self, rows):
+        if self.csv is not None:
+            self.csv.writerows(rows)
+        else:
+            self.text.writelines(json.dumps(row) + "\n" for row in rows)
+
+    def flush(self, final=False):
+        self.text.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self):
+        self.text.close()
+
+
+class ParquetWriter:
+    """Numbered part files in a directory; each part is complete or absent"""
+
+    def __init__(self, path, columns, rows_per_part, resume_parts=None):
+        self.path = path
+        self.columns = columns
+        self.rows_per_part = rows_per_part
+        self.parts = resume_parts or 0
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Parts after the checkpoint (or half-written temp files) are stale
+            if name.endswith(".tmp") or (name.startswith("part-") and int(name[5:10]) >= self.parts):
+                os.remove(os.path.join(path, name))
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+    def flush(self, final=False):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        while self.rows and (len(self.rows) >= self.rows_per_part or final):
+            chunk, self.rows = self.rows[:self.rows_per_part], self.rows[self.rows_per_part:]
+            table = pa.table({column: [row[column] for row in chunk] for column in self.columns})
+            target = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+            pq.write_table(table, target + ".tmp")
+            os.replace(target + ".tmp", target)
+            self.parts += 1
+        return {"parts": self.parts, "buffered": len(self.rows)}
+
+    def close(self):
+        pass
+
+
+def output_intact(path, fmt, state):
+    """Whether the rows the checkpoint counts as done are still in the output"""
+    writer = state["writer"]
+    if fmt == "parquet":
+        return all(os.path.exists(os.path.join(path, f"part-{part:05d}.parquet"))
+                   for part in range(writer["parts"]))
+    return os.path.exists(path) and os.path.getsize(path) >= writer["offset"]
+
+
+def output_format(path, fmt=None):
+    if fmt:
+        return fmt
+    lower = path.lower()
+    for candidate in FORMATS:
+        if lower.endswith("." + candidate):
+            return candidate
+    raise ValueError(f"Cannot tell the format of {path!r}; pass --format ({', '.join(FORMATS)})")
+
+
+def build_rows(paths, probabilities, errors, class_names, version):
+    """One output row per image; probabilities is (N, classes)"""
+    top = probabilities.argmax(axis=1)
+    rows = []
+    for path, probs, top_idx, error in zip(paths, probabilities, top, errors):
+        row = {"path": path, "model_version": version}
+        if error:
+            row.update({"disease": None, "probability": None, "error": error})
+            row.update({name: None for name in class_names})
+        else:
+            row.update({"disease": class_names[top_idx], "probability": float(probs[top_idx]), "error": None})
+            row.update({name: float(p) for name, p in zip(class_names, probs)})
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-score image archives with a saved model version")
+    parser.add_argument("--input", help="Directory tree of images")
+    parser.add_argument("--file-list", help="Text file with one image path per line")
+    parser.add_argument("--output", required=True, help="Output file (.csv, .jsonl) or directory (.parquet)")
+    parser.add_argument("--format", choices=FORMATS, help="Output format (default: from --output)")
+    parser.add_argument("--version", default=default_version(), help="saved_models/<version> to score with")
+    parser.add_argument("--backend", help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="Decode threads (default: auto)")
+    parser.add_argument("--pipeline", choices=["auto", "tf", "threads"], default="auto")
+    parser.add_argument("--rows-per-part", type=int, default=50_000, help="Parquet rows per part file")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    if not args.input and not args.file_list:
+        parser.error("pass --input and/or --file-list")
+    fmt = output_format(args.output, args.format)
+
+    paths = list_inputs(args.input, args.file_list)
+    if not paths:
+        print("[ERROR] No images found")
+        return 1
+    digest = inputs_digest(paths)
+
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip(os.sep) + ".checkpoint.json")
+    temperature = calibration.temperature_for(args.version)
+    state = None if args.restart else checkpoint.load()
+    if state is not None and (state["inputs"] != digest or state["version"] != str(args.version)
+                              or state["format"] != fmt or state.get("temperature") != temperature):
+        print("[ERROR] Checkpoint belongs to a different input list, model version, format or "
+              "calibration temperature - pass --restart to overwrite")
+        return 1
+    if state is not None and not output_intact(args.output, fmt, state):
+        print(f"[WARNING] {args.output} is missing rows the checkpoint counts as done - scoring everything again")
+        state = None
+    done = state["done"] if state else 0
+    if done >= len(paths):
+        print(f"[INFO] All {len(paths)} images already scored ({args.output})")
+        return 0
+    if done:
+        print(f"[INFO] Resuming at image {done} of {len(paths)}")
+
+    registry = ModelRegistry(backend_loader(batching=False, backend=args.backend))
+    loaded = registry.load(args.version)
+    class_names = loaded.class_names
+    columns = ["path", "model_version", "disease", "probability", "error"] + class_names
+
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("[ERROR] Parquet output needs pyarrow (pip install pyarrow)")
+            return 1
+        writer = ParquetWriter(args.output, columns, args.rows_per_part,
+                               resume_parts=state["writer"]["parts"] if state else None)
+        # Rows buffered but not yet in a part were lost with the previous run
+        done -= state["writer"]["buffered"] if state else 0
+    else:
+        writer = RowWriter(args.output, fmt, columns, resume_offset=state["writer"]["offset"] if state else None)
+
+    pipeline = args.pipeline
+    if pipeline == "auto":
+        try:
+            import tensorflow  # noqa: F401
+            pipeline = "tf"
+        except ImportError:
+            pipeline = "threads"
+    remaining = paths[done:]
+    batches = (tf_batches if pipeline == "tf" else thread_batches)(remaining, args.batch_size, args.workers)
+
+    print(f"[INFO] Scoring {len(remaining)} images with v{loaded.version} (T={temperature:g}, "
+          f"batch {args.batch_size}, {pipeline} pipeline) -> {args.output}")
+    started = time.perf_counter()
+    scored = errors = 0
+    try:
+        for images, batch_errors in batches:
+            batch_paths = remaining[scored:scored + len(images)]
+            probabilities = calibration.calibrate(np.asarray(loaded.predict(images)), temperature)
+            writer.write(build_rows(batch_paths, probabilities, batch_errors, class_names, loaded.version))
+            scored += len(images)
+            errors += sum(1 for e in batch_errors if e)
+
+            checkpoint.save({"inputs": digest, "version": loaded.version, "format": fmt, "temperature": temperature,
+                             "done": done + scored, "total": len(paths), "writer": writer.flush()})
+            elapsed = time.perf_counter() - started
+            rate = scored / elapsed if elapsed else 0.0
+            eta = (len(remaining) - scored) / rate if rate else 0.0
+            print(f"\r[INFO] {done + scored}/{len(paths)} images, {rate:.1f} img/s, ETA {eta / 60:.1f} min",
+                  end="", flush=True)
+        checkpoint.save({"inputs": digest, "version": loaded.version, "format": fmt, "temperature": temperature,
+                         "done": len(paths), "total": len(paths), "writer": writer.flush(final=True)})
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrupted - rerun the same command to resume")
+        return 130
+    finally:
+        writer.close()
+    print()
+
+    elapsed = time.perf_counter() - started
+    print(f"[SUCCESS] Scored {scored} images in {elapsed:.1f}s ({scored / elapsed:.1f} img/s), "
+          f"{errors} unreadable")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
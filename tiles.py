@@ -0,0 +1,184 @@
+"""Tiled analysis: overlapping model-size windows over a high-resolution photo
+
+The image is decoded at the largest size whose grid of overlapping 224 px
+tiles fits within ``max_tiles``. So the tile cap, not the camera, sets the
+working resolution, and JPEGs still decode in draft mode. Tiles are cut
+from the decoded pixels without resizing and classified in large batches.
+They run in checkerboard order, so a run cut short by the time budget
+still covers the whole leaf.
+
+Combining tiles: tiles the model is unsure about (top probability below
+TILES_MIN_CONFIDENCE, typically background or out-of-distribution crops)
+are dropped first. The rest are ranked by lesion evidence (1 - P(Healthy))
+and the leaf verdict is a trimmed, evidence-weighted mean of the top
+TILES_TOP_FRACTION of them (at least MIN_TOP_TILES), leaving out the
+TILES_TRIM most extreme tiles. A lesion spread over several tiles is not
+outvoted by the healthy leaf around it, but a single odd tile cannot flip a
+healthy leaf. The heatmap grid holds each tile's lesion evidence; tiles
+that were not analysed are null.
+"""
+
+import io
+import math
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import preprocessing
+
+TILE_SIZE = preprocessing.IMAGE_SIZE[0]
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", 0.25))
+TILES_MAX = int(os.environ.get("TILES_MAX", 64))
+TILES_BATCH_SIZE = int(os.environ.get("TILES_BATCH_SIZE", 16))
+TILES_BUDGET_MS = float(os.environ.get("TILES_BUDGET_MS", 3000))
+TILES_TOP_FRACTION = float(os.environ.get("TILES_TOP_FRACTION", 0.25))
+TILES_TRIM = int(os.environ.get("TILES_TRIM", 1))
+TILES_MIN_CONFIDENCE = float(os.environ.get("TILES_MIN_CONFIDENCE", 0.5))
+MIN_TOP_TILES = 3
+HEALTHY_CLASS = "Healthy"
+# Keeps the weights positive when every tile is confidently healthy
+MIN_WEIGHT = 1e-3
+
+
+def parse_tiles(value):
+    """Tile cap from a request value: empty/"0"/"false" -> None (off), "1"/"true" -> TILES_MAX
+
+    A single tile would just be the plain prediction, so "1" switches tiling on.
+    """
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return TILES_MAX
+    try:
+        tiles = int(value)
+    except ValueError:
+        raise ValueError(f"tiles must be a maximum tile count (2-{TILES_MAX}) or true/false")
+    if tiles < 2:
+        raise ValueError(f"tiles must be between 2 and {TILES_MAX}")
+    return min(tiles, TILES_MAX)
+
+
+def _count(length, stride, tile=TILE_SIZE):
+    return 1 if length <= tile else math.ceil((length - tile) / stride) + 1
+
+
+def working_size(width, height, max_tiles, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(width, height, columns, rows) of the largest downscale whose tile grid fits max_tiles
+
+    Never upscales beyond what is needed to make the short side one tile.
+    """
+    stride = max(1, int(tile * (1.0 - overlap)))
+    # The short side is at least one tile
+    floor = tile / min(width, height)
+    low, high = min(floor, 1.0), max(floor, 1.0)
+    if _count(round(width * high), stride) * _count(round(height * high), stride) > max_tiles:
+        for _ in range(30):
+            mid = (low + high) / 2.0
+            if _count(round(width * mid), stride) * _count(round(height * mid), stride) <= max_tiles:
+                low = mid
+            else:
+                high = mid
+        scale = low
+    else:
+        scale = high
+    w, h = max(tile, round(width * scale)), max(tile, round(height * scale))
+    return w, h, _count(w, stride), _count(h, stride)
+
+
+def _positions(length, count, tile=TILE_SIZE):
+    """Evenly spaced tile offsets with the last tile flush with the edge"""
+    if count == 1:
+        return [max(0, (length - tile) // 2)]
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def checkerboard_order(rows, cols):
+    """Grid cells ordered so every prefix is spread over the whole grid"""
+    cells = [(r, c) for r in range(rows) for c in range(cols)]
+    return sorted(cells, key=lambda rc: (rc[0] % 2, rc[1] % 2, rc[0] // 2, rc[1] // 2))
+
+
+def combine(probabilities, class_names, top_fraction=TILES_TOP_FRACTION, trim=TILES_TRIM,
+            min_confidence=TILES_MIN_CONFIDENCE):
+    """Leaf-level probability vector from (N, classes) tile probabilities"""
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    confident = probabilities.max(axis=1) >= min_confidence
+    if confident.any():
+        probabilities = probabilities[confident]
+    if HEALTHY_CLASS not in class_names:
+        return probabilities.mean(axis=0)
+    evidence = np.maximum(1.0 - probabilities[:, class_names.index(HEALTHY_CLASS)], MIN_WEIGHT)
+    count = min(len(evidence), max(MIN_TOP_TILES, math.ceil(len(evidence) * top_fraction)))
+    top = np.argsort(-evidence, kind="stable")[min(max(0, trim), count - 1):count]
+    weights = evidence[top]
+    return (weights[:, None] * probabilities[top]).sum(axis=0) / weights.sum()
+
+
+def analyze(data, predict, class_names, max_tiles=None, batch_size=None, budget_ms=None,
+            scale=preprocessing.MODEL_INPUT_SCALE, timer=None):
+    """Classify overlapping tiles of an image given as bytes
+
+    ``predict(batch)`` returns (N, classes) probabilities. Returns (leaf
+    probabilities, summary for the response). Stops starting new batches
+    once ``budget_ms`` has elapsed; the summary then has complete=False.
+    """
+    max_tiles = max_tiles or TILES_MAX
+    batch_size = batch_size or TILES_BATCH_SIZE
+    budget_ms = TILES_BUDGET_MS if budget_ms is None else budget_ms
+    started = time.perf_counter()
+    with preprocessing._stage(timer, "decode"):
+        with Image.open(io.BytesIO(data)) as probe:
+            original = probe.size  # header only; open_image checks the pixel limit
+    width, height, cols, rows = working_size(*original, max_tiles)
+    img = preprocessing.open_image(data, size=(width, height), timer=timer)
+    with preprocessing._stage(timer, "resize"):
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.Resampling.BICUBIC)
+        pixels = np.asarray(img)
+
+    xs, ys = _positions(width, cols), _positions(height, rows)
+    order = checkerboard_order(rows, cols)
+    batch = preprocessing.allocate_batch(min(batch_size, len(order)))
+    tile_probabilities = np.full((rows, cols, len(class_names)), np.nan, dtype=np.float32)
+    analysed = 0
+    for start in range(0, len(order), batch_size):
+        if analysed and (time.perf_counter() - started) * 1000.0 > budget_ms:
+            break
+        cells = order[start:start + batch_size]
+        with preprocessing._stage(timer, "normalize"):
+            for i, (r, c) in enumerate(cells):
+                np.multiply(pixels[ys[r]:ys[r] + TILE_SIZE, xs[c]:xs[c] + TILE_SIZE], scale, out=batch[i],
+                            casting="unsafe")
+        with preprocessing._stage(timer, "model"):
+            output = np.asarray(predict(batch[:len(cells)]))
+        for (r, c), probs in zip(cells, output):
+            tile_probabilities[r, c] = probs
+        analysed += len(cells)
+
+    done = ~np.isnan(tile_probabilities[..., 0])
+    leaf = combine(tile_probabilities[done], class_names)
+    if HEALTHY_CLASS in class_names:
+        evidence = 1.0 - tile_probabilities[..., class_names.index(HEALTHY_CLASS)]
+    else:
+        evidence = 1.0 - tile_probabilities.max(axis=-1)
+    top = np.nan_to_num(tile_probabilities, nan=-1.0).argmax(axis=-1)
+    summary = {
+        "tiles": int(rows * cols),
+        "analysed": analysed,
+        "complete": analysed == rows * cols,
+        "grid": [rows, cols],
+        "tile_size": TILE_SIZE,
+        "image_size": list(original),
+        "working_size": [width, height],
+        "elapsed_ms": (time.perf_counter() - started) * 1000.0,
+        "heatmap": [[float(evidence[r, c]) if done[r, c] else None for c in range(cols)] for r in range(rows)],
+        "labels": [[class_names[int(top[r, c])] if done[r, c] else None for c in range(cols)] for r in range(rows)],
+        "max_tile_probability": {name: float(tile_probabilities[done][:, i].max())
+                                 for i, name in enumerate(class_names)},
+    }
+    return leaf, summary
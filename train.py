@@ -0,0 +1,203 @@
+"""Two-phase Swin-Tiny training (the notebook's recipe) on the pre-decoded store
+
+    python train.py --data-dir path/to/MangoDisease
+    python train.py --data-dir path/to/MangoDisease --benchmark-input 3 [--legacy]
+
+Phase 1 trains the head with the backbone frozen (Adam 1e-4). Phase 2
+unfreezes the last 30 backbone layers (Adam 5e-5). Both phases use
+ReduceLROnPlateau and EarlyStopping as before. Images come from the
+training_data store as uint8 batches. The model casts them and applies the
+augmentation layers batched, on the device. Only the classifier, with no
+augmentation layers, is saved to saved_models/<next version>/ along with
+metadata.json, in the same layout the notebook wrote.
+
+Each epoch prints its training throughput in images/sec.
+--benchmark-input times the input pipeline alone; add --legacy to time the
+notebook's image_dataset_from_directory pipeline for comparison.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import tensorflow as tf
+from tensorflow.keras import layers
+
+import model_registry
+import training_data
+from inference_backends import build_swin_classifier
+
+IMAGE_SIZE = training_data.IMAGE_SIZE
+FINE_TUNE_LAYERS = 30
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Print and log training images/sec per epoch (validation time excluded)"""
+
+    def __init__(self, images_per_epoch, phase):
+        super().__init__()
+        self.images_per_epoch = images_per_epoch
+        self.phase = phase
+        self.rates = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+        self.train_finished = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.train_finished = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        finished = time.perf_counter()
+        train_seconds = (self.train_finished or finished) - self.started
+        rate = self.images_per_epoch / max(train_seconds, 1e-9)
+        self.rates.append(rate)
+        if logs is not None:
+            logs["images_per_sec"] = rate
+        print(f"[INFO] {self.phase} epoch {epoch + 1}: {rate:.1f} img/s "
+              f"({train_seconds:.1f}s training, {finished - self.started:.1f}s with validation)")
+
+
+def build_augmentation():
+    """The notebook's augmentation, applied to float 0-255 batches"""
+    return tf.keras.Sequential([
+        layers.RandomFlip("horizontal_and_vertical"),
+        layers.RandomRotation(0.2),
+        layers.RandomZoom(0.2),
+        layers.RandomContrast(0.2),
+        layers.RandomBrightness(0.1),
+    ], name="data_augmentation")
+
+
+def build_trainer(classifier):
+    """uint8 input -> float32 -> augmentation (training only) -> classifier"""
+    inputs = tf.keras.Input(shape=(*IMAGE_SIZE, 3), dtype="uint8", name="image")
+    x = tf.keras.ops.cast(inputs, "float32")
+    x = build_augmentation()(x)
+    return tf.keras.Model(inputs, classifier(x), name="trainer")
+
+
+def training_callbacks():
+    return [
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=2, min_lr=1e-7, verbose=1),
+        tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=3, restore_best_weights=True, verbose=1),
+    ]
+
+
+def run_phase(trainer, train_ds, val_ds, train_count, epochs, learning_rate, phase):
+    trainer.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                    loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    throughput = ThroughputCallback(train_count, phase)
+    print(f"\n[TRAINING] {phase}: {epochs} epochs, lr={learning_rate}")
+    history = trainer.fit(train_ds, validation_data=val_ds, epochs=epochs,
+                          callbacks=training_callbacks() + [throughput], verbose=1)
+    print(f"[SUCCESS] {phase} completed")
+    return history, throughput.rates
+
+
+def benchmark_input(dataset, epochs, label):
+    """Iterate a dataset without a model and print images/sec per epoch"""
+    for epoch in range(epochs):
+        started = time.perf_counter()
+        images = 0
+        for batch_images, _ in dataset:
+            images += int(batch_images.shape[0])
+        elapsed = time.perf_counter() - started
+        print(f"[INFO] {label} input epoch {epoch + 1}: {images / max(elapsed, 1e-9):.1f} img/s "
+              f"({images} images in {elapsed:.1f}s)")
+
+
+def save_model(classifier, metadata, root=model_registry.MODELS_ROOT):
+    """Write model.keras, weights and metadata.json to the next saved_models version"""
+    os.makedirs(root, exist_ok=True)
+    version = int(model_registry.latest_version(root) or 0) + 1
+    save_path = os.path.join(root, str(version))
+    os.makedirs(save_path, exist_ok=True)
+    classifier.save(os.path.join(save_path, "model.keras"))
+    classifier.save_weights(os.path.join(save_path, "model_weights.weights.h5"))
+    with open(os.path.join(save_path, "metadata.json"), "w") as f:
+        json.dump({**metadata, "model_version": version}, f, indent=4)
+    print(f"[SUCCESS] Model v{version} saved to {save_path}")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the Swin-Tiny mango leaf classifier")
+    parser.add_argument("--data-dir", required=True, help="Dataset root, one subfolder per class")
+    parser.add_argument("--store", help="Decoded image store (default: data_cache/<dataset name>)")
+    parser.add_argument("--rebuild-store", action="store_true", help="Decode again even if the store is current")
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads while building the store")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--epochs", type=int, default=30, help="Phase 1 epochs (frozen backbone)")
+    parser.add_argument("--fine-tune-epochs", type=int, default=30, help="Phase 2 epochs")
+    parser.add_argument("--validation-split", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--benchmark-input", type=int, metavar="EPOCHS", default=0,
+                        help="Only time the input pipeline for this many epochs")
+    parser.add_argument("--legacy", action="store_true",
+                        help="With --benchmark-input: time image_dataset_from_directory instead")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    if args.benchmark_input and args.legacy:
+        train_ds, _ = training_data.legacy_datasets(args.data_dir, args.batch_size, args.validation_split, args.seed)
+        benchmark_input(train_ds, args.benchmark_input, "legacy")
+        return
+
+    store = args.store or os.path.join("data_cache", os.path.basename(os.path.normpath(args.data_dir)))
+    manifest = training_data.build_store(args.data_dir, store, IMAGE_SIZE, args.validation_split, args.seed,
+                                         workers=args.workers, rebuild=args.rebuild_store)
+    class_names = manifest["class_names"]
+    train_ds, val_ds, train_count, val_count = training_data.make_datasets(store, args.batch_size, seed=args.seed)
+    print(f"[INFO] {train_count} training / {val_count} validation images, {len(class_names)} classes")
+
+    if args.benchmark_input:
+        benchmark_input(train_ds, args.benchmark_input, "store")
+        return
+
+    classifier, backbone = build_swin_classifier(len(class_names), backbone_weights="imagenet", l2=1e-4,
+                                                 return_backbone=True)
+    trainer = build_trainer(classifier)
+
+    backbone.trainable = False
+    history1, rates1 = run_phase(trainer, train_ds, val_ds, train_count, args.epochs, 1e-4, "Phase 1")
+
+    backbone.trainable = True
+    for layer in backbone.layers[:-FINE_TUNE_LAYERS]:
+        layer.trainable = False
+    history2, rates2 = run_phase(trainer, train_ds, val_ds, train_count, args.fine_tune_epochs, 5e-5, "Phase 2")
+
+    _, test_acc = trainer.evaluate(val_ds, verbose=0)
+    print(f"[RESULTS] Validation accuracy: {test_acc * 100:.2f}%")
+    if args.no_save:
+        return
+
+    metadata = {
+        "model_name": "SwinTransformer_Tiny_MangoDiseaseClassifier",
+        "model_type": "Swin Transformer Tiny (Transfer Learning)",
+        "num_classes": len(class_names),
+        "class_names": class_names,
+        "image_size": list(IMAGE_SIZE),
+        "epochs_phase1": args.epochs,
+        "epochs_phase2": args.fine_tune_epochs,
+        "batch_size": args.batch_size,
+        "validation_split": manifest["validation_split"],
+        "seed": manifest["seed"],
+        "split_method": manifest["split_method"],
+        "phase1_train_acc": float(history1.history['accuracy'][-1]),
+        "phase1_val_acc": float(history1.history['val_accuracy'][-1]),
+        "phase2_train_acc": float(history2.history['accuracy'][-1]),
+        "phase2_val_acc": float(history2.history['val_accuracy'][-1]),
+        "final_train_acc": float(history2.history['accuracy'][-1]),
+        "final_val_acc": float(history2.history['val_accuracy'][-1]),
+        "test_acc": float(test_acc),
+        "images_per_sec": {"phase1": rates1, "phase2": rates2},
+        "training_method": "Two-phase training (frozen backbone + fine-tuning) with on-device augmentation "
+                           "from a pre-decoded uint8 store",
+    }
+    save_model(classifier, metadata)
+
+
+if __name__ == "__main__":
+    main()
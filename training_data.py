@@ -0,0 +1,205 @@
+"""Pre-decoded training data: a uint8 memmap store and tf.data pipelines
+
+Every image is decoded and resized once into <store>/train.u8.npy and
+<store>/val.u8.npy, which are (N, 224, 224, 3) uint8 arrays opened as
+memmaps (150 KB per image). A training epoch then only gathers rows. The
+labels sit next to them as .npy files, and manifest.json is written last.
+The store is reused while the source folder (file names, sizes, mtimes),
+image size, split and seed are unchanged.
+
+The train/validation split is the one image_dataset_from_directory makes
+for the same validation_split and seed: the same file list (Keras's image
+formats, walked in its order), shuffled with np.random.RandomState(seed),
+with the last int(validation_split * N) files held out. The method is
+recorded as SPLIT_METHOD in the manifest and the model's metadata.json.
+
+The pipelines yield uint8 batches: shuffled row indices are gathered
+batch-wise with a parallel map, validation batches are cached, and both
+are prefetched. Casting and augmentation happen inside the training model
+(see train.py), so they run batched on the accelerator and the host ships
+4x fewer bytes than float32.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import preprocessing
+IMAGE_SIZE = preprocessing.IMAGE_SIZE
+STORE_FORMAT = 2
+# The formats image_dataset_from_directory lists
+KERAS_IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png")
+SPLIT_METHOD = "keras_image_dataset_from_directory"
+
+
+def scan_dataset(data_dir):
+    """(class names, [(path, label)]) for a class-per-subfolder dataset
+
+    Class order, file order and image formats are those of
+    image_dataset_from_directory: sorted subfolder names, then each class's
+    walk sorted by directory and file name.
+    """
+    class_names = sorted(name for name in os.listdir(data_dir)
+                         if os.path.isdir(os.path.join(data_dir, name)))
+    items = []
+    for label, name in enumerate(class_names):
+        for root, _, files in sorted(os.walk(os.path.join(data_dir, name))):
+            for file in sorted(files):
+                if file.lower().endswith(KERAS_IMAGE_EXTENSIONS):
+                    items.append((os.path.join(root, file), label))
+    return class_names, items
+
+
+def split_items(items, validation_split=0.2, seed=123):
+    """(train, validation) lists, split exactly as image_dataset_from_directory does"""
+    shuffled = list(items)
+    np.random.RandomState(seed).shuffle(shuffled)
+    val_count = int(validation_split * len(shuffled))
+    return shuffled[:len(shuffled) - val_count], shuffled[len(shuffled) - val_count:]
+
+
+def fingerprint(data_dir, items, image_size, validation_split, seed):
+    """Hash of everything that changes the store contents"""
+    digest = hashlib.sha256(json.dumps([list(image_size), validation_split, seed, STORE_FORMAT]).encode())
+    for path, label in items:
+        stat = os.stat(path)
+        digest.update(f"{os.path.relpath(path, data_dir)}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def decode_into(path, out, image_size=IMAGE_SIZE):
+    """Decode one image into a (height, width, 3) uint8 row (bilinear, like the notebook)"""
+    img = preprocessing.open_image(path, size=image_size)
+    if img.size != tuple(image_size):
+        img = img.resize(image_size, Image.Resampling.BILINEAR)
+    out[...] = np.asarray(img, dtype=np.uint8)
+
+
+def _write_split(store_dir, name, items, image_size, workers):
+    """Decode items into <name>.u8.npy / <name>_labels.npy; failed images get label -1"""
+    width, height = image_size
+    images = np.lib.format.open_memmap(os.path.join(store_dir, f"{name}.u8.npy"), mode="w+",
+                                       dtype=np.uint8, shape=(len(items), height, width, 3))
+    labels = np.array([label for _, label in items], dtype=np.int32)
+    failed = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="store-decode") as executor:
+        futures = [executor.submit(decode_into, path, images[i], image_size)
+                   for i, (path, _) in enumerate(items)]
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                labels[i] = -1
+                failed.append(items[i][0])
+                print(f"[WARNING] Skipping {items[i][0]}: {e}")
+            if (i + 1) % 500 == 0:
+                print(f"[INFO] {name}: {i + 1}/{len(items)} decoded")
+    images.flush()
+    del images
+    np.save(os.path.join(store_dir, f"{name}_labels.npy"), labels)
+    elapsed = time.perf_counter() - started
+    print(f"[SUCCESS] {name}: {len(items) - len(failed)} images in {elapsed:.1f}s "
+          f"({len(items) / max(elapsed, 1e-9):.0f} img/s)")
+    return failed
+
+
+def build_store(data_dir, store_dir, image_size=IMAGE_SIZE, validation_split=0.2, seed=123,
+                workers=None, rebuild=False):
+    """Decode the dataset into ``store_dir`` unless an up-to-date store exists; returns the manifest"""
+    class_names, items = scan_dataset(data_dir)
+    if not items:
+        raise ValueError(f"No images found under {data_dir}")
+    key = fingerprint(data_dir, items, image_size, validation_split, seed)
+    manifest_path = os.path.join(store_dir, "manifest.json")
+    if not rebuild and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("fingerprint") == key:
+            print(f"[INFO] Reusing decoded store {store_dir} ({manifest['train_count']} train, "
+                  f"{manifest['val_count']} val)")
+            return manifest
+
+    os.makedirs(store_dir, exist_ok=True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # the store is incomplete until the new manifest lands
+    train_items, val_items = split_items(items, validation_split, seed)
+    workers = workers or min(8, os.cpu_count() or 1)
+    print(f"[INFO] Decoding {len(items)} images into {store_dir} with {workers} threads...")
+    failed = _write_split(store_dir, "train", train_items, image_size, workers)
+    failed += _write_split(store_dir, "val", val_items, image_size, workers)
+
+    manifest = {
+        "format": STORE_FORMAT,
+        "fingerprint": key,
+        "data_dir": os.path.abspath(data_dir),
+        "class_names": class_names,
+        "image_size": list(image_size),
+        "validation_split": validation_split,
+        "seed": seed,
+        "split_method": SPLIT_METHOD,
+        "train_count": len(train_items),
+        "val_count": len(val_items),
+        "failed": failed,
+    }
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def open_split(store_dir, name):
+    """(uint8 images memmap, int32 labels, row indices of decodable images)"""
+    images = np.load(os.path.join(store_dir, f"{name}.u8.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(store_dir, f"{name}_labels.npy"))
+    return images, labels, np.flatnonzero(labels >= 0)
+
+
+def _gather_dataset(tf, images, labels, indices_ds):
+    """Map batches of row indices to (uint8 images, labels) with a parallel gather"""
+    _, height, width, channels = images.shape
+
+    def gather(rows):
+        rows = np.sort(rows)  # sequential reads; order within a batch does not matter
+        return images[rows], labels[rows]
+
+    def gather_tf(rows):
+        batch_images, batch_labels = tf.numpy_function(gather, [rows], [tf.uint8, tf.int32])
+        batch_images.set_shape((None, height, width, channels))
+        batch_labels.set_shape((None,))
+        return batch_images, batch_labels
+
+    return indices_ds.map(gather_tf, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+
+
+def make_datasets(store_dir, batch_size, seed=None):
+    """(train dataset, validation dataset, train count, validation count) of uint8 batches"""
+    import tensorflow as tf
+
+    train_images, train_labels, train_rows = open_split(store_dir, "train")
+    val_images, val_labels, val_rows = open_split(store_dir, "val")
+
+    train_ds = (tf.data.Dataset.from_tensor_slices(train_rows)
+                .shuffle(len(train_rows), seed=seed, reshuffle_each_iteration=True)
+                .batch(batch_size))
+    train_ds = _gather_dataset(tf, train_images, train_labels, train_ds).prefetch(tf.data.AUTOTUNE)
+
+    # Fixed order, so the gathered batches are cached after the first epoch
+    val_ds = tf.data.Dataset.from_tensor_slices(val_rows).batch(batch_size)
+    val_ds = _gather_dataset(tf, val_images, val_labels, val_ds).cache().prefetch(tf.data.AUTOTUNE)
+    return train_ds, val_ds, len(train_rows), len(val_rows)
+
+
+def legacy_datasets(data_dir, batch_size, validation_split=0.2, seed=123):
+    """The notebook's image_dataset_from_directory pipeline, for --benchmark-input comparisons"""
+    import tensorflow as tf
+
+    common = dict(image_size=IMAGE_SIZE, batch_size=batch_size, validation_split=validation_split, seed=seed)
+    train_ds = tf.keras.preprocessing.image_dataset_from_directory(data_dir, subset="training", **common)
+    val_ds = tf.keras.preprocessing.image_dataset_from_directory(data_dir, subset="validation", **common)
+    return train_ds.prefetch(tf.data.AUTOTUNE), val_ds.prefetch(tf.data.AUTOTUNE)
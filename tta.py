@@ -0,0 +1,95 @@
+"""Test-time augmentation: several views of one image in a single forward pass
+
+Views are cut from the decoded RGB image before it is resized to the model
+input, so crops keep their detail, and every view is written into one
+preallocated batch. The identity view comes first and the cheap symmetric
+views next, so ``n_views=1`` is exactly the plain prediction.
+"""
+
+import numpy as np
+from PIL import Image
+
+import preprocessing
+
+VIEW_NAMES = ("original", "hflip", "vflip", "rotate+10", "rotate-10",
+              "center", "top_left", "top_right", "bottom_left", "bottom_right")
+MAX_VIEWS = len(VIEW_NAMES)
+
+# Crops keep this fraction of each side; rotations are cropped too so the
+# filled-in corners stay out of the view
+CROP_FRACTION = 0.875
+ROTATION_DEGREES = 10
+
+# Decode size for open_image's draft mode, large enough that crops are not upscaled
+DECODE_SIZE = tuple(int(side / CROP_FRACTION) + 1 for side in preprocessing.IMAGE_SIZE)
+
+
+def parse_views(value):
+    """Number of views from a request value: empty/"0"/"false" -> 1, "true" -> MAX_VIEWS"""
+    if value is None:
+        return 1
+    value = str(value).strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return 1
+    if value in ("true", "yes", "on"):
+        return MAX_VIEWS
+    try:
+        views = int(value)
+    except ValueError:
+        raise ValueError(f"tta must be a number of views (1-{MAX_VIEWS}) or true/false")
+    if views < 1:
+        raise ValueError(f"tta must be between 1 and {MAX_VIEWS}")
+    return min(views, MAX_VIEWS)
+
+
+def _crop(img, name):
+    width, height = img.size
+    crop_w, crop_h = int(width * CROP_FRACTION), int(height * CROP_FRACTION)
+    if name == "top_left":
+        left, top = 0, 0
+    elif name == "top_right":
+        left, top = width - crop_w, 0
+    elif name == "bottom_left":
+        left, top = 0, height - crop_h
+    elif name == "bottom_right":
+        left, top = width - crop_w, height - crop_h
+    else:
+        left, top = (width - crop_w) // 2, (height - crop_h) // 2
+    return img.crop((left, top, left + crop_w, top + crop_h))
+
+
+def view(img, name):
+    """One named view of an RGB image"""
+    if name == "original":
+        return img
+    if name == "hflip":
+        return img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if name == "vflip":
+        return img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+    if name in ("rotate+10", "rotate-10"):
+        degrees = ROTATION_DEGREES if name == "rotate+10" else -ROTATION_DEGREES
+        return _crop(img.rotate(degrees, resample=Image.Resampling.BILINEAR), "center")
+    return _crop(img, name)
+
+
+def build_views(img, n_views, scale=preprocessing.MODEL_INPUT_SCALE, resample=Image.Resampling.BICUBIC,
+                timer=None):
+    """Return (view names, (n_views, height, width, 3) float32 batch) for one image"""
+    names = VIEW_NAMES[:max(1, min(int(n_views), MAX_VIEWS))]
+    batch = preprocessing.allocate_batch(len(names))
+    for i, name in enumerate(names):
+        preprocessing.preprocess_into(view(img, name), batch[i], scale=scale, resample=resample, timer=timer)
+    return names, batch
+
+
+def aggregate(view_probabilities):
+    """Average per-view probabilities
+
+    Returns (mean probability vector, agreement, per-view top-1 indices);
+    agreement is the fraction of views whose top-1 matches the averaged top-1.
+    """
+    view_probabilities = np.asarray(view_probabilities, dtype=np.float32)
+    mean = view_probabilities.mean(axis=0)
+    view_top = view_probabilities.argmax(axis=1)
+    agreement = float((view_top == int(mean.argmax())).mean())
+    return mean, agreement, view_top
@@ -0,0 +1,118 @@
+"""Bounded reading of uploaded images with early rejection
+
+Uploads are read in chunks up to MAX_UPLOAD_BYTES. The first bytes are
+sniffed for a supported image signature, and the image dimensions are read
+from the header while the rest of the body is still arriving. Non-images
+and oversized images are therefore refused before the full body is read,
+and always before any pixel buffer is allocated.
+
+    MAX_UPLOAD_BYTES   cap per image (default 20 MiB)
+    MAX_REQUEST_BYTES  cap per request body, incl. zip/tar uploads (default 256 MiB)
+"""
+
+import io
+import os
+
+from PIL import Image
+
+from preprocessing import MAX_IMAGE_PIXELS, ImageTooLargeError
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 256 * 1024 * 1024))
+
+# Multipart boundaries, headers and small form fields around a single file
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+CHUNK_BYTES = 64 * 1024
+# Stop trying to read dimensions after this much (EXIF blocks can be large)
+HEADER_PROBE_BYTES = 256 * 1024
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"BM", "BMP"),
+)
+
+
+class UploadRejected(ValueError):
+    """An upload refused before decoding; ``status`` is the HTTP status"""
+    status = 400
+    reason = "rejected"
+
+
+class UploadTooLargeError(UploadRejected):
+    status = 413
+    reason = "too_large"
+
+
+class UnsupportedImageError(UploadRejected):
+    status = 415
+    reason = "unsupported_type"
+
+
+def sniff(head):
+    """Image format from the first bytes (JPEG, PNG, BMP, WEBP) or None"""
+    for signature, name in SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def probe_dimensions(head):
+    """(width, height) from a possibly incomplete image header, or None"""
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def check_dimensions(size, max_pixels=MAX_IMAGE_PIXELS):
+    width, height = size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(f"Image is {width}x{height} pixels, limit is {max_pixels} pixels")
+
+
+def read_image(stream, max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS, size_hint=None):
+    """Read one uploaded image from a file-like object and return its bytes
+
+    Raises UploadTooLargeError past ``max_bytes`` (or when ``size_hint``, e.g.
+    a zip member's size, already exceeds it), UnsupportedImageError when the
+    bytes are not a supported image, and ImageTooLargeError when the header
+    declares more than ``max_pixels``.
+    """
+    if size_hint is not None and max_bytes and size_hint > max_bytes:
+        raise UploadTooLargeError(f"Image is {size_hint} bytes, limit is {max_bytes} bytes")
+    chunks, total = [], 0
+    image_format = dimensions = None
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise UploadTooLargeError(f"Image is larger than the {max_bytes} byte limit")
+        chunks.append(chunk)
+        if dimensions is None and total <= HEADER_PROBE_BYTES:
+            head = b"".join(chunks)
+            if image_format is None and len(head) >= 12:
+                image_format = sniff(head)
+                if image_format is None:
+                    raise UnsupportedImageError("Upload is not a JPEG, PNG, BMP or WebP image")
+            dimensions = probe_dimensions(head)
+            if dimensions is not None:
+                check_dimensions(dimensions, max_pixels)
+    if not chunks:
+        raise UnsupportedImageError("Upload is empty")
+    data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    if image_format is None and sniff(data) is None:
+        raise UnsupportedImageError("Upload is not a JPEG, PNG, BMP or WebP image")
+    if dimensions is None:
+        dimensions = probe_dimensions(data)
+        if dimensions is None:
+            raise UnsupportedImageError(f"Upload looks like a {image_format or sniff(data)} image "
+                                        "but its header is unreadable")
+        check_dimensions(dimensions, max_pixels)
+    return data